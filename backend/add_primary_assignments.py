@@ -32,28 +32,28 @@ async def create_primary_subjects():
             "name": "Mathématiques (Primaire)",
             "name_en": "Mathematics (Primary)",
             "branch_id": primaire["id"],
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": "primaire_francais",
             "name": "Français (Primaire)",
             "name_en": "French (Primary)",
             "branch_id": primaire["id"],
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": "primaire_eveil",
             "name": "Éveil Scientifique",
             "name_en": "Science Discovery",
             "branch_id": primaire["id"],
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": "primaire_dessin",
             "name": "Dessin et Arts",
             "name_en": "Drawing and Arts",
             "branch_id": primaire["id"],
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
     ]
     
@@ -84,7 +84,7 @@ async def create_primary_teacher():
         "bio": "Institutrice avec 15 ans d'expérience en primaire. J'adore enseigner aux enfants!",
         "establishment": "École Primaire Diamniadio",
         "is_validated": True,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     existing = await db.users.find_one({"email": teacher["email"]})
@@ -128,7 +128,7 @@ async def create_primary_students():
             "objectives": "Apprendre à bien lire et compter",
             "establishment": "École Primaire Diamniadio",
             "is_validated": True,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": str(uuid.uuid4()),
@@ -141,7 +141,7 @@ async def create_primary_students():
             "objectives": "Devenir excellente en maths",
             "establishment": "École Primaire Diamniadio",
             "is_validated": True,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": str(uuid.uuid4()),
@@ -154,7 +154,7 @@ async def create_primary_students():
             "objectives": "Préparer mon entrée au collège",
             "establishment": "École Primaire Diamniadio",
             "is_validated": True,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
     ]
     
@@ -199,9 +199,9 @@ async def create_primary_assignments(teacher, primaire, subjects):
         "level_id": levels[2]["id"] if len(levels) > 2 else levels[0]["id"],  # CE1
         "teacher_id": teacher["id"],
         "assignment_type": "quiz",
-        "due_date": (datetime.now(timezone.utc) + timedelta(days=5)).isoformat(),
+        "due_date": (datetime.now(timezone.utc) + timedelta(days=5)),
         "allow_files": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     questions1 = [
@@ -213,7 +213,7 @@ async def create_primary_assignments(teacher, primaire, subjects):
             "options": ["6", "7", "8", "9"],
             "correct_answer": "8",
             "points": 2,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": str(uuid.uuid4()),
@@ -223,7 +223,7 @@ async def create_primary_assignments(teacher, primaire, subjects):
             "options": ["18", "19", "20", "21"],
             "correct_answer": "20",
             "points": 2,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": str(uuid.uuid4()),
@@ -233,7 +233,7 @@ async def create_primary_assignments(teacher, primaire, subjects):
             "options": ["14", "15", "16", "17"],
             "correct_answer": "16",
             "points": 2,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
     ]
     
@@ -247,9 +247,9 @@ async def create_primary_assignments(teacher, primaire, subjects):
         "level_id": levels[3]["id"] if len(levels) > 3 else levels[0]["id"],  # CE2
         "teacher_id": teacher["id"],
         "assignment_type": "submission",
-        "due_date": (datetime.now(timezone.utc) + timedelta(days=10)).isoformat(),
+        "due_date": (datetime.now(timezone.utc) + timedelta(days=10)),
         "allow_files": True,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     # Assignment 3: Quiz Maths CM1 - Les multiplications
@@ -263,9 +263,9 @@ async def create_primary_assignments(teacher, primaire, subjects):
         "level_id": levels[4]["id"] if len(levels) > 4 else levels[0]["id"],  # CM1
         "teacher_id": teacher["id"],
         "assignment_type": "quiz",
-        "due_date": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
+        "due_date": (datetime.now(timezone.utc) + timedelta(days=7)),
         "allow_files": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     questions3 = [
@@ -277,7 +277,7 @@ async def create_primary_assignments(teacher, primaire, subjects):
             "options": ["40", "41", "42", "43"],
             "correct_answer": "42",
             "points": 2,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": str(uuid.uuid4()),
@@ -287,7 +287,7 @@ async def create_primary_assignments(teacher, primaire, subjects):
             "options": ["70", "71", "72", "73"],
             "correct_answer": "72",
             "points": 2,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": str(uuid.uuid4()),
@@ -297,7 +297,7 @@ async def create_primary_assignments(teacher, primaire, subjects):
             "options": ["50", "55", "60", "65"],
             "correct_answer": "60",
             "points": 2,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
     ]
     
@@ -313,7 +313,7 @@ async def create_primary_assignments(teacher, primaire, subjects):
         "assignment_type": "submission",
         "due_date": None,  # Pas de limite
         "allow_files": True,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     assignments = [assignment1, assignment2, assignment3, assignment4]
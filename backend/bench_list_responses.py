@@ -0,0 +1,118 @@
+"""
+Benchmark: serializing large list responses.
+
+Builds N posts and N submissions shaped like documents read from Mongo
+(timezone-aware dates, some optional fields missing, integer grades) and
+times turning them into a response body the way FastAPI does for
+`response_model=List[...]` ("before": validate into models, then encode)
+and with ModelListResponse ("after"). Both bodies are checked to be
+byte-for-byte identical.
+
+Usage:
+    python bench_list_responses.py [--items 1000] [--rounds 200]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "kaay_jang_bench")
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+import server  # noqa: E402
+
+def mongo_date(base, offset_ms):
+    # BSON dates have millisecond precision
+    return base + timedelta(milliseconds=offset_ms)
+
+def make_posts(count):
+    base = datetime(2025, 3, 1, 8, 0, tzinfo=timezone.utc)
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "topic_id": "topic-1",
+            "author_id": f"user-{i % 40}",
+            "author_name": f"Élève {i % 40}",
+            "author_role": "student" if i % 5 else "teacher",
+            "content": "Bonjour, voici ma réponse à l'exercice 3 : " + "x" * 240,
+            "created_at": mongo_date(base, i * 61_237),
+        }
+        for i in range(count)
+    ]
+
+def make_submissions(count):
+    base = datetime(2025, 3, 1, 8, 0, tzinfo=timezone.utc)
+    submissions = []
+    for i in range(count):
+        submission = {
+            "id": str(uuid.uuid4()),
+            "assignment_id": "assignment-1",
+            "student_id": f"user-{i}",
+            "student_name": f"Élève {i}",
+            "content": "Devoir rendu, voir le fichier joint. " + "y" * 160,
+            "file_urls": [f"/api/files/{uuid.uuid4()}"],
+            "submitted_at": mongo_date(base, i * 33_101),
+            "status": "submitted",
+        }
+        if i % 2:
+            submission.update(grade=i % 21, teacher_comment="Bon travail", graded_at=mongo_date(base, i * 90_000), status="graded")
+        submissions.append(submission)
+    return submissions
+
+async def render_before(field, docs):
+    # What FastAPI does with the value a response_model route returns
+    content = await serialize_response(field=field, response_content=docs)
+    return JSONResponse(content).body
+
+async def render_after(model, docs):
+    return server.ModelListResponse(model, docs).body
+
+async def time_rounds(render, rounds):
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        body = await render()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings, body
+
+def report(label, timings, size):
+    p50 = statistics.median(timings)
+    print(f"   {label:<8} p50 {p50:8.2f} ms   min {min(timings):8.2f} ms   {size / p50 / 1000:8.1f} MB/s")
+    return p50
+
+async def bench(name, model, docs, rounds):
+    field = create_response_field(name="response", type_=List[model])
+    before, before_body = await time_rounds(lambda: render_before(field, docs), rounds)
+    after, after_body = await time_rounds(lambda: render_after(model, docs), rounds)
+    assert before_body == after_body, f"{name}: bodies differ"
+
+    print(f"\n{name}: {len(docs)} items, {len(after_body) / 1024:.0f} KiB")
+    before_p50 = report("before", before, len(before_body))
+    after_p50 = report("after", after, len(after_body))
+    print(f"   speedup  x{before_p50 / after_p50:.1f}")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"List responses: {args.items} items, {args.rounds} rounds")
+    print("=" * 60)
+
+    await bench("get_posts", server.Post, make_posts(args.items), args.rounds)
+    await bench("get_submissions", server.Submission, make_submissions(args.items), args.rounds)
+
+    print("\n" + "=" * 60)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+"""
+Benchmark: latency of unrelated requests during a login storm.
+
+Simulates a whole class logging in at once (N concurrent bcrypt verifications)
+while lightweight "unrelated" requests keep arriving on the same event loop,
+then reports their p50/p99 latency with the old inline verification
+("before") and with the password pool ("after").
+
+Usage:
+    python bench_login_storm.py [--logins 20] [--probe-interval-ms 5]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "kaay_jang_bench")
+
+import server  # noqa: E402
+
+PASSWORD = "eleve123"
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def login_inline(hashed):
+    # Previous behaviour: bcrypt runs directly on the event loop
+    await asyncio.sleep(0)
+    return server.verify_password(PASSWORD, hashed)
+
+async def login_pooled(hashed):
+    await asyncio.sleep(0)
+    return await server.verify_password_async(PASSWORD, hashed)
+
+async def unrelated_request():
+    # Stands in for a cheap endpoint: one ~1 ms database round trip
+    await asyncio.sleep(0.001)
+
+async def run_storm(login, hashed, logins, probe_interval):
+    latencies = []
+    requests = []
+    storm = {"end": None}
+
+    async def timed_request(arrival):
+        await unrelated_request()
+        latencies.append((time.perf_counter() - arrival) * 1000)
+
+    async def probe():
+        # Requests arrive on a fixed schedule; latency is measured from the
+        # scheduled arrival, so time spent waiting on a blocked loop counts.
+        origin = time.perf_counter()
+        sent = 0
+        while True:
+            arrival = origin + sent * probe_interval
+            if storm["end"] is not None and arrival > storm["end"]:
+                break
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            requests.append(asyncio.create_task(timed_request(arrival)))
+            sent += 1
+
+    probe_task = asyncio.create_task(probe())
+    await asyncio.sleep(probe_interval)
+    started = time.perf_counter()
+    results = await asyncio.gather(*(login(hashed) for _ in range(logins)))
+    storm["end"] = time.perf_counter()
+    storm_seconds = storm["end"] - started
+    await probe_task
+    await asyncio.gather(*requests)
+
+    assert all(results)
+    return latencies, storm_seconds
+
+def report(label, latencies, storm_seconds, logins):
+    print(f"\n{label}")
+    print(f"   logins/s          : {logins / storm_seconds:8.1f}")
+    print(f"   probe requests    : {len(latencies):8d}")
+    print(f"   p50 latency (ms)  : {statistics.median(latencies):8.2f}")
+    print(f"   p99 latency (ms)  : {percentile(latencies, 99):8.2f}")
+    print(f"   max latency (ms)  : {max(latencies):8.2f}")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=20)
+    parser.add_argument("--probe-interval-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    hashed = server.hash_password(PASSWORD)
+    probe_interval = args.probe_interval_ms / 1000
+
+    print("=" * 60)
+    print(f"Login storm: {args.logins} concurrent logins, {server.PASSWORD_HASH_WORKERS} hash workers")
+    print("=" * 60)
+
+    latencies, seconds = await run_storm(login_inline, hashed, args.logins, probe_interval)
+    report("BEFORE (bcrypt on the event loop)", latencies, seconds, args.logins)
+
+    latencies, seconds = await run_storm(login_pooled, hashed, args.logins, probe_interval)
+    report("AFTER (bcrypt on the password pool)", latencies, seconds, args.logins)
+
+    print("\n" + "=" * 60)
+    server.password_executor.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+"""
+Script pour vérifier les index MongoDB par rapport à INDEX_MANIFEST (server.py)
+
+Reports, per collection:
+  - missing    : declared in the manifest but absent from the database
+  - mismatched : same keys as a manifest entry but different options (unique,
+                 partial filter or TTL)
+  - extra      : present in the database but not declared in the manifest
+  - unused     : no recorded access since the server started ($indexStats)
+
+Usage:
+    python check_indexes.py           # report only
+    python check_indexes.py --apply   # create missing indexes, then report
+"""
+import argparse
+import asyncio
+
+from server import db, client, ensure_indexes, INDEX_MANIFEST
+
+def key_of(keys):
+    return tuple((field, direction if isinstance(direction, str) else int(direction)) for field, direction in keys)
+
+def plain(value):
+    """SON and nested documents as plain dicts, so filters compare by content"""
+    if isinstance(value, dict):
+        return {k: plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [plain(v) for v in value]
+    return value
+
+def options_of(unique, partial, ttl):
+    return {
+        "unique": bool(unique),
+        "partialFilterExpression": plain(partial) if partial is not None else None,
+        "expireAfterSeconds": int(ttl) if ttl is not None else None,
+    }
+
+def declared_options(spec):
+    return options_of(spec.get("unique", False), spec.get("partial"), spec.get("ttl"))
+
+def present_options(index):
+    return options_of(index.get("unique", False), index.get("partialFilterExpression"), index.get("expireAfterSeconds"))
+
+async def index_usage(collection_name):
+    """Return {index name: ops since server start}, or {} if $indexStats is unavailable"""
+    try:
+        stats = await db[collection_name].aggregate([{"$indexStats": {}}]).to_list(None)
+    except Exception:
+        return {}
+    return {s["name"]: s["accesses"]["ops"] for s in stats}
+
+async def collection_report(collection_name, existing_collections):
+    declared = {key_of(spec["keys"]): declared_options(spec) for spec in INDEX_MANIFEST.get(collection_name, [])}
+    present = {}
+    if collection_name in existing_collections:
+        info = await db[collection_name].index_information()
+        for name, index in info.items():
+            if name == "_id_":
+                continue
+            present[key_of(index["key"])] = (name, present_options(index))
+
+    usage = await index_usage(collection_name) if present else {}
+
+    return {
+        "missing": [keys for keys in declared if keys not in present],
+        "mismatched": [
+            (name, declared[keys], options)
+            for keys, (name, options) in present.items()
+            if keys in declared and declared[keys] != options
+        ],
+        "extra": [name for keys, (name, _) in present.items() if keys not in declared],
+        "unused": [name for name, _ in present.values() if usage.get(name) == 0],
+    }
+
+def format_keys(keys):
+    return ", ".join(f"{field}:{direction}" for field, direction in keys)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="create missing indexes before reporting")
+    args = parser.parse_args()
+
+    if args.apply:
+        print("🛠  Création des index manquants...")
+        await ensure_indexes()
+
+    existing_collections = set(await db.list_collection_names())
+    collection_names = sorted(set(INDEX_MANIFEST) | existing_collections)
+
+    print("=" * 80)
+    print("📇 VÉRIFICATION DES INDEX")
+    print("=" * 80)
+
+    problems = 0
+    for collection_name in collection_names:
+        report = await collection_report(collection_name, existing_collections)
+        if not any(report.values()):
+            print(f"\n✅ {collection_name}")
+            continue
+
+        print(f"\n📦 {collection_name}")
+        for keys in report["missing"]:
+            print(f"   ❌ missing    : {{{format_keys(keys)}}}")
+        for name, expected, actual in report["mismatched"]:
+            for option in expected:
+                if expected[option] != actual[option]:
+                    print(f"   ⚠️  mismatched : {name} ({option}={actual[option]}, manifest says {option}={expected[option]})")
+        for name in report["extra"]:
+            print(f"   ➕ extra      : {name}")
+        for name in report["unused"]:
+            print(f"   💤 unused     : {name}")
+        problems += len(report["missing"]) + len(report["mismatched"])
+
+    print("\n" + "=" * 80)
+    if problems:
+        print(f"⚠️  {problems} index(es) missing or mismatched")
+    else:
+        print("✅ All manifest indexes are in place")
+    print("=" * 80)
+
+    client.close()
+    return problems
+
+if __name__ == "__main__":
+    raise SystemExit(1 if asyncio.run(main()) else 0)
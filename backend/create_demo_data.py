@@ -48,7 +48,7 @@ async def create_demo_users():
             "bio": "Professeure de mathématiques avec 10 ans d'expérience. Passionnée par l'enseignement des sciences.",
             "establishment": "Lycée Blaise Diagne",
             "is_validated": True,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": str(uuid.uuid4()),
@@ -61,7 +61,7 @@ async def create_demo_users():
             "bio": "Enseignant de français et littérature. J'aime partager ma passion pour les lettres.",
             "establishment": "Collège Kennedy",
             "is_validated": True,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": str(uuid.uuid4()),
@@ -75,7 +75,7 @@ async def create_demo_users():
             "bio": "Docteure en physique, enseignante passionnée de sciences expérimentales.",
             "establishment": "Lycée Limamou Laye",
             "is_validated": True,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": str(uuid.uuid4()),
@@ -88,7 +88,7 @@ async def create_demo_users():
             "bio": "Ingénieur informaticien et formateur. Spécialisé en développement web et algorithmique.",
             "establishment": "Université Cheikh Anta Diop",
             "is_validated": True,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
     ]
     
@@ -106,7 +106,7 @@ async def create_demo_users():
             "objectives": objective,
             "establishment": establishment,
             "is_validated": True,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
         for i, (name, branch, level, filiere, objective, establishment) in enumerate([
             ("Awa Faye", lycee_branch, lycee_levels[2] if len(lycee_levels) > 2 else lycee_levels[0], "S", "Réussir le bac et devenir médecin", "Lycée Blaise Diagne"),
@@ -161,7 +161,7 @@ async def create_follows(teachers, students):
                 "id": str(uuid.uuid4()),
                 "follower_id": student["id"],
                 "followed_id": teacher["id"],
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             })
     
     # Some students follow each other
@@ -171,7 +171,7 @@ async def create_follows(teachers, students):
                 "id": str(uuid.uuid4()),
                 "follower_id": students[i]["id"],
                 "followed_id": students[i+1]["id"],
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             })
     
     existing = await db.follows.count_documents({})
@@ -204,7 +204,7 @@ async def create_forum_posts(teachers, students):
             "visibility": "public",
             "views_count": 45,
             "replies_count": 5,
-            "created_at": (datetime.now(timezone.utc) - timedelta(days=2)).isoformat()
+            "created_at": (datetime.now(timezone.utc) - timedelta(days=2))
         },
         {
             "id": str(uuid.uuid4()),
@@ -219,7 +219,7 @@ async def create_forum_posts(teachers, students):
             "visibility": "public",
             "views_count": 23,
             "replies_count": 3,
-            "created_at": (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
+            "created_at": (datetime.now(timezone.utc) - timedelta(days=1))
         },
         {
             "id": str(uuid.uuid4()),
@@ -234,7 +234,7 @@ async def create_forum_posts(teachers, students):
             "visibility": "followers_only",
             "views_count": 12,
             "replies_count": 2,
-            "created_at": (datetime.now(timezone.utc) - timedelta(hours=12)).isoformat()
+            "created_at": (datetime.now(timezone.utc) - timedelta(hours=12))
         },
         {
             "id": str(uuid.uuid4()),
@@ -249,7 +249,7 @@ async def create_forum_posts(teachers, students):
             "visibility": "public",
             "views_count": 67,
             "replies_count": 8,
-            "created_at": (datetime.now(timezone.utc) - timedelta(days=3)).isoformat()
+            "created_at": (datetime.now(timezone.utc) - timedelta(days=3))
         },
         {
             "id": str(uuid.uuid4()),
@@ -264,7 +264,7 @@ async def create_forum_posts(teachers, students):
             "visibility": "followers_only",
             "views_count": 8,
             "replies_count": 1,
-            "created_at": (datetime.now(timezone.utc) - timedelta(hours=6)).isoformat()
+            "created_at": (datetime.now(timezone.utc) - timedelta(hours=6))
         }
     ]
     
@@ -293,9 +293,9 @@ async def create_assignments(teachers, students):
         "level_id": teachers[0]["level_id"],
         "teacher_id": teachers[0]["id"],
         "assignment_type": "quiz",
-        "due_date": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
+        "due_date": (datetime.now(timezone.utc) + timedelta(days=7)),
         "allow_files": False,
-        "created_at": (datetime.now(timezone.utc) - timedelta(days=2)).isoformat()
+        "created_at": (datetime.now(timezone.utc) - timedelta(days=2))
     }
     
     # Questions for assignment 1
@@ -308,7 +308,7 @@ async def create_assignments(teachers, students):
             "options": ["ax + b = 0", "ax² + bx + c = 0", "ax³ + bx² + c = 0", "ax² + b = 0"],
             "correct_answer": "ax² + bx + c = 0",
             "points": 2,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": str(uuid.uuid4()),
@@ -318,7 +318,7 @@ async def create_assignments(teachers, students):
             "options": ["b² - 4ac", "b² + 4ac", "2b - 4ac", "b - 4ac"],
             "correct_answer": "b² - 4ac",
             "points": 2,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
     ]
     
@@ -334,7 +334,7 @@ async def create_assignments(teachers, students):
         "assignment_type": "submission",
         "due_date": None,  # Pas de limite de temps
         "allow_files": True,
-        "created_at": (datetime.now(timezone.utc) - timedelta(days=5)).isoformat()
+        "created_at": (datetime.now(timezone.utc) - timedelta(days=5))
     }
     
     # Assignment 3: Étude de cas
@@ -347,9 +347,9 @@ async def create_assignments(teachers, students):
         "level_id": teachers[2]["level_id"],
         "teacher_id": teachers[2]["id"],
         "assignment_type": "submission",
-        "due_date": (datetime.now(timezone.utc) + timedelta(days=14)).isoformat(),
+        "due_date": (datetime.now(timezone.utc) + timedelta(days=14)),
         "allow_files": True,
-        "created_at": (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
+        "created_at": (datetime.now(timezone.utc) - timedelta(days=1))
     }
     
     existing = await db.assignments.count_documents({})
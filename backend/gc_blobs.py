@@ -0,0 +1,159 @@
+"""
+Script pour supprimer les fichiers (blobs) qui ne sont plus référencés
+
+Upload content is stored once per SHA-256 and counted in `blobs.refs`. This
+deletes blobs whose count has been zero for longer than the grace period.
+Each blob is first marked `deleting`, so a concurrent upload of the same
+content waits and then stores it again instead of losing it. Expired
+resumable upload sessions are deleted along with their partial data.
+
+  --recount  recompute every `refs` from the `files` collection first
+  --orphans  also delete stored objects with no `blobs` document, abandoned
+             direct uploads, stale partial uploads in UPLOAD_DIR and session
+             data with no `upload_sessions` document
+
+Usage:
+    python gc_blobs.py [--grace-hours 24] [--recount] [--orphans] [--dry-run]
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from pymongo import UpdateOne
+
+from server import (
+    db, client, storage, upload_executor, upload_session_path,
+    BLOB_GC_GRACE_SECONDS, UPLOAD_DIR, UPLOAD_SESSION_DIR
+)
+
+async def recount_refs():
+    actual = {}
+    pipeline = [
+        {"$match": {"sha256": {"$ne": None}}},
+        {"$group": {"_id": "$sha256", "refs": {"$sum": 1}}},
+    ]
+    async for row in db.files.aggregate(pipeline, allowDiskUse=True):
+        actual[row["_id"]] = row["refs"]
+
+    operations = []
+    now = datetime.now(timezone.utc)
+    async for blob in db.blobs.find({"deleting": {"$ne": True}}, {"_id": 0, "sha256": 1, "refs": 1}):
+        refs = actual.get(blob["sha256"], 0)
+        if refs != blob["refs"]:
+            update = {"$set": {"refs": refs}}
+            if refs == 0:
+                update["$set"]["unreferenced_at"] = now
+            operations.append(UpdateOne({"sha256": blob["sha256"], "refs": blob["refs"]}, update))
+    if operations:
+        await db.blobs.bulk_write(operations, ordered=False)
+    return len(operations)
+
+async def collect_blobs(cutoff, dry_run):
+    deleted = 0
+    query = {"refs": {"$lte": 0}, "$or": [{"unreferenced_at": {"$lt": cutoff}}, {"deleting": True}]}
+    async for blob in db.blobs.find(query, {"_id": 0, "sha256": 1}):
+        if dry_run:
+            deleted += 1
+            continue
+        claimed = await db.blobs.find_one_and_update(
+            {"sha256": blob["sha256"], "refs": {"$lte": 0}},
+            {"$set": {"deleting": True}}
+        )
+        if claimed is None:
+            continue
+        await storage.delete(blob["sha256"])
+        await db.blobs.delete_one({"sha256": blob["sha256"], "deleting": True})
+        deleted += 1
+    return deleted
+
+async def collect_sessions(dry_run):
+    """Delete upload sessions past their expiry (pushed back by every chunk)"""
+    now = datetime.now(timezone.utc)
+    expired = await db.upload_sessions.find({"expires_at": {"$lt": now}}, {"_id": 0, "id": 1}).to_list(None)
+    if dry_run:
+        return len(expired)
+
+    deleted = 0
+    for session in expired:
+        # Conditional: a chunk may have arrived since the query
+        result = await db.upload_sessions.delete_one({"id": session["id"], "expires_at": {"$lt": now}})
+        if result.deleted_count:
+            await asyncio.get_running_loop().run_in_executor(
+                upload_executor, lambda: upload_session_path(session["id"]).unlink(missing_ok=True)
+            )
+            deleted += 1
+    return deleted
+
+async def collect_orphans(cutoff, dry_run):
+    known = set()
+    async for blob in db.blobs.find({}, {"_id": 0, "sha256": 1}):
+        known.add(blob["sha256"])
+
+    orphans = [key for key, modified in await storage.list_keys() if key not in known and modified < cutoff]
+    # Direct uploads that were never completed
+    staged = [upload_id for upload_id, modified in await storage.list_staged() if modified < cutoff]
+    if not dry_run:
+        for key in orphans:
+            await storage.delete(key)
+        for upload_id in staged:
+            await storage.discard_staged(upload_id)
+
+    sessions = set()
+    async for session in db.upload_sessions.find({}, {"_id": 0, "id": 1}):
+        sessions.add(session["id"])
+
+    def stale_parts():
+        parts = [
+            path for path in UPLOAD_DIR.glob(".*.part")
+            if datetime.fromtimestamp(path.stat().st_mtime, timezone.utc) < cutoff
+        ] + [
+            path for path in UPLOAD_SESSION_DIR.glob("*.part")
+            if path.stem not in sessions and datetime.fromtimestamp(path.stat().st_mtime, timezone.utc) < cutoff
+        ]
+        if not dry_run:
+            for path in parts:
+                path.unlink(missing_ok=True)
+        return len(parts)
+    parts = await asyncio.get_running_loop().run_in_executor(upload_executor, stale_parts)
+    return len(orphans) + len(staged), parts
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--grace-hours", type=float, default=BLOB_GC_GRACE_SECONDS / 3600)
+    parser.add_argument("--recount", action="store_true", help="recompute reference counts from `files` first")
+    parser.add_argument("--orphans", action="store_true", help="also delete stored objects without a blobs document")
+    parser.add_argument("--dry-run", action="store_true", help="report without deleting")
+    args = parser.parse_args()
+
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=args.grace_hours)
+
+    print("=" * 60)
+    print(f"🗑  Nettoyage des fichiers non référencés ({storage.name})")
+    print("=" * 60)
+
+    if args.recount and not args.dry_run:
+        fixed = await recount_refs()
+        print(f"   Reference counts fixed : {fixed}")
+
+    deleted = await collect_blobs(cutoff, args.dry_run)
+    print(f"   Unreferenced blobs     : {deleted}")
+
+    sessions = await collect_sessions(args.dry_run)
+    print(f"   Expired upload sessions: {sessions}")
+
+    if args.orphans:
+        orphans, parts = await collect_orphans(cutoff, args.dry_run)
+        print(f"   Orphan objects         : {orphans}")
+        print(f"   Stale partial uploads  : {parts}")
+
+    print("=" * 60)
+    if args.dry_run:
+        print("🔎 Dry run: nothing was deleted")
+    else:
+        print("✅ Done")
+    print("=" * 60)
+    client.close()
+    upload_executor.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,41 @@
+"""
+Image resizing for the derivative pipeline (server.py, Image Variants).
+
+Kept out of server.py so the process pool's spawned workers only import
+Pillow, not the whole application.
+"""
+import os
+
+from PIL import Image, ImageOps
+
+def render_image_variant(source: str, target: str, size: int, crop: bool, image_format: str, quality: int) -> int:
+    """Resize `source` to fit (or, with `crop`, fill) a `size` square and save it
+    as `image_format` at `target`. Returns the size of the written file."""
+    with Image.open(source) as original:
+        # JPEG sources decode straight at a reduced scale, which is most of the win
+        original.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(original)
+
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+    if has_alpha:
+        image = image.convert("RGBA")
+        if image_format == "JPEG":
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+    else:
+        image = image.convert("RGB")
+
+    if crop:
+        image = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+    else:
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp = f"{target}.{os.getpid()}.tmp"
+    if image_format == "JPEG":
+        image.save(temp, "JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(temp, image_format, quality=quality)
+    os.replace(temp, target)
+    return os.path.getsize(target)
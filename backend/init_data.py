@@ -19,13 +19,13 @@ db = client[os.environ['DB_NAME']]
 async def init_branches():
     """Initialize branches"""
     branches = [
-        {"id": str(uuid.uuid4()), "name": "Primaire", "name_en": "Primary", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "Secondaire", "name_en": "Secondary", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "Coll\u00e8ge", "name_en": "Middle School", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "Lyc\u00e9e", "name_en": "High School", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "BTS", "name_en": "BTS", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "Licence", "name_en": "Bachelor", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "Ing\u00e9nieur", "name_en": "Engineering", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
+        {"id": str(uuid.uuid4()), "name": "Primaire", "name_en": "Primary", "is_active": True, "created_at": datetime.now(timezone.utc)},
+        {"id": str(uuid.uuid4()), "name": "Secondaire", "name_en": "Secondary", "is_active": True, "created_at": datetime.now(timezone.utc)},
+        {"id": str(uuid.uuid4()), "name": "Coll\u00e8ge", "name_en": "Middle School", "is_active": True, "created_at": datetime.now(timezone.utc)},
+        {"id": str(uuid.uuid4()), "name": "Lyc\u00e9e", "name_en": "High School", "is_active": True, "created_at": datetime.now(timezone.utc)},
+        {"id": str(uuid.uuid4()), "name": "BTS", "name_en": "BTS", "is_active": True, "created_at": datetime.now(timezone.utc)},
+        {"id": str(uuid.uuid4()), "name": "Licence", "name_en": "Bachelor", "is_active": True, "created_at": datetime.now(timezone.utc)},
+        {"id": str(uuid.uuid4()), "name": "Ing\u00e9nieur", "name_en": "Engineering", "is_active": True, "created_at": datetime.now(timezone.utc)},
     ]
     
     existing = await db.branches.count_documents({})
@@ -49,7 +49,7 @@ async def init_levels(branches):
             "branch_id": primaire_branch["id"],
             "name": level_name,
             "name_en": level_name,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         })
     
     # Coll\u00e8ge levels
@@ -60,7 +60,7 @@ async def init_levels(branches):
             "branch_id": college_branch["id"],
             "name": level_name,
             "name_en": level_name,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         })
     
     # Lyc\u00e9e levels
@@ -71,7 +71,7 @@ async def init_levels(branches):
             "branch_id": lycee_branch["id"],
             "name": level_name,
             "name_en": level_name,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         })
     
     # Licence levels
@@ -82,7 +82,7 @@ async def init_levels(branches):
             "branch_id": licence_branch["id"],
             "name": level_name,
             "name_en": level_name,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         })
     
     existing = await db.levels.count_documents({})
@@ -95,16 +95,16 @@ async def init_levels(branches):
 async def init_subjects():
     """Initialize subjects"""
     subjects = [
-        {"id": str(uuid.uuid4()), "name": "Math\u00e9matiques", "name_en": "Mathematics", "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "Fran\u00e7ais", "name_en": "French", "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "Anglais", "name_en": "English", "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "Physique-Chimie", "name_en": "Physics-Chemistry", "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "SVT (Sciences de la Vie et de la Terre)", "name_en": "Life and Earth Sciences", "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "Histoire-G\u00e9ographie", "name_en": "History-Geography", "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "Philosophie", "name_en": "Philosophy", "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "Informatique", "name_en": "Computer Science", "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "\u00c9conomie", "name_en": "Economics", "created_at": datetime.now(timezone.utc).isoformat()},
-        {"id": str(uuid.uuid4()), "name": "Espagnol", "name_en": "Spanish", "created_at": datetime.now(timezone.utc).isoformat()},
+        {"id": str(uuid.uuid4()), "name": "Math\u00e9matiques", "name_en": "Mathematics", "created_at": datetime.now(timezone.utc)},
+        {"id": str(uuid.uuid4()), "name": "Fran\u00e7ais", "name_en": "French", "created_at": datetime.now(timezone.utc)},
+        {"id": str(uuid.uuid4()), "name": "Anglais", "name_en": "English", "created_at": datetime.now(timezone.utc)},
+        {"id": str(uuid.uuid4()), "name": "Physique-Chimie", "name_en": "Physics-Chemistry", "created_at": datetime.now(timezone.utc)},
+        {"id": str(uuid.uuid4()), "name": "SVT (Sciences de la Vie et de la Terre)", "name_en": "Life and Earth Sciences", "created_at": datetime.now(timezone.utc)},
+        {"id": str(uuid.uuid4()), "name": "Histoire-G\u00e9ographie", "name_en": "History-Geography", "created_at": datetime.now(timezone.utc)},
+        {"id": str(uuid.uuid4()), "name": "Philosophie", "name_en": "Philosophy", "created_at": datetime.now(timezone.utc)},
+        {"id": str(uuid.uuid4()), "name": "Informatique", "name_en": "Computer Science", "created_at": datetime.now(timezone.utc)},
+        {"id": str(uuid.uuid4()), "name": "\u00c9conomie", "name_en": "Economics", "created_at": datetime.now(timezone.utc)},
+        {"id": str(uuid.uuid4()), "name": "Espagnol", "name_en": "Spanish", "created_at": datetime.now(timezone.utc)},
     ]
     
     existing = await db.subjects.count_documents({})
@@ -126,7 +126,7 @@ async def init_ad_banners():
             "email": "contact@librairie-dakar.sn",
             "link": "https://example.com",
             "is_active": True,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": str(uuid.uuid4()),
@@ -137,7 +137,7 @@ async def init_ad_banners():
             "email": "info@soutien-scolaire.sn",
             "link": "https://example.com",
             "is_active": True,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         },
         {
             "id": str(uuid.uuid4()),
@@ -148,7 +148,7 @@ async def init_ad_banners():
             "email": "contact@orientation.sn",
             "link": "https://example.com",
             "is_active": True,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
     ]
     
@@ -176,7 +176,7 @@ async def create_admin_user():
             "name": "Admin KAAY-JANG",
             "role": "admin",
             "is_validated": True,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
         await db.users.insert_one(admin_user)
         print(f"Created admin user: {admin_email} / password: admin123")
@@ -0,0 +1,141 @@
+"""
+Migration: convert ISO-8601 date strings to native BSON dates
+
+Older write paths stored `created_at`, `due_date`, `submitted_at` and
+`graded_at` as `.isoformat()` strings. This walks each collection in `_id`
+order, converts those fields in batches with one bulk_write per batch, and
+records a checkpoint in the `migrations` collection after every batch, so it
+can run while the API is serving traffic and resume where it stopped.
+
+Each update is conditional on the field still holding the string that was
+read, so a concurrent write is never overwritten.
+
+Required on databases written by those older versions: the paginated list
+endpoints answer 503 for a collection until it has been migrated.
+
+Usage:
+    python migrate_datetimes.py [--batch-size 500] [--pause-ms 50] [--restart]
+"""
+import argparse
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+import os
+from dotenv import load_dotenv
+from pathlib import Path
+from datetime import datetime, timezone
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+mongo_url = os.environ['MONGO_URL']
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
+db = client[os.environ['DB_NAME']]
+
+MIGRATION_ID = "bson_datetimes"
+
+DATE_FIELDS = {
+    "users": ["created_at"],
+    "branches": ["created_at"],
+    "levels": ["created_at"],
+    "subjects": ["created_at"],
+    "teacher_subjects": ["created_at"],
+    "topics": ["created_at"],
+    "posts": ["created_at"],
+    "assignments": ["created_at", "due_date"],
+    "questions": ["created_at"],
+    "answers": ["created_at"],
+    "submissions": ["submitted_at", "graded_at"],
+    "follows": ["created_at"],
+    "notifications": ["created_at"],
+    "ad_banners": ["created_at"],
+    "files": ["created_at"],
+}
+
+def parse_date(value):
+    """Parse an ISO-8601 string; naive values were always written in UTC"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+async def migrate_collection(collection_name, fields, batch_size, pause):
+    checkpoint_id = f"{MIGRATION_ID}:{collection_name}"
+    checkpoint = await db.migrations.find_one({"id": checkpoint_id}) or {}
+    if checkpoint.get("completed"):
+        print(f"   ✅ {collection_name}: already migrated")
+        return
+
+    converted = checkpoint.get("converted", 0)
+    skipped = checkpoint.get("skipped", 0)
+    last_id = checkpoint.get("last_id")
+
+    string_filter = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    projection = {field: 1 for field in fields}
+
+    while True:
+        query = dict(string_filter)
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await db[collection_name].find(query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+
+        operations = []
+        for doc in batch:
+            for field in fields:
+                value = doc.get(field)
+                if not isinstance(value, str):
+                    continue
+                try:
+                    parsed = parse_date(value)
+                except ValueError:
+                    skipped += 1
+                    print(f"   ⚠️  {collection_name} {doc['_id']}: cannot parse {field}={value!r}")
+                    continue
+                operations.append(UpdateOne({"_id": doc["_id"], field: value}, {"$set": {field: parsed}}))
+
+        if operations:
+            result = await db[collection_name].bulk_write(operations, ordered=False)
+            converted += result.modified_count
+
+        last_id = batch[-1]["_id"]
+        await db.migrations.update_one(
+            {"id": checkpoint_id},
+            {"$set": {"last_id": last_id, "converted": converted, "skipped": skipped, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        print(f"   … {collection_name}: {converted} fields converted")
+
+        if pause:
+            await asyncio.sleep(pause)
+
+    await db.migrations.update_one(
+        {"id": checkpoint_id},
+        {"$set": {"completed": True, "converted": converted, "skipped": skipped, "updated_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    print(f"   ✅ {collection_name}: {converted} fields converted, {skipped} skipped")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause-ms", type=float, default=50, help="pause between batches to limit load on a live database")
+    parser.add_argument("--restart", action="store_true", help="discard checkpoints and scan every collection again")
+    args = parser.parse_args()
+
+    if args.restart:
+        await db.migrations.delete_many({"id": {"$regex": f"^{MIGRATION_ID}:"}})
+
+    print("=" * 60)
+    print("🕒 Migration des dates vers le type BSON date")
+    print("=" * 60)
+
+    for collection_name, fields in DATE_FIELDS.items():
+        await migrate_collection(collection_name, fields, args.batch_size, args.pause_ms / 1000)
+
+    print("=" * 60)
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+"""
+Migration: move uploads named by uuid into content-addressed storage
+
+Files uploaded before content-addressed storage live at UPLOAD_DIR/<uuid>.<ext>
+and their `files` record points at /uploads/. This hashes each of them, stores
+the content once per SHA-256 in the configured storage backend
+(STORAGE_BACKEND), points the record at /api/files/<id> and rewrites the URL
+in the submissions that reference it. The original file is removed only once its record is
+updated, so the migration can be stopped and run again.
+
+Run `python gc_blobs.py --recount` afterwards if a run was interrupted.
+
+Usage:
+    python migrate_uploads_to_blobs.py [--dry-run]
+"""
+import argparse
+import asyncio
+import hashlib
+import shutil
+import uuid
+
+from server import db, client, storage, acquire_blob, upload_executor, UPLOAD_CHUNK_BYTES, UPLOAD_DIR
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+async def migrate(dry_run):
+    loop = asyncio.get_running_loop()
+    migrated = missing = 0
+
+    async for file_doc in db.files.find({"file_url": {"$regex": "^/uploads/"}}, {"_id": 0}):
+        legacy_path = UPLOAD_DIR / file_doc["file_url"].rsplit("/", 1)[-1]
+        if not legacy_path.is_file():
+            missing += 1
+            print(f"   ⚠️  {file_doc['id']}: {legacy_path.name} not found")
+            continue
+        if dry_run:
+            migrated += 1
+            continue
+
+        sha256 = await loop.run_in_executor(upload_executor, hash_file, legacy_path)
+        size = legacy_path.stat().st_size
+        # Storage consumes its source, so hand it a copy
+        temp_path = UPLOAD_DIR / f".{uuid.uuid4()}.part"
+        await loop.run_in_executor(upload_executor, shutil.copyfile, legacy_path, temp_path)
+        await acquire_blob(
+            sha256, size,
+            store=lambda: storage.put(sha256, temp_path, file_doc.get("file_type")),
+            discard=lambda: loop.run_in_executor(upload_executor, temp_path.unlink)
+        )
+
+        file_url = f"/api/files/{file_doc['id']}"
+        await db.files.update_one(
+            {"id": file_doc["id"]},
+            {"$set": {"sha256": sha256, "size": size, "file_url": file_url}}
+        )
+        await db.submissions.update_many(
+            {"file_urls": file_doc["file_url"]},
+            {"$set": {"file_urls.$": file_url}}
+        )
+        legacy_path.unlink()
+        migrated += 1
+
+    return migrated, missing
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="count files to migrate without moving them")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("📦 Migration des fichiers vers le stockage par contenu")
+    print("=" * 60)
+
+    migrated, missing = await migrate(args.dry_run)
+
+    print("=" * 60)
+    print(f"{'🔎 Would migrate' if args.dry_run else '✅ Migrated'} {migrated} file(s), {missing} missing on disk")
+    print("=" * 60)
+    client.close()
+    upload_executor.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
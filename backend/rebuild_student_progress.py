@@ -0,0 +1,144 @@
+"""
+Script pour reconstruire la progression des élèves (collection student_progress)
+
+The API keeps one student_progress document per (student, assignment) up to
+date on every answer and submission write. This recomputes all of them from
+`answers`, `submissions`, `questions` and `assignments` (server-side
+aggregations, written back with batched bulk_write), then removes progress
+documents that no longer have any answer or submission behind them. Run it
+once after deploying student_progress, again after deploying per-question
+quiz scores (`scores`, which later answers and regrades build on), and
+whenever drift is suspected.
+
+Usage:
+    python rebuild_student_progress.py [--batch-size 1000]
+"""
+import argparse
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteOne, UpdateOne
+import os
+from dotenv import load_dotenv
+from pathlib import Path
+from datetime import datetime, timezone
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+mongo_url = os.environ['MONGO_URL']
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
+db = client[os.environ['DB_NAME']]
+
+# Keep in sync with SUBMISSION_MAX_GRADE in server.py
+SUBMISSION_MAX_GRADE = 20
+
+async def flush(operations, batch_size, force=False):
+    if operations and (force or len(operations) >= batch_size):
+        await db.student_progress.bulk_write(operations, ordered=False)
+        operations.clear()
+
+async def rebuild(batch_size):
+    levels = {}
+    async for assignment in db.assignments.find({}, {"_id": 0, "id": 1, "level_id": 1}):
+        levels[assignment["id"]] = assignment.get("level_id")
+
+    max_scores = {}
+    async for row in db.questions.aggregate([{"$group": {"_id": "$assignment_id", "points": {"$sum": "$points"}}}]):
+        max_scores[row["_id"]] = row["points"]
+
+    now = datetime.now(timezone.utc)
+    seen = set()
+    operations = []
+
+    # Quiz answers: the latest answer to each question counts, as in the API
+    quiz_pipeline = [
+        {"$match": {"question_id": {"$ne": None}}},
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": {"student_id": "$student_id", "assignment_id": "$assignment_id", "question_id": "$question_id"},
+            "score": {"$last": {"$ifNull": ["$score", 0]}},
+        }},
+        {"$group": {
+            "_id": {"student_id": "$_id.student_id", "assignment_id": "$_id.assignment_id"},
+            "scores": {"$push": {"k": "$_id.question_id", "v": "$score"}},
+            "answered_count": {"$sum": 1},
+            "score": {"$sum": "$score"},
+        }},
+    ]
+    async for row in db.answers.aggregate(quiz_pipeline, allowDiskUse=True):
+        key = (row["_id"]["student_id"], row["_id"]["assignment_id"])
+        seen.add(key)
+        operations.append(UpdateOne(
+            {"student_id": key[0], "assignment_id": key[1]},
+            {"$set": {
+                "level_id": levels.get(key[1]),
+                "scores": {item["k"]: item["v"] for item in row["scores"]},
+                "answered_count": row["answered_count"],
+                "score": row["score"],
+                "max_score": max_scores.get(key[1], 0),
+                "completed": True,
+                "updated_at": now,
+            }},
+            upsert=True
+        ))
+        await flush(operations, batch_size)
+
+    # Manual submissions: the latest one per student and assignment counts
+    submission_pipeline = [
+        {"$sort": {"submitted_at": 1}},
+        {"$group": {
+            "_id": {"student_id": "$student_id", "assignment_id": "$assignment_id"},
+            "grade": {"$last": "$grade"},
+        }},
+    ]
+    async for row in db.submissions.aggregate(submission_pipeline, allowDiskUse=True):
+        key = (row["_id"]["student_id"], row["_id"]["assignment_id"])
+        if key in seen:
+            continue
+        seen.add(key)
+        operations.append(UpdateOne(
+            {"student_id": key[0], "assignment_id": key[1]},
+            {
+                "$set": {
+                    "level_id": levels.get(key[1]),
+                    "score": row["grade"],
+                    "max_score": SUBMISSION_MAX_GRADE,
+                    "completed": True,
+                    "updated_at": now,
+                },
+                "$unset": {"answered_count": "", "scores": ""},
+            },
+            upsert=True
+        ))
+        await flush(operations, batch_size)
+
+    await flush(operations, batch_size, force=True)
+
+    # Progress with nothing left behind it
+    removed = 0
+    async for progress in db.student_progress.find({}, {"_id": 1, "student_id": 1, "assignment_id": 1}):
+        if (progress["student_id"], progress["assignment_id"]) not in seen:
+            operations.append(DeleteOne({"_id": progress["_id"]}))
+            removed += 1
+            await flush(operations, batch_size)
+    await flush(operations, batch_size, force=True)
+
+    return len(seen), removed
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("📈 Reconstruction de la progression des élèves")
+    print("=" * 60)
+
+    rebuilt, removed = await rebuild(args.batch_size)
+
+    print(f"✅ {rebuilt} progress document(s) rebuilt, {removed} removed")
+    print("=" * 60)
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
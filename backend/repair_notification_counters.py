@@ -0,0 +1,124 @@
+"""
+Script pour recalculer les compteurs de notifications non lues
+
+`notification_counters` holds one {user_id, unread} document per user and is
+maintained incrementally by the API. This recomputes every counter from the
+`notifications` collection (the source of truth) and fixes the ones that
+drifted. (Missing counters are seeded by the API when first needed.)
+
+It can run while the API is serving traffic: each drifted counter is
+compare-and-set against the value it held when the user's notifications
+were counted, then re-checked, so an increment or decrement made by the API
+in between is never overwritten; the user is simply counted again. Users
+whose counter keeps moving are reported as unsettled (run the script
+again). An increment still in flight for a notification that was already
+counted can land after the last check and leave that user one too high
+until the next run.
+
+Usage:
+    python repair_notification_counters.py [--batch-size 100] [--dry-run]
+"""
+import argparse
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+import os
+from dotenv import load_dotenv
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+mongo_url = os.environ['MONGO_URL']
+client = AsyncIOMotorClient(mongo_url)
+db = client[os.environ['DB_NAME']]
+
+REPAIR_ATTEMPTS = 5
+
+async def repair_counter(user_id):
+    """Bring one user's counter in line with their unread notifications.
+
+    Returns False if it still disagreed after REPAIR_ATTEMPTS tries.
+    """
+    for _ in range(REPAIR_ATTEMPTS):
+        counter = await db.notification_counters.find_one({"user_id": user_id}, {"_id": 0, "unread": 1})
+        unread = await db.notifications.count_documents({"user_id": user_id, "read": False})
+        if counter is not None and counter.get("unread") == unread:
+            return True
+        try:
+            if counter is None:
+                await db.notification_counters.update_one(
+                    {"user_id": user_id},
+                    {"$setOnInsert": {"unread": unread}},
+                    upsert=True
+                )
+            else:
+                # Only applies if the API has not changed the counter since it was read
+                await db.notification_counters.update_one(
+                    {"user_id": user_id, "unread": counter.get("unread")},
+                    {"$set": {"unread": unread}}
+                )
+        except DuplicateKeyError:
+            # The API created the counter first
+            pass
+    return False
+
+async def repair_counters(batch_size, dry_run):
+    # Actual unread counts, grouped server-side
+    actual = {}
+    pipeline = [
+        {"$match": {"read": False}},
+        {"$group": {"_id": "$user_id", "unread": {"$sum": 1}}},
+    ]
+    async for row in db.notifications.aggregate(pipeline, allowDiskUse=True):
+        actual[row["_id"]] = row["unread"]
+
+    stored = {}
+    async for counter in db.notification_counters.find({}, {"_id": 0, "user_id": 1, "unread": 1}):
+        stored[counter["user_id"]] = counter.get("unread", 0)
+
+    fixes = {
+        user_id: actual.get(user_id, 0)
+        for user_id in set(actual) | set(stored)
+        if actual.get(user_id, 0) != stored.get(user_id)
+    }
+
+    print(f"   Users with unread notifications : {len(actual)}")
+    print(f"   Stored counters                 : {len(stored)}")
+    print(f"   Counters to fix                 : {len(fixes)}")
+
+    if dry_run or not fixes:
+        return len(fixes), 0
+
+    # The counts above are only a snapshot: each user is repaired on its own
+    user_ids = list(fixes)
+    unsettled = 0
+    for i in range(0, len(user_ids), batch_size):
+        results = await asyncio.gather(*(repair_counter(user_id) for user_id in user_ids[i:i + batch_size]))
+        unsettled += results.count(False)
+    return len(fixes), unsettled
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=100, help="users repaired concurrently")
+    parser.add_argument("--dry-run", action="store_true", help="report drift without writing")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("🔔 Recalcul des compteurs de notifications non lues")
+    print("=" * 60)
+
+    fixed, unsettled = await repair_counters(args.batch_size, args.dry_run)
+
+    print("=" * 60)
+    if args.dry_run:
+        print(f"🔎 Dry run: {fixed} counter(s) would be fixed")
+    else:
+        print(f"✅ {fixed - unsettled} counter(s) fixed")
+        if unsettled:
+            print(f"⚠️  {unsettled} counter(s) kept changing; run the script again")
+    print("=" * 60)
+    client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
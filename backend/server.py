@@ -1,36 +1,96 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, File, UploadFile
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Header, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import RedirectResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import ClientDisconnect
+from python_multipart.multipart import MultipartParser, parse_options_header
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, CursorType, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
+from bson import ObjectId
+import boto3
+from botocore.client import Config as BotoConfig
+from botocore.exceptions import ClientError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, TypeAdapter, ValidationError
+from typing import List, Mapping, Optional, Union, get_args, get_origin
+from types import UnionType
 import uuid
 from datetime import datetime, timezone, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 import aiosmtplib
+import numpy as np
+import pandas as pd
 from email.message import EmailMessage
-import shutil
+from collections import OrderedDict
+import base64
+import hashlib
+import csv
+import io
+import json
+import orjson
+import zipfile
+from urllib.parse import quote
+from email.utils import formatdate, parsedate_to_datetime
+from PIL import Image, UnidentifiedImageError
+from imaging import render_image_variant
+from xml.sax.saxutils import escape as xml_escape
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import multiprocessing
+import time
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# tz_aware: dates are stored as native BSON dates and read back as UTC datetimes
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
 
 # JWT & Password
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+# Tokens for /events travel in the URL (and so end up in logs): keep them brief
+STREAM_TOKEN_EXPIRE_SECONDS = int(os.environ.get('STREAM_TOKEN_EXPIRE_SECONDS', '60'))
+# Signed file links (POST /files/{id}/link) for clients that cannot send headers
+FILE_LINK_EXPIRE_SECONDS = int(os.environ.get('FILE_LINK_EXPIRE_SECONDS', '900'))
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+# Question sets per assignment (get_questions and grading)
+QUESTION_CACHE_TTL_SECONDS = float(os.environ.get('QUESTION_CACHE_TTL_SECONDS', '300'))
+QUESTION_CACHE_MAX_SIZE = int(os.environ.get('QUESTION_CACHE_MAX_SIZE', '2000'))
+
+# Teacher quiz analytics, recomputed only when an assignment's answers change
+ANALYTICS_CACHE_MAX_SIZE = int(os.environ.get('ANALYTICS_CACHE_MAX_SIZE', '500'))
+ANALYTICS_CACHE_TTL_SECONDS = float(os.environ.get('ANALYTICS_CACHE_TTL_SECONDS', '3600'))
+
+# Branches, levels and subjects: serialized once and served from memory until
+# a create_* route changes them (or the TTL passes, for edits made in Mongo)
+REFERENCE_CACHE_TTL_SECONDS = float(os.environ.get('REFERENCE_CACHE_TTL_SECONDS', '3600'))
+# Browsers reuse them this long, then revalidate with If-None-Match (304 if unchanged)
+REFERENCE_MAX_AGE_SECONDS = int(os.environ.get('REFERENCE_MAX_AGE_SECONDS', '300'))
+
+# bcrypt work runs in a bounded thread pool so it never stalls the event loop
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '4'))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', '256'))
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+password_slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+password_pool_stats = {"queued": 0, "running": 0, "completed": 0, "rejected": 0, "max_queue_depth": 0}
+
+# Identity cache (get_current_user)
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '60'))
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', '10000'))
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -41,6 +101,231 @@ api_router = APIRouter(prefix="/api")
 # File upload directory
 UPLOAD_DIR = ROOT_DIR / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
+# Uploads are streamed to disk; anything larger than this is rejected mid-transfer
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(20 * 1024 * 1024)))
+# Bytes buffered before each (threaded) disk write and hash update
+UPLOAD_CHUNK_BYTES = int(os.environ.get('UPLOAD_CHUNK_BYTES', str(1024 * 1024)))
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', '4'))
+UPLOAD_ALLOWED_EXTENSIONS = set(
+    os.environ.get(
+        'UPLOAD_ALLOWED_EXTENSIONS',
+        'pdf,doc,docx,odt,rtf,txt,ppt,pptx,odp,xls,xlsx,ods,csv,jpg,jpeg,png,gif,webp,heic,heif,mp3,m4a,mp4,zip'
+    ).lower().split(',')
+)
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload")
+
+# Resumable uploads keep their partial data here, so it must be shared by all workers
+UPLOAD_SESSION_DIR = UPLOAD_DIR / "sessions"
+# Sessions expire this long after their last chunk (completed ones: after completion)
+UPLOAD_SESSION_TTL_SECONDS = float(os.environ.get('UPLOAD_SESSION_TTL_SECONDS', '86400'))
+# A PATCH holds its session for this long without progress before another may take over
+UPLOAD_SESSION_LOCK_SECONDS = float(os.environ.get('UPLOAD_SESSION_LOCK_SECONDS', '60'))
+UPLOAD_OFFSET_HEADER = "Upload-Offset"
+
+# Where upload content is kept: "local" (UPLOAD_DIR/blobs) or "s3". Content is
+# stored once per SHA-256; the S3 driver also hands out presigned URLs so
+# clients upload and download straight from the bucket. Point S3_ENDPOINT_URL
+# at MinIO or `moto_server` to run against a local stand-in.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+S3_BUCKET = os.environ.get('S3_BUCKET', '')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL') or None
+S3_REGION = os.environ.get('S3_REGION', 'us-east-1')
+S3_KEY_PREFIX = os.environ.get('S3_KEY_PREFIX', 'blobs/')
+# Direct uploads land here and are copied under S3_KEY_PREFIX once verified
+S3_STAGING_PREFIX = os.environ.get('S3_STAGING_PREFIX', 'incoming/')
+S3_PRESIGN_EXPIRES_SECONDS = int(os.environ.get('S3_PRESIGN_EXPIRES_SECONDS', '900'))
+# Unreferenced blobs are kept this long before gc_blobs.py deletes them
+BLOB_GC_GRACE_SECONDS = float(os.environ.get('BLOB_GC_GRACE_SECONDS', '86400'))
+# Behind nginx, hand local file bodies to it (sendfile, ranges) via
+# X-Accel-Redirect: set this to an `internal` location aliased to UPLOAD_DIR
+FILES_ACCEL_REDIRECT_PREFIX = os.environ.get('FILES_ACCEL_REDIRECT_PREFIX')
+FILES_SEND_CHUNK_BYTES = int(os.environ.get('FILES_SEND_CHUNK_BYTES', str(256 * 1024)))
+
+# Resized image variants: rendered in a process pool, cached on disk (LRU)
+IMAGE_CACHE_DIR = UPLOAD_DIR / "variants"
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', '2'))
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', '80'))
+# Spawned workers import only imaging.py (and never inherit the event loop's threads)
+image_executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+# Topic view counters are buffered in memory and flushed in one bulk_write
+VIEW_FLUSH_INTERVAL_SECONDS = float(os.environ.get('VIEW_FLUSH_INTERVAL_SECONDS', '10'))
+# Repeat views of a topic by the same user within this window count once (0 disables)
+VIEW_DEDUP_WINDOW_SECONDS = float(os.environ.get('VIEW_DEDUP_WINDOW_SECONDS', '300'))
+
+# Notification fan-out runs on background workers, inserting in chunks
+NOTIFICATION_FANOUT_WORKERS = int(os.environ.get('NOTIFICATION_FANOUT_WORKERS', '2'))
+NOTIFICATION_FANOUT_CHUNK_SIZE = int(os.environ.get('NOTIFICATION_FANOUT_CHUNK_SIZE', '500'))
+NOTIFICATION_FANOUT_DRAIN_SECONDS = float(os.environ.get('NOTIFICATION_FANOUT_DRAIN_SECONDS', '10'))
+
+# Live push channel: "local" delivers events within this worker only, "mongo"
+# shares them between workers through a capped collection
+EVENT_BROKER = os.environ.get('EVENT_BROKER', 'local')
+EVENT_BROKER_CAPPED_BYTES = int(os.environ.get('EVENT_BROKER_CAPPED_BYTES', str(16 * 1024 * 1024)))
+EVENT_SUBSCRIBER_QUEUE_SIZE = int(os.environ.get('EVENT_SUBSCRIBER_QUEUE_SIZE', '100'))
+SSE_KEEPALIVE_SECONDS = float(os.environ.get('SSE_KEEPALIVE_SECONDS', '15'))
+
+# Email delivery (disabled unless SMTP_HOST is set). For local testing point it
+# at a stand-in server, e.g. `python -m aiosmtpd -n -l localhost:1025`.
+SMTP_HOST = os.environ.get('SMTP_HOST')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
+SMTP_USERNAME = os.environ.get('SMTP_USERNAME')
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD')
+SMTP_USE_TLS = os.environ.get('SMTP_USE_TLS', 'false').lower() == 'true'
+SMTP_START_TLS = os.environ.get('SMTP_START_TLS', 'auto').lower()
+SMTP_FROM = os.environ.get('SMTP_FROM', 'KAAY-JANG <no-reply@kaayjang.com>')
+FRONTEND_URL = os.environ.get('FRONTEND_URL', '')
+EMAIL_WORKERS = int(os.environ.get('EMAIL_WORKERS', '2'))
+EMAIL_SMTP_POOL_SIZE = int(os.environ.get('EMAIL_SMTP_POOL_SIZE', '2'))
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', '20'))
+EMAIL_POLL_SECONDS = float(os.environ.get('EMAIL_POLL_SECONDS', '5'))
+# Items for the same recipient within this window are sent as one digest email
+EMAIL_DIGEST_WINDOW_SECONDS = float(os.environ.get('EMAIL_DIGEST_WINDOW_SECONDS', '300'))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get('EMAIL_MAX_ATTEMPTS', '5'))
+EMAIL_RETRY_BASE_SECONDS = float(os.environ.get('EMAIL_RETRY_BASE_SECONDS', '30'))
+EMAIL_LOCK_TIMEOUT_SECONDS = float(os.environ.get('EMAIL_LOCK_TIMEOUT_SECONDS', '300'))
+
+# List endpoints (keyset pagination)
+PAGE_SIZE_DEFAULT = int(os.environ.get('PAGE_SIZE_DEFAULT', '100'))
+# Posts, submissions and follows used to return up to 1000 items and the
+# frontend does not follow X-Next-Cursor yet, so they keep that default
+PAGE_SIZE_LONG_DEFAULT = int(os.environ.get('PAGE_SIZE_LONG_DEFAULT', '1000'))
+PAGE_SIZE_MAX = int(os.environ.get('PAGE_SIZE_MAX', '1000'))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Regrade jobs re-evaluate stored answers this many at a time
+REGRADE_BATCH_SIZE = int(os.environ.get('REGRADE_BATCH_SIZE', '1000'))
+
+# Gradebook exports read this many students per round trip
+GRADEBOOK_CHUNK_SIZE = int(os.environ.get('GRADEBOOK_CHUNK_SIZE', '200'))
+
+# Create the indexes declared in INDEX_MANIFEST on startup
+AUTO_CREATE_INDEXES = os.environ.get('AUTO_CREATE_INDEXES', 'true').lower() == 'true'
+
+# ============= Indexes =============
+# Every query filters on our own string ids, never on _id. Each entry lists the
+# key pattern and whether the code relies on it being unique.
+INDEX_MANIFEST = {
+    "users": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("email", ASCENDING)], "unique": True},
+        {"keys": [("role", ASCENDING), ("level_id", ASCENDING), ("name", ASCENDING), ("id", ASCENDING)]},
+        {"keys": [("role", ASCENDING), ("is_validated", ASCENDING)]},
+    ],
+    "notification_settings": [
+        {"keys": [("user_id", ASCENDING)], "unique": True},
+    ],
+    "branches": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+    ],
+    "levels": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("branch_id", ASCENDING)]},
+    ],
+    "subjects": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+    ],
+    "teacher_subjects": [
+        {"keys": [("teacher_id", ASCENDING)]},
+    ],
+    "topics": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("branch_id", ASCENDING), ("level_id", ASCENDING), ("subject_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        {"keys": [("level_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        {"keys": [("created_at", DESCENDING), ("id", DESCENDING)]},
+        {"keys": [("author_id", ASCENDING)]},
+    ],
+    "posts": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("topic_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)]},
+    ],
+    "follows": [
+        {"keys": [("follower_id", ASCENDING), ("followed_id", ASCENDING)], "unique": True},
+        {"keys": [("follower_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        {"keys": [("followed_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+    ],
+    "notifications": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("user_id", ASCENDING), ("created_at", DESCENDING)]},
+        {"keys": [("user_id", ASCENDING), ("read", ASCENDING), ("created_at", DESCENDING)]},
+    ],
+    "notification_counters": [
+        {"keys": [("user_id", ASCENDING)], "unique": True},
+    ],
+    "email_outbox": [
+        # At most one open (still collecting) digest per recipient
+        {"keys": [("to_email", ASCENDING)], "unique": True, "partial": {"status": "pending"}},
+        {"keys": [("status", ASCENDING), ("send_after", ASCENDING)]},
+    ],
+    "assignments": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("teacher_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        {"keys": [("level_id", ASCENDING), ("subject_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+        {"keys": [("level_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]},
+    ],
+    "questions": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("assignment_id", ASCENDING)]},
+    ],
+    "answers": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("assignment_id", ASCENDING), ("student_id", ASCENDING)]},
+        {"keys": [("student_id", ASCENDING)]},
+        # Regrades read a question's answers oldest first
+        {"keys": [("question_id", ASCENDING), ("created_at", ASCENDING)]},
+    ],
+    "regrade_jobs": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("teacher_id", ASCENDING), ("created_at", DESCENDING)]},
+    ],
+    "submissions": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("assignment_id", ASCENDING), ("student_id", ASCENDING)]},
+        {"keys": [("assignment_id", ASCENDING), ("submitted_at", ASCENDING), ("id", ASCENDING)]},
+    ],
+    "student_progress": [
+        {"keys": [("student_id", ASCENDING), ("assignment_id", ASCENDING)], "unique": True},
+        {"keys": [("student_id", ASCENDING), ("level_id", ASCENDING), ("completed", ASCENDING)]},
+        {"keys": [("assignment_id", ASCENDING)]},
+    ],
+    "ad_banners": [
+        {"keys": [("is_active", ASCENDING)]},
+    ],
+    "files": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("sha256", ASCENDING)]},
+    ],
+    "blobs": [
+        {"keys": [("sha256", ASCENDING)], "unique": True},
+        {"keys": [("refs", ASCENDING), ("unreferenced_at", ASCENDING)]},
+    ],
+    "upload_intents": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("expires_at", ASCENDING)], "ttl": 0},
+    ],
+    "upload_sessions": [
+        {"keys": [("id", ASCENDING)], "unique": True},
+        {"keys": [("expires_at", ASCENDING)]},
+    ],
+}
+
+async def ensure_indexes():
+    """Create every index in INDEX_MANIFEST. Existing indexes are left untouched."""
+    for collection_name, specs in INDEX_MANIFEST.items():
+        for spec in specs:
+            options = {"unique": spec.get("unique", False)}
+            if "partial" in spec:
+                options["partialFilterExpression"] = spec["partial"]
+            if "ttl" in spec:
+                options["expireAfterSeconds"] = spec["ttl"]
+            index = IndexModel(spec["keys"], **options)
+            try:
+                await db[collection_name].create_indexes([index])
+            except OperationFailure as e:
+                # Usually duplicates blocking a unique index; keep serving and let
+                # check_indexes.py surface it.
+                logger.error("Could not create index %s on %s: %s", index.document["name"], collection_name, e)
 
 # ============= Models =============
 class User(BaseModel):
@@ -171,6 +456,20 @@ class StudentAnswer(BaseModel):
     score: Optional[int] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class AnswerBatchItem(BaseModel):
+    question_id: str
+    answer_value: str
+
+class AnswerBatch(BaseModel):
+    assignment_id: str
+    answers: List[AnswerBatchItem]
+
+class AnswerBatchResult(BaseModel):
+    assignment_id: str
+    answers: List[StudentAnswer]
+    score: int
+    max_score: int
+
 class Submission(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -179,61 +478,2456 @@ class Submission(BaseModel):
     student_name: Optional[str] = None
     content: str  # Text content of the submission
     file_urls: Optional[List[str]] = []  # Uploaded files
+    upload_session_ids: List[str] = Field(default=[], exclude=True)  # Completed resumable uploads, added to file_urls
     submitted_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     grade: Optional[float] = None  # Grade given by teacher
     teacher_comment: Optional[str] = None  # Teacher's feedback
     graded_at: Optional[datetime] = None
     status: str = "submitted"  # submitted, graded
 
-class Follow(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    follower_id: str
-    followed_id: str
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+class GradeEntry(BaseModel):
+    submission_id: str
+    grade: float = Field(ge=0, le=20)  # Out of SUBMISSION_MAX_GRADE
+    teacher_comment: Optional[str] = None
+
+class GradeBatch(BaseModel):
+    grades: List[GradeEntry]
+
+class RegradeJob(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    question_id: str
+    assignment_id: str
+    teacher_id: str
+    status: str = "pending"  # pending, running, completed, failed, interrupted
+    total: int = 0
+    processed: int = 0
+    changed: int = 0
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    finished_at: Optional[datetime] = None
+
+class Follow(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    follower_id: str
+    followed_id: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class Notification(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    type: str  # new_post, new_assignment, new_follower, etc.
+    message: str
+    message_en: str
+    link: Optional[str] = None
+    read: bool = False
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class NotificationSettings(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    email_enabled: bool = True
+    in_app_enabled: bool = True
+    new_posts: bool = True
+    new_assignments: bool = True
+    new_followers: bool = True
+    forum_replies: bool = True
+
+class AdBanner(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    image_url: str
+    title: str
+    text: str
+    phone: Optional[str] = None
+    email: Optional[str] = None
+    link: Optional[str] = None
+    is_active: bool = True
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class FileUpload(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    filename: str
+    file_url: str
+    uploaded_by: str
+    file_type: str
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class DirectUploadRequest(BaseModel):
+    filename: str
+    content_type: Optional[str] = None
+    size: int = Field(ge=0)
+    sha256: str = Field(pattern="^[0-9a-f]{64}$")
+
+class PresignedRequest(BaseModel):
+    method: str
+    url: str
+    headers: dict
+
+class DirectUpload(BaseModel):
+    upload_id: Optional[str] = None
+    upload: Optional[PresignedRequest] = None  # None when the content is already stored
+    file_id: Optional[str] = None
+    file_url: Optional[str] = None
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    content_type: Optional[str] = None
+    size: int = Field(gt=0)
+    sha256: Optional[str] = Field(default=None, pattern="^[0-9a-f]{64}$")  # Checked on completion when given
+
+class UploadSession(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    filename: str
+    content_type: str
+    size: int
+    offset: int = 0  # Bytes received so far; the next PATCH starts here
+    status: str = "open"  # open, completed
+    expires_at: datetime
+    file_id: Optional[str] = None  # Set once completed
+    file_url: Optional[str] = None
+
+# ============= Caches =============
+class TTLCache:
+    """Bounded in-process LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+class BroadcastInvalidation:
+    """Runs `drop(key)` on every API worker when any of them calls invalidate(key).
+
+    The local drop is immediate; the others hear about it on the event
+    broker's `channel` (with EVENT_BROKER=mongo, through the shared
+    `events` collection).
+    """
+
+    def __init__(self, channel: str, drop):
+        self.channel = channel
+        self.drop = drop
+        self._queue = None
+        self._task = None
+
+    async def invalidate(self, key: Optional[str] = None):
+        self.drop(key)
+        await event_broker.publish(self.channel, {"type": "invalidate", "data": {"key": key}})
+
+    async def _listen(self):
+        while True:
+            event = await self._queue.get()
+            self.drop(event["data"]["key"])
+
+    def start(self):
+        if self._task is None:
+            self._queue = event_broker.subscribe([self.channel])
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            event_broker.unsubscribe(self._queue, [self.channel])
+
+class UserCache:
+    """Users by id, as resolved from access tokens.
+
+    Every write to `users` must await invalidate(), which drops the entry on
+    every worker (so a role or validation change applies everywhere at
+    once); as in QuestionCache, a version keeps a load that started before
+    the write from storing the old document.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.versions = {}
+        self.broadcast = BroadcastInvalidation("users", self._drop)
+
+    async def get(self, user_id: str) -> Optional[User]:
+        user = self.entries.get(user_id)
+        if user is not None:
+            return user
+        version = self.versions.get(user_id, 0)
+        doc = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
+        if doc is None:
+            return None
+        user = User(**doc)
+        if self.versions.get(user_id, 0) == version:
+            self.entries.set(user_id, user)
+        return user
+
+    def _drop(self, user_id: str):
+        self.versions[user_id] = self.versions.get(user_id, 0) + 1
+        self.entries.invalidate(user_id)
+
+    async def invalidate(self, user_id: str):
+        await self.broadcast.invalidate(user_id)
+
+    def start(self):
+        self.broadcast.start()
+
+    async def stop(self):
+        await self.broadcast.stop()
+
+    def stats(self) -> dict:
+        return self.entries.stats()
+
+user_cache = UserCache(maxsize=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+class QuestionCache:
+    """Question set of each assignment, shared by get_questions and grading.
+
+    Writes to `questions` must await invalidate(), which drops the entry on
+    every worker and bumps the assignment's version so a load that started
+    before the write cannot store its stale result. Cached lists are shared
+    and must not be mutated.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.versions = {}
+        self.broadcast = BroadcastInvalidation("questions", self._drop)
+
+    async def get(self, assignment_id: str) -> List[dict]:
+        questions = self.entries.get(assignment_id)
+        if questions is not None:
+            return questions
+        version = self.versions.get(assignment_id, 0)
+        questions = await db.questions.find({"assignment_id": assignment_id}, {"_id": 0}).to_list(None)
+        if self.versions.get(assignment_id, 0) == version:
+            self.entries.set(assignment_id, questions)
+        return questions
+
+    async def get_by_id(self, assignment_id: str) -> dict:
+        return {q["id"]: q for q in await self.get(assignment_id)}
+
+    def _drop(self, assignment_id: str):
+        self.versions[assignment_id] = self.versions.get(assignment_id, 0) + 1
+        self.entries.invalidate(assignment_id)
+
+    async def invalidate(self, assignment_id: str):
+        await self.broadcast.invalidate(assignment_id)
+
+    def start(self):
+        self.broadcast.start()
+
+    async def stop(self):
+        await self.broadcast.stop()
+
+    def stats(self) -> dict:
+        return self.entries.stats()
+
+question_cache = QuestionCache(maxsize=QUESTION_CACHE_MAX_SIZE, ttl=QUESTION_CACHE_TTL_SECONDS)
+
+class AnalyticsCache:
+    """Quiz analytics by assignment id, stored with the answer count they were computed from.
+
+    New answers change the count, which every read checks, so they are seen
+    whichever worker wrote them. Question writes and regrades keep the count
+    and must await invalidate(), which drops the entry on every worker; as in
+    QuestionCache, a version keeps a computation that raced with one of them
+    from being stored.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.versions = {}
+        self.broadcast = BroadcastInvalidation("analytics", self.discard)
+
+    async def get(self, assignment_id: str, compute) -> dict:
+        """Cached analytics for `assignment_id`, or the result of `await compute()`"""
+        answer_count = await db.answers.count_documents({"assignment_id": assignment_id})
+        cached = self.entries.get(assignment_id)
+        if cached is not None and cached[0] == answer_count:
+            return cached[1]
+        version = self.versions.get(assignment_id, 0)
+        analytics = await compute()
+        if self.versions.get(assignment_id, 0) == version:
+            self.entries.set(assignment_id, (answer_count, analytics))
+        return analytics
+
+    def discard(self, assignment_id: str):
+        """Drop the entry on this worker only (enough after an answer write)"""
+        self.versions[assignment_id] = self.versions.get(assignment_id, 0) + 1
+        self.entries.invalidate(assignment_id)
+
+    async def invalidate(self, assignment_id: str):
+        await self.broadcast.invalidate(assignment_id)
+
+    def start(self):
+        self.broadcast.start()
+
+    async def stop(self):
+        await self.broadcast.stop()
+
+    def stats(self) -> dict:
+        return self.entries.stats()
+
+analytics_cache = AnalyticsCache(maxsize=ANALYTICS_CACHE_MAX_SIZE, ttl=ANALYTICS_CACHE_TTL_SECONDS)
+
+class ReferenceDataCache:
+    """Branch, level and subject listings as ready-to-send JSON with an ETag.
+
+    The ETag is a hash of the body, so every worker hands out the same one.
+    Writes call invalidate(), which drops the cache here and publishes on the
+    event broker so the other workers drop theirs; as in QuestionCache, the
+    version keeps a load that raced with a write from being stored.
+    """
+
+    def __init__(self, ttl: float):
+        self.entries = TTLCache(maxsize=256, ttl=ttl)
+        self.version = 0
+        self.broadcast = BroadcastInvalidation("reference_data", self._drop)
+
+    async def get(self, collection: str, model, query: Optional[dict] = None) -> tuple:
+        """(body, etag) for the `collection` documents matching `query`"""
+        query = query or {}
+        key = (collection, tuple(sorted(query.items())))
+        entry = self.entries.get(key)
+        if entry is not None:
+            return entry
+        version = self.version
+        docs = await db[collection].find(query, {"_id": 0}).to_list(100)
+        body = encode_model_list(model, docs)
+        entry = (body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+        if self.version == version:
+            self.entries.set(key, entry)
+        return entry
+
+    def _drop(self, key=None):
+        self.version += 1
+        self.entries.invalidate()
+
+    async def invalidate(self):
+        await self.broadcast.invalidate()
+
+    def start(self):
+        self.broadcast.start()
+
+    async def stop(self):
+        await self.broadcast.stop()
+
+    def stats(self) -> dict:
+        return {**self.entries.stats(), "version": self.version}
+
+reference_cache = ReferenceDataCache(ttl=REFERENCE_CACHE_TTL_SECONDS)
+
+# ============= JSON Responses =============
+# Routes declare `response_model=List[...]`, so FastAPI validates every
+# document they return into a model and then serializes it again. For lists
+# the route loaded from Mongo itself, that validation is redundant: the route
+# keeps its response_model (the OpenAPI schema is unchanged) and returns a
+# ModelListResponse, which writes the same JSON directly with orjson.
+JSON_LEAF_TYPES = (str, int, float, bool, datetime, type(None))
+
+def _plain_json_type(annotation) -> bool:
+    """Whether orjson writes values of `annotation` exactly as Pydantic would"""
+    args = get_args(annotation)
+    if not args:
+        return annotation in JSON_LEAF_TYPES
+    return get_origin(annotation) in (list, dict, Union, UnionType) and all(_plain_json_type(arg) for arg in args)
+
+def _clean_types(annotation) -> tuple:
+    """Types a value of a plain `annotation` can have that validation keeps as is"""
+    if get_origin(annotation) in (Union, UnionType):
+        return tuple(t for arg in get_args(annotation) for t in _clean_types(arg))
+    if get_origin(annotation) is not None:
+        # Containers are only checked at the top level
+        return (get_origin(annotation),)
+    if annotation is float:
+        return (float, int)
+    return (annotation,)
+
+def compile_list_encoder(model):
+    """Encoder for lists of `model` documents: (docs) -> JSON bytes.
+
+    Each document is reduced to the model's fields in declaration order,
+    with defaults for missing ones and ints widened for float fields, as
+    validation would. A list holding any document validation would change
+    or reject (a date still stored as a string, a missing required field, a
+    value of another type) goes through a TypeAdapter instead, as do models
+    with fields orjson cannot reproduce (nested models, aliases,
+    constrained types).
+    """
+    adapter = TypeAdapter(List[model])
+    
+    def validate_and_encode(docs: List[dict]) -> bytes:
+        return adapter.dump_json(adapter.validate_python(docs))
+    
+    fields = []
+    for name, field in model.model_fields.items():
+        if field.exclude:
+            continue
+        if field.alias or field.serialization_alias or field.metadata or not _plain_json_type(field.annotation):
+            return validate_and_encode
+        default = None if field.is_required() else field.default_factory or (lambda value=field.default: value)
+        widen = field.annotation is float or float in get_args(field.annotation)
+        fields.append((name, default, widen, _clean_types(field.annotation)))
+    
+    def encode(docs: List[dict]) -> bytes:
+        rows = []
+        for doc in docs:
+            row = {}
+            for name, default, widen, types in fields:
+                if name in doc:
+                    value = doc[name]
+                    if type(value) not in types:
+                        return validate_and_encode(docs)
+                elif default is None:
+                    return validate_and_encode(docs)
+                else:
+                    value = default()
+                if widen and type(value) is int:
+                    value = float(value)
+                row[name] = value
+            rows.append(row)
+        return orjson.dumps(rows, option=orjson.OPT_UTC_Z)
+    return encode
+
+list_encoders = {}
+
+def encode_model_list(model, docs: List[dict]) -> bytes:
+    encoder = list_encoders.get(model)
+    if encoder is None:
+        encoder = list_encoders[model] = compile_list_encoder(model)
+    return encoder(docs)
+
+class ModelListResponse(Response):
+    """`docs` as the JSON body `response_model=List[model]` would produce.
+
+    Pass the route's injected `response` headers along (e.g. X-Next-Cursor):
+    FastAPI does not merge them into a Response the route returns itself.
+    """
+    media_type = "application/json"
+
+    def __init__(self, model, docs: List[dict], headers: Optional[Mapping[str, str]] = None):
+        self.model = model
+        super().__init__(docs, headers=headers)
+
+    def render(self, content: List[dict]) -> bytes:
+        return encode_model_list(self.model, content)
+
+# ============= Quiz Analytics =============
+def _metric(value, digits: int = 4):
+    """numpy scalar -> JSON-friendly float (None for NaN)."""
+    value = float(value)
+    return None if np.isnan(value) else round(value, digits)
+
+def compute_quiz_analytics(answers: List[dict], questions: List[dict]) -> dict:
+    """Item analysis of one quiz, computed column-wise over all its answers.
+
+    `answers` must be ordered by created_at; when a student answered a question
+    more than once, the last answer counts. Difficulty is the share of students
+    who answered correctly, discrimination the difference in that share between
+    the top and bottom 27% of students by total score.
+    """
+    question_ids = [q["id"] for q in questions]
+    max_score = int(sum(q["points"] for q in questions))
+    
+    df = pd.DataFrame.from_records(answers, columns=["student_id", "question_id", "answer_value", "is_correct", "score"])
+    df = df[df["question_id"].isin(question_ids)].drop_duplicates(["student_id", "question_id"], keep="last")
+    df["correct"] = df["is_correct"].eq(True).astype(np.int8)
+    df["score"] = pd.to_numeric(df["score"], errors="coerce").fillna(0)
+    
+    totals = df.groupby("student_id")["score"].sum()
+    scores = totals.to_numpy(dtype=float)
+    student_count = len(scores)
+    
+    # Students x questions matrices: 1 if correct / answered
+    def matrix(frame, column):
+        table = frame.pivot_table(index="student_id", columns="question_id", values=column, aggfunc="max", fill_value=0)
+        return table.reindex(index=totals.index, columns=question_ids, fill_value=0).to_numpy(dtype=float)
+    correct = matrix(df, "correct")
+    answered = matrix(df.assign(answered=1), "answered")
+    
+    answered_counts = answered.sum(axis=0)
+    correct_counts = correct.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        difficulty = np.where(answered_counts > 0, correct_counts / answered_counts, np.nan)
+    
+    if student_count >= 2:
+        group_size = max(1, int(round(student_count * 0.27)))
+        order = np.argsort(scores, kind="stable")
+        discrimination = correct[order[-group_size:]].mean(axis=0) - correct[order[:group_size]].mean(axis=0)
+    else:
+        discrimination = np.full(len(question_ids), np.nan)
+    
+    # Answer frequencies for MCQ questions, matched back to the option text
+    mcq = [q for q in questions if q.get("question_type") == "mcq" and q.get("options")]
+    mcq_answers = df[df["question_id"].isin([q["id"] for q in mcq])]
+    frequencies = mcq_answers.groupby([mcq_answers["question_id"], mcq_answers["answer_value"].astype(str).str.strip().str.lower()]).size()
+    counts_by_question = {}
+    for (question_id, value), count in frequencies.items():
+        counts_by_question.setdefault(question_id, {})[value] = int(count)
+    distractors = {}
+    for question in mcq:
+        counts = counts_by_question.get(question["id"], {})
+        options = {option.strip().lower(): option for option in question["options"]}
+        distractors[question["id"]] = {
+            "options": {option: int(counts.pop(key, 0)) for key, option in options.items()},
+            "other": int(sum(counts.values()))
+        }
+    
+    if student_count:
+        upper_bound = max(max_score, scores.max(), 1)
+        histogram, edges = np.histogram(scores, bins=10, range=(0, upper_bound))
+        percentiles = np.percentile(scores, [10, 25, 50, 75, 90])
+        score_distribution = {
+            "mean": _metric(scores.mean()),
+            "std": _metric(scores.std()),
+            "min": _metric(scores.min()),
+            "max": _metric(scores.max()),
+            "percentiles": {f"p{p}": _metric(v) for p, v in zip([10, 25, 50, 75, 90], percentiles)},
+            "histogram": [
+                {"from": _metric(edges[i]), "to": _metric(edges[i + 1]), "count": int(histogram[i])}
+                for i in range(len(histogram))
+            ]
+        }
+    else:
+        score_distribution = None
+    
+    return {
+        "students": student_count,
+        "max_score": max_score,
+        "score_distribution": score_distribution,
+        "questions": [
+            {
+                "question_id": question["id"],
+                "question_text": question["question_text"],
+                "points": question["points"],
+                "answered": int(answered_counts[i]),
+                "correct": int(correct_counts[i]),
+                "difficulty": _metric(difficulty[i]),
+                "discrimination": _metric(discrimination[i]),
+                "distractors": distractors.get(question["id"])
+            }
+            for i, question in enumerate(questions)
+        ]
+    }
+
+# ============= Gradebook Export =============
+# Gradebooks are streamed: students come off a cursor in chunks, the chunk's
+# student_progress documents are fetched in one query, and the encoded rows are
+# sent before the next chunk is read, so memory does not grow with the level.
+GRADEBOOK_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+async def gradebook_max_scores(assignments: List[dict]) -> tuple:
+    """({assignment id: max score}, {quiz id: its question ids})"""
+    quiz_ids = [a["id"] for a in assignments if a.get("assignment_type", "quiz") == "quiz"]
+    points = {}
+    question_ids = {quiz_id: [] for quiz_id in quiz_ids}
+    if quiz_ids:
+        pipeline = [
+            {"$match": {"assignment_id": {"$in": quiz_ids}}},
+            {"$group": {"_id": "$assignment_id", "points": {"$sum": "$points"}, "question_ids": {"$push": "$id"}}},
+        ]
+        async for row in db.questions.aggregate(pipeline):
+            points[row["_id"]] = row["points"]
+            question_ids[row["_id"]] = row["question_ids"]
+    max_scores = {
+        a["id"]: points.get(a["id"], 0) if a["id"] in question_ids else SUBMISSION_MAX_GRADE
+        for a in assignments
+    }
+    return max_scores, question_ids
+
+async def gradebook_quiz_scores(student_ids: List[str], question_ids: dict) -> dict:
+    """{(student id, quiz id): score} counting each student's last answer per question.
+
+    Read from `answers`, as compute_quiz_analytics does; student_progress
+    keeps its score by the same rule.
+    """
+    all_question_ids = [question_id for ids in question_ids.values() for question_id in ids]
+    if not all_question_ids:
+        return {}
+    pipeline = [
+        {"$match": {
+            "student_id": {"$in": student_ids},
+            "assignment_id": {"$in": list(question_ids)},
+            "question_id": {"$in": all_question_ids},
+        }},
+        {"$sort": {"created_at": ASCENDING}},
+        {"$group": {
+            "_id": {"student_id": "$student_id", "assignment_id": "$assignment_id", "question_id": "$question_id"},
+            "score": {"$last": "$score"},
+        }},
+        {"$group": {
+            "_id": {"student_id": "$_id.student_id", "assignment_id": "$_id.assignment_id"},
+            "score": {"$sum": {"$ifNull": ["$score", 0]}},
+        }},
+    ]
+    scores = {}
+    async for row in db.answers.aggregate(pipeline, allowDiskUse=True):
+        scores[(row["_id"]["student_id"], row["_id"]["assignment_id"])] = row["score"]
+    return scores
+
+async def gradebook_chunks(level_id: str, assignments: List[dict]):
+    """Yield the header, then lists of rows (one per student of the level)"""
+    max_scores, question_ids = await gradebook_max_scores(assignments)
+    assignment_ids = [a["id"] for a in assignments]
+    yield [["Student", "Email"] + [f"{a['title']} (/{max_scores[a['id']]})" for a in assignments] + ["Completed", "Average %"]]
+    
+    students = db.users.find(
+        {"role": "student", "level_id": level_id},
+        {"_id": 0, "id": 1, "name": 1, "email": 1}
+    ).sort([("name", ASCENDING), ("id", ASCENDING)]).batch_size(GRADEBOOK_CHUNK_SIZE)
+    
+    chunk = []
+    async for student in students:
+        chunk.append(student)
+        if len(chunk) < GRADEBOOK_CHUNK_SIZE:
+            continue
+        yield await gradebook_rows(chunk, assignment_ids, max_scores, question_ids)
+        chunk = []
+    if chunk:
+        yield await gradebook_rows(chunk, assignment_ids, max_scores, question_ids)
+
+async def gradebook_rows(students: List[dict], assignment_ids: List[str], max_scores: dict, question_ids: dict) -> List[list]:
+    student_ids = [s["id"] for s in students]
+    quiz_scores = await gradebook_quiz_scores(student_ids, question_ids)
+    # Progress says what was completed and holds submission grades
+    scores = dict(quiz_scores)
+    progress = db.student_progress.find(
+        {"student_id": {"$in": student_ids}, "assignment_id": {"$in": assignment_ids}},
+        {"_id": 0, "student_id": 1, "assignment_id": 1, "score": 1}
+    )
+    async for doc in progress:
+        key = (doc["student_id"], doc["assignment_id"])
+        scores[key] = quiz_scores.get(key, 0) if doc["assignment_id"] in question_ids else doc.get("score")
+    
+    rows = []
+    for student in students:
+        cells = [scores.get((student["id"], assignment_id)) for assignment_id in assignment_ids]
+        # Ungraded submissions are completed but have no score yet
+        completed = sum(1 for assignment_id in assignment_ids if (student["id"], assignment_id) in scores)
+        ratios = [
+            score / max_scores[assignment_id]
+            for assignment_id, score in zip(assignment_ids, cells)
+            if score is not None and max_scores[assignment_id]
+        ]
+        average = round(100 * sum(ratios) / len(ratios), 1) if ratios else None
+        rows.append([student["name"], student["email"]] + cells + [completed, average])
+    return rows
+
+# Spreadsheet software evaluates cells starting with these as formulas
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def csv_cell(value):
+    """Neutralize formulas in text cells (names come from self-registration)"""
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+async def stream_gradebook_csv(chunks):
+    # The BOM lets spreadsheet software detect UTF-8 (accented names)
+    yield "\ufeff".encode("utf-8")
+    async for rows in chunks:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([csv_cell(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable sink that zipfile writes into and we drain between chunks"""
+    def __init__(self):
+        self.chunks = []
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+XLSX_STATIC_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Gradebook" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+def xlsx_cell(value) -> str:
+    if value is None:
+        return "<c/>"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"<c><v>{value}</v></c>"
+    return f'<c t="inlineStr"><is><t>{xml_escape(str(value))}</t></is></c>'
+
+async def stream_gradebook_xlsx(chunks):
+    # A single-sheet workbook with inline strings, written straight into a
+    # zip stream (no openpyxl, no temporary file)
+    sink = _ChunkSink()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED)
+    for name, content in XLSX_STATIC_PARTS.items():
+        archive.writestr(name, content)
+    sheet = archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True)
+    sheet.write(
+        b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+    )
+    async for rows in chunks:
+        sheet.write("".join("<row>" + "".join(xlsx_cell(v) for v in row) + "</row>" for row in rows).encode("utf-8"))
+        data = sink.drain()
+        if data:
+            yield data
+    sheet.write(b"</sheetData></worksheet>")
+    sheet.close()
+    archive.close()
+    yield sink.drain()
+
+def gradebook_response(level_id: str, assignments: List[dict], export_format: str, filename: str) -> StreamingResponse:
+    chunks = gradebook_chunks(level_id, assignments)
+    body = stream_gradebook_csv(chunks) if export_format == "csv" else stream_gradebook_xlsx(chunks)
+    return StreamingResponse(
+        body,
+        media_type=GRADEBOOK_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format}"'}
+    )
+
+# ============= Write Coalescing =============
+class TopicViewCounter:
+    """Accumulates topic views in memory and flushes them with a single bulk_write."""
+
+    def __init__(self, flush_interval: float, dedup_window: float):
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.recent_views = TTLCache(maxsize=100000, ttl=dedup_window) if dedup_window > 0 else None
+        self.recorded = 0
+        self.deduplicated = 0
+        self.flushed = 0
+        self.flushes = 0
+        self._task = None
+
+    def record(self, topic_id: str, user_id: str):
+        if self.recent_views is not None:
+            if self.recent_views.get((user_id, topic_id)) is not None:
+                self.deduplicated += 1
+                return
+            self.recent_views.set((user_id, topic_id), True)
+        self.pending[topic_id] = self.pending.get(topic_id, 0) + 1
+        self.recorded += 1
+
+    def pending_for(self, topic_id: str) -> int:
+        return self.pending.get(topic_id, 0)
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        operations = [UpdateOne({"id": topic_id}, {"$inc": {"views_count": count}}) for topic_id, count in batch.items()]
+        try:
+            await db.topics.bulk_write(operations, ordered=False)
+        except Exception:
+            # Put the counts back so the next flush retries them
+            for topic_id, count in batch.items():
+                self.pending[topic_id] = self.pending.get(topic_id, 0) + count
+            raise
+        self.flushed += sum(batch.values())
+        self.flushes += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Topic view flush failed: %s", e)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the periodic flush and write out whatever is still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending_topics": len(self.pending),
+            "pending_views": sum(self.pending.values()),
+            "recorded": self.recorded,
+            "deduplicated": self.deduplicated,
+            "flushed": self.flushed,
+            "flushes": self.flushes
+        }
+
+topic_views = TopicViewCounter(flush_interval=VIEW_FLUSH_INTERVAL_SECONDS, dedup_window=VIEW_DEDUP_WINDOW_SECONDS)
+
+# ============= Event Broker =============
+class LocalEventBroker:
+    """In-process pub/sub feeding the live event stream.
+
+    Subscribers get a bounded queue; an event for a subscriber whose queue is
+    full is dropped (the client resyncs over REST when it reconnects).
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.subscribers = {}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, channels: List[str]) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        for channel in channels:
+            self.subscribers.setdefault(channel, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue, channels: List[str]):
+        for channel in channels:
+            queues = self.subscribers.get(channel)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self.subscribers[channel]
+
+    def _dispatch(self, channel: str, event: dict):
+        for queue in self.subscribers.get(channel, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    async def publish_many(self, events: List[tuple]):
+        """Publish (channel, event) pairs; an event is {"type": ..., "data": ...}."""
+        for channel, event in events:
+            self._dispatch(channel, event)
+        self.published += len(events)
+
+    async def publish(self, channel: str, event: dict):
+        await self.publish_many([(channel, event)])
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "backend": "local",
+            "channels": len(self.subscribers),
+            "subscriptions": sum(len(queues) for queues in self.subscribers.values()),
+            "published": self.published,
+            "dropped": self.dropped
+        }
+
+class MongoEventBroker(LocalEventBroker):
+    """Shares events between API workers through a capped `events` collection.
+
+    publish inserts into the collection; every worker (this one included) tails
+    it with a tailable cursor and dispatches what it reads to local subscribers.
+    """
+
+    def __init__(self, queue_size: int, capped_bytes: int):
+        super().__init__(queue_size)
+        self.capped_bytes = capped_bytes
+        self._task = None
+
+    async def publish_many(self, events: List[tuple]):
+        if not events:
+            return
+        await db.events.insert_many([{"channel": channel, "event": event} for channel, event in events], ordered=False)
+        self.published += len(events)
+
+    async def _tail(self):
+        last = await db.events.find_one({}, sort=[("$natural", -1)])
+        last_id = last["_id"] if last else ObjectId.from_datetime(datetime.now(timezone.utc))
+        while True:
+            try:
+                cursor = db.events.find({"_id": {"$gt": last_id}}, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for doc in cursor:
+                        last_id = doc["_id"]
+                        self._dispatch(doc["channel"], doc["event"])
+                    await asyncio.sleep(0.1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Event broker tail failed: %s", e)
+            await asyncio.sleep(1)
+
+    async def start(self):
+        try:
+            await db.create_collection("events", capped=True, size=self.capped_bytes)
+        except CollectionInvalid:
+            pass
+        if self._task is None:
+            self._task = asyncio.create_task(self._tail())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {**super().stats(), "backend": "mongo"}
+
+if EVENT_BROKER == "mongo":
+    event_broker = MongoEventBroker(queue_size=EVENT_SUBSCRIBER_QUEUE_SIZE, capped_bytes=EVENT_BROKER_CAPPED_BYTES)
+else:
+    event_broker = LocalEventBroker(queue_size=EVENT_SUBSCRIBER_QUEUE_SIZE)
+
+# ============= Email Delivery =============
+class SMTPConnectionPool:
+    """Keeps up to `size` authenticated SMTP connections open for reuse."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.idle = []
+        self.open_connections = 0
+        self.connects = 0
+        self._slots = asyncio.Semaphore(size)
+
+    async def _connect(self):
+        start_tls = None if SMTP_START_TLS == "auto" else SMTP_START_TLS == "true"
+        smtp = aiosmtplib.SMTP(
+            hostname=SMTP_HOST,
+            port=SMTP_PORT,
+            username=SMTP_USERNAME,
+            password=SMTP_PASSWORD,
+            use_tls=SMTP_USE_TLS,
+            start_tls=start_tls,
+            timeout=30,
+        )
+        await smtp.connect()
+        self.open_connections += 1
+        self.connects += 1
+        return smtp
+
+    async def acquire(self):
+        await self._slots.acquire()
+        try:
+            while self.idle:
+                smtp = self.idle.pop()
+                if smtp.is_connected:
+                    return smtp
+                self.open_connections -= 1
+            return await self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    async def release(self, smtp, healthy: bool = True):
+        if healthy and smtp.is_connected:
+            self.idle.append(smtp)
+        else:
+            self.open_connections -= 1
+            try:
+                smtp.close()
+            except Exception:
+                pass
+        self._slots.release()
+
+    async def close(self):
+        while self.idle:
+            smtp = self.idle.pop()
+            self.open_connections -= 1
+            try:
+                await smtp.quit()
+            except Exception:
+                smtp.close()
+
+class EmailOutbox:
+    """Durable email delivery through the `email_outbox` collection.
+
+    Each outbox document is one email to one recipient. Items queued for a
+    recipient are pushed onto their open ("pending") document until its
+    digest window ends, so a burst of forum replies becomes a single email.
+    Workers claim due documents, send them over pooled SMTP connections and
+    reschedule failures with exponential backoff; a document claimed by a
+    worker that died is reclaimed after EMAIL_LOCK_TIMEOUT_SECONDS.
+    """
+
+    def __init__(self, workers: int, pool_size: int, batch_size: int):
+        self.enabled = bool(SMTP_HOST)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.pool = SMTPConnectionPool(pool_size)
+        self.queued_items = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._tasks = []
+
+    async def enqueue(self, items: List[tuple]):
+        """Queue (to_email, {"subject": ..., "body": ...}) items for digest delivery."""
+        if not self.enabled or not items:
+            return
+        now = datetime.now(timezone.utc)
+        operations = [
+            UpdateOne(
+                {"to_email": to_email, "status": "pending"},
+                {
+                    "$push": {"items": item},
+                    "$setOnInsert": {
+                        "id": str(uuid.uuid4()),
+                        "attempts": 0,
+                        "created_at": now,
+                        "send_after": now + timedelta(seconds=EMAIL_DIGEST_WINDOW_SECONDS)
+                    }
+                },
+                upsert=True
+            )
+            for to_email, item in items
+        ]
+        try:
+            await db.email_outbox.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Two concurrent upserts for the same recipient: the loser hits the
+            # unique index, and retrying it now matches the winner's document.
+            failed = [operations[err["index"]] for err in e.details["writeErrors"] if err["code"] == 11000]
+            if len(failed) != len(e.details["writeErrors"]):
+                raise
+            await db.email_outbox.bulk_write(failed, ordered=False)
+        self.queued_items += len(items)
+
+    async def _claim(self):
+        now = datetime.now(timezone.utc)
+        return await db.email_outbox.find_one_and_update(
+            {"$or": [
+                {"status": {"$in": ["pending", "retry"]}, "send_after": {"$lte": now}},
+                {"status": "sending", "locked_at": {"$lt": now - timedelta(seconds=EMAIL_LOCK_TIMEOUT_SECONDS)}}
+            ]},
+            {"$set": {"status": "sending", "locked_at": now}, "$inc": {"attempts": 1}},
+            sort=[("send_after", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _build_message(self, doc: dict) -> EmailMessage:
+        items = doc["items"]
+        message = EmailMessage()
+        message["From"] = SMTP_FROM
+        message["To"] = doc["to_email"]
+        if len(items) == 1:
+            message["Subject"] = items[0]["subject"]
+            message.set_content(items[0]["body"])
+        else:
+            message["Subject"] = f"KAAY-JANG : {len(items)} nouvelles notifications / {len(items)} new notifications"
+            message.set_content("\n\n".join(item["body"] for item in items))
+        return message
+
+    async def _mark_failed(self, doc: dict, error: Exception, permanent: bool):
+        if permanent or doc["attempts"] >= EMAIL_MAX_ATTEMPTS:
+            update = {"status": "failed", "last_error": str(error)}
+            self.failed += 1
+        else:
+            delay = EMAIL_RETRY_BASE_SECONDS * 2 ** (doc["attempts"] - 1)
+            update = {
+                "status": "retry",
+                "send_after": datetime.now(timezone.utc) + timedelta(seconds=delay),
+                "last_error": str(error)
+            }
+            self.retried += 1
+        await db.email_outbox.update_one({"_id": doc["_id"]}, {"$set": update})
+
+    async def _send_batch(self, batch: List[dict]):
+        smtp = None
+        try:
+            for doc in batch:
+                if smtp is None:
+                    try:
+                        smtp = await self.pool.acquire()
+                    except Exception as e:
+                        await self._mark_failed(doc, e, permanent=False)
+                        continue
+                try:
+                    await smtp.send_message(self._build_message(doc))
+                except aiosmtplib.SMTPResponseException as e:
+                    # 5xx replies (unknown mailbox, rejected content) will not succeed on retry
+                    await self._mark_failed(doc, e, permanent=500 <= e.code < 600)
+                    continue
+                except (aiosmtplib.SMTPException, OSError) as e:
+                    await self._mark_failed(doc, e, permanent=False)
+                    await self.pool.release(smtp, healthy=False)
+                    smtp = None
+                    continue
+                await db.email_outbox.update_one(
+                    {"_id": doc["_id"]},
+                    {"$set": {"status": "sent", "sent_at": datetime.now(timezone.utc)}, "$unset": {"last_error": ""}}
+                )
+                self.sent += 1
+        finally:
+            if smtp is not None:
+                await self.pool.release(smtp)
+
+    async def _run(self):
+        while True:
+            try:
+                batch = []
+                while len(batch) < self.batch_size:
+                    doc = await self._claim()
+                    if doc is None:
+                        break
+                    batch.append(doc)
+                if not batch:
+                    await asyncio.sleep(EMAIL_POLL_SECONDS)
+                    continue
+                await self._send_batch(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Email worker error: %s", e)
+                await asyncio.sleep(EMAIL_POLL_SECONDS)
+
+    def start(self):
+        if self.enabled and not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.pool.close()
+
+    async def stats(self) -> dict:
+        stats = {
+            "enabled": self.enabled,
+            "workers": len(self._tasks),
+            "queued_items": self.queued_items,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "smtp_connections": self.pool.open_connections,
+            "smtp_connects": self.pool.connects
+        }
+        if self.enabled:
+            stats["backlog"] = await db.email_outbox.count_documents({"status": {"$in": ["pending", "retry", "sending"]}})
+        return stats
+
+email_outbox = EmailOutbox(workers=EMAIL_WORKERS, pool_size=EMAIL_SMTP_POOL_SIZE, batch_size=EMAIL_BATCH_SIZE)
+
+def notification_email_item(template: dict) -> dict:
+    link = f"\n{FRONTEND_URL}{template['link']}" if template.get("link") else ""
+    return {
+        "subject": f"KAAY-JANG : {template['message']}",
+        "body": f"{template['message']}\n{template['message_en']}{link}"
+    }
+
+# ============= Notification Fan-out =============
+# NotificationSettings flag that gates each notification type; types not
+# listed here are only subject to in_app_enabled.
+NOTIFICATION_SETTING_FLAGS = {
+    "new_post": "new_posts",
+    "new_assignment": "new_assignments",
+    "new_follower": "new_followers",
+    "forum_reply": "forum_replies",
+}
+
+class NotificationFanout:
+    """Background fan-out of notifications, off the request path.
+
+    Request handlers enqueue a job naming the recipients (a list of user ids,
+    or a query whose matching documents are streamed by the worker) and return
+    immediately. Workers resolve recipients in chunks, drop those whose
+    NotificationSettings opt out, and write each chunk with one insert_many.
+    Jobs live in memory, so a crash loses whatever has not been written yet.
+    """
+
+    def __init__(self, workers: int, chunk_size: int):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.queue = asyncio.Queue()
+        self.active_jobs = 0
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        self.delivered = 0
+        self.skipped_by_settings = 0
+        self.busy_seconds = 0.0
+        self._tasks = []
+
+    def enqueue(self, type: str, message: str, message_en: str, link: Optional[str] = None,
+                user_ids: Optional[List[str]] = None, source: Optional[tuple] = None):
+        """Queue a notification for `user_ids`, or for every document of `source`.
+
+        `source` is (collection name, query, field holding the recipient id).
+        """
+        template = {"type": type, "message": message, "message_en": message_en, "link": link}
+        self.queue.put_nowait({"template": template, "user_ids": user_ids, "source": source})
+
+    async def _recipient_chunks(self, job):
+        if job["user_ids"] is not None:
+            for i in range(0, len(job["user_ids"]), self.chunk_size):
+                yield job["user_ids"][i:i + self.chunk_size]
+            return
+        
+        collection_name, query, field = job["source"]
+        chunk = []
+        async for doc in db[collection_name].find(query, {"_id": 0, field: 1}).batch_size(self.chunk_size):
+            chunk.append(doc[field])
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    async def _deliver(self, user_ids: List[str], template: dict):
+        flag = NOTIFICATION_SETTING_FLAGS.get(template["type"])
+        settings = await db.notification_settings.find({"user_id": {"$in": user_ids}}, {"_id": 0}).to_list(None)
+        settings_by_user = {s["user_id"]: s for s in settings}
+        
+        def wants(user_id, channel):
+            # Users without a settings document get the defaults (everything on)
+            user_settings = settings_by_user.get(user_id, {})
+            return user_settings.get(channel, True) and (not flag or user_settings.get(flag, True))
+        
+        docs = [Notification(user_id=user_id, **template).model_dump() for user_id in user_ids if wants(user_id, "in_app_enabled")]
+        self.skipped_by_settings += len(user_ids) - len(docs)
+        if docs:
+            await db.notifications.insert_many(docs, ordered=False)
+            await increment_unread_counters([doc["user_id"] for doc in docs])
+            self.delivered += len(docs)
+            await event_broker.publish_many([
+                (f"user:{doc['user_id']}", {"type": "notification", "data": {k: v for k, v in doc.items() if k != "_id"}})
+                for doc in docs
+            ])
+        
+        if email_outbox.enabled:
+            email_ids = [user_id for user_id in user_ids if wants(user_id, "email_enabled")]
+            if email_ids:
+                try:
+                    recipients = await db.users.find({"id": {"$in": email_ids}}, {"_id": 0, "email": 1}).to_list(None)
+                    item = notification_email_item(template)
+                    await email_outbox.enqueue([(r["email"], item) for r in recipients if r.get("email")])
+                except Exception as e:
+                    logger.error("Could not queue %s emails: %s", template["type"], e)
+
+    async def _run(self):
+        while True:
+            job = await self.queue.get()
+            self.active_jobs += 1
+            started = time.monotonic()
+            try:
+                async for user_ids in self._recipient_chunks(job):
+                    await self._deliver(user_ids, job["template"])
+                self.jobs_completed += 1
+            except Exception as e:
+                self.jobs_failed += 1
+                logger.error("Notification fan-out failed for %s: %s", job["template"]["type"], e)
+            finally:
+                self.busy_seconds += time.monotonic() - started
+                self.active_jobs -= 1
+                self.queue.task_done()
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout: float):
+        """Give queued jobs up to `drain_timeout` seconds to finish, then stop the workers."""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Stopping notification fan-out with %d jobs still queued", self.queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued_jobs": self.queue.qsize(),
+            "active_jobs": self.active_jobs,
+            "jobs_completed": self.jobs_completed,
+            "jobs_failed": self.jobs_failed,
+            "delivered": self.delivered,
+            "skipped_by_settings": self.skipped_by_settings,
+            "notifications_per_second": round(self.delivered / self.busy_seconds, 1) if self.busy_seconds else 0.0
+        }
+
+notification_fanout = NotificationFanout(workers=NOTIFICATION_FANOUT_WORKERS, chunk_size=NOTIFICATION_FANOUT_CHUNK_SIZE)
+
+# Unread counts are kept in `notification_counters` ({user_id, unread}) so the
+# unread badge is a point read. A missing counter is seeded from
+# `notifications`, the source of truth; repair_notification_counters.py
+# fixes counters that drifted from it.
+async def seed_unread_counter(user_id: str) -> int:
+    """Create `user_id`'s counter from their unread notifications unless it exists; returns its value"""
+    count = await db.notifications.count_documents({"user_id": user_id, "read": False})
+    try:
+        counter = await db.notification_counters.find_one_and_update(
+            {"user_id": user_id},
+            {"$setOnInsert": {"unread": count}},
+            upsert=True,
+            projection={"_id": 0, "unread": 1},
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Another request created it at the same time
+        counter = await db.notification_counters.find_one({"user_id": user_id}, {"_id": 0, "unread": 1})
+    return counter.get("unread", 0)
+
+async def increment_unread_counters(user_ids: List[str]):
+    """Count new notifications, which must already be inserted"""
+    counts = {}
+    for user_id in user_ids:
+        counts[user_id] = counts.get(user_id, 0) + 1
+    existing = set()
+    async for counter in db.notification_counters.find({"user_id": {"$in": list(counts)}}, {"_id": 0, "user_id": 1}):
+        existing.add(counter["user_id"])
+    
+    operations = [
+        UpdateOne({"user_id": user_id}, {"$inc": {"unread": count}})
+        for user_id, count in counts.items()
+        if user_id in existing
+    ]
+    if operations:
+        await db.notification_counters.bulk_write(operations, ordered=False)
+    # Starting those at 0 would miss older unread notifications: seed from the
+    # collection instead (the count includes the new ones)
+    await asyncio.gather(*(seed_unread_counter(user_id) for user_id in counts if user_id not in existing))
+
+async def decrement_unread_counter(user_id: str, amount: int = 1):
+    # Pipeline update so a drifted counter never goes below zero
+    counter = await db.notification_counters.find_one_and_update(
+        {"user_id": user_id},
+        [{"$set": {"unread": {"$max": [0, {"$subtract": [{"$ifNull": ["$unread", 0]}, amount]}]}}}],
+        projection={"_id": 0, "unread": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if counter is not None:
+        # Keep the user's other open tabs in sync
+        await event_broker.publish(f"user:{user_id}", {"type": "unread_count", "data": {"count": counter["unread"]}})
+
+# ============= Regrading =============
+# Fields of a question that decide how its answers are graded
+GRADING_FIELDS = ("question_type", "options", "correct_answer", "points")
+
+class RegradeRunner:
+    """Re-grades the stored answers to a question after its grading fields change.
+
+    Jobs are persisted in `regrade_jobs` and run as background tasks, one at a
+    time per question. Answers are streamed oldest first and rewritten in
+    batches; each batch also stores each student's latest score for the
+    question in `student_progress` and reports progress to the teacher over
+    the event broker.
+    """
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.tasks = {}
+        self.locks = {}
+        self.completed = 0
+        self.failed = 0
+        self.answers_processed = 0
+        self.answers_changed = 0
+
+    async def submit(self, question: dict, teacher_id: str) -> RegradeJob:
+        job = RegradeJob(question_id=question["id"], assignment_id=question["assignment_id"], teacher_id=teacher_id)
+        await db.regrade_jobs.insert_one(job.model_dump())
+        task = asyncio.create_task(self._run(job))
+        self.tasks[job.id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(job.id, None))
+        return job
+
+    async def _run(self, job: RegradeJob):
+        # Jobs for the same question run in order; a later edit regrades last
+        entry = self.locks.setdefault(job.question_id, {"lock": asyncio.Lock(), "jobs": 0})
+        entry["jobs"] += 1
+        try:
+            async with entry["lock"]:
+                await self._regrade(job)
+            self.completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            logger.error("Regrade job %s failed: %s", job.id, e)
+            job.status, job.error = "failed", str(e)
+            await self._report(job, finished=True)
+        finally:
+            entry["jobs"] -= 1
+            if not entry["jobs"]:
+                self.locks.pop(job.question_id, None)
+
+    async def _regrade(self, job: RegradeJob):
+        question = await db.questions.find_one({"id": job.question_id}, {"_id": 0})
+        if question is None:
+            raise ValueError("Question not found")
+        
+        job.status = "running"
+        job.total = await db.answers.count_documents({"question_id": job.question_id})
+        await self._report(job)
+        
+        answers = db.answers.find(
+            {"question_id": job.question_id},
+            {"_id": 0, "id": 1, "student_id": 1, "answer_value": 1, "is_correct": 1, "score": 1}
+        ).sort("created_at", ASCENDING).batch_size(self.batch_size)
+        batch = []
+        async for answer in answers:
+            batch.append(answer)
+            if len(batch) >= self.batch_size:
+                await self._apply(job, question, batch)
+                batch = []
+        if batch:
+            await self._apply(job, question, batch)
+        
+        # Quiz progress is out of the sum of question points, which may have changed
+        questions = await question_cache.get(job.assignment_id)
+        await db.student_progress.update_many(
+            {"assignment_id": job.assignment_id, "answered_count": {"$exists": True}},
+            {"$set": {"max_score": sum(q["points"] for q in questions)}}
+        )
+        await analytics_cache.invalidate(job.assignment_id)
+        
+        job.status = "completed"
+        await self._report(job, finished=True)
+
+    async def _apply(self, job: RegradeJob, question: dict, batch: List[dict]):
+        operations = []
+        latest_scores = {}
+        for answer in batch:
+            is_correct, score = grade_answer(answer["answer_value"], question)
+            # Answers come oldest first, so the last one seen per student counts
+            latest_scores[answer["student_id"]] = score
+            if is_correct == answer.get("is_correct") and score == answer.get("score"):
+                continue
+            operations.append(UpdateOne({"id": answer["id"]}, {"$set": {"is_correct": is_correct, "score": score}}))
+        
+        if operations:
+            await db.answers.bulk_write(operations, ordered=False)
+        if latest_scores:
+            await db.student_progress.bulk_write([
+                UpdateOne(
+                    {"student_id": student_id, "assignment_id": job.assignment_id},
+                    {"$set": {f"scores.{question['id']}": score}}
+                )
+                for student_id, score in latest_scores.items()
+            ], ordered=False)
+            await db.student_progress.update_many(
+                {"student_id": {"$in": list(latest_scores)}, "assignment_id": job.assignment_id},
+                PROGRESS_TOTALS_UPDATE
+            )
+        
+        job.processed += len(batch)
+        job.changed += len(operations)
+        self.answers_processed += len(batch)
+        self.answers_changed += len(operations)
+        await self._report(job)
+
+    async def _report(self, job: RegradeJob, finished: bool = False):
+        if finished:
+            job.finished_at = datetime.now(timezone.utc)
+        fields = {k: getattr(job, k) for k in ("status", "total", "processed", "changed", "error", "finished_at")}
+        await db.regrade_jobs.update_one({"id": job.id}, {"$set": fields})
+        await event_broker.publish(f"user:{job.teacher_id}", {"type": "regrade_progress", "data": jsonable_encoder(job)})
+
+    async def stop(self):
+        """Cancel running jobs; they are left marked as interrupted."""
+        job_ids = list(self.tasks)
+        for task in list(self.tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        if job_ids:
+            await db.regrade_jobs.update_many(
+                {"id": {"$in": job_ids}},
+                {"$set": {"status": "interrupted", "finished_at": datetime.now(timezone.utc)}}
+            )
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self.tasks),
+            "completed": self.completed,
+            "failed": self.failed,
+            "answers_processed": self.answers_processed,
+            "answers_changed": self.answers_changed
+        }
+
+regrade_runner = RegradeRunner(batch_size=REGRADE_BATCH_SIZE)
+
+# ============= Uploads =============
+# Multipart bodies allow for some framing around the file itself
+UPLOAD_FORM_OVERHEAD_BYTES = 64 * 1024
+
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "required": ["file"],
+            "properties": {"file": {"type": "string", "format": "binary"}}
+        }}}
+    }
+}
+
+upload_stats = {"completed": 0, "bytes": 0, "seconds": 0.0, "too_large": 0, "bad_type": 0, "aborted": 0}
+
+def upload_extension(filename: str) -> str:
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if extension not in UPLOAD_ALLOWED_EXTENSIONS:
+        upload_stats["bad_type"] += 1
+        raise HTTPException(status_code=415, detail=f"File type not allowed: .{extension}" if extension else "File type not allowed")
+    return extension
+
+class UploadWriter:
+    """Writes one uploaded file to a temporary path, hashing it on the way.
+
+    Data is buffered up to UPLOAD_CHUNK_BYTES and each chunk is written and
+    hashed on `upload_executor`, so the event loop only copies bytes around.
+    """
+
+    def __init__(self, filename: str, content_type: Optional[str]):
+        self.filename = filename
+        self.content_type = content_type
+        self.extension = upload_extension(filename)
+        self.path = UPLOAD_DIR / f".{uuid.uuid4()}.part"
+        self.size = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self.sha256 = None
+        self._buffer = bytearray()
+        self._file = None
+        self._digest = hashlib.sha256()
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > UPLOAD_MAX_BYTES:
+            upload_stats["too_large"] += 1
+            raise HTTPException(status_code=413, detail=f"File too large (max {UPLOAD_MAX_BYTES} bytes)")
+        self._buffer += data
+        if len(self._buffer) >= UPLOAD_CHUNK_BYTES:
+            await self._flush()
+
+    def _write_chunk(self, data: bytes):
+        if self._file is None:
+            self._file = open(self.path, "wb")
+        self._file.write(data)
+        self._digest.update(data)
+
+    async def _flush(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        await asyncio.get_running_loop().run_in_executor(upload_executor, self._write_chunk, data)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+
+    async def finish(self):
+        """Write what is left and close the file; sets `sha256`."""
+        await self._flush()
+        await asyncio.get_running_loop().run_in_executor(upload_executor, self._close)
+        self.sha256 = self._digest.hexdigest()
+        self.seconds = time.perf_counter() - self.started
+        upload_stats["completed"] += 1
+        upload_stats["bytes"] += self.size
+        upload_stats["seconds"] += self.seconds
+
+    async def discard(self):
+        def remove():
+            self._close()
+            self.path.unlink(missing_ok=True)
+        await asyncio.get_running_loop().run_in_executor(upload_executor, remove)
+
+    def throughput(self) -> float:
+        """Bytes per second over the whole transfer"""
+        return self.size / self.seconds if self.seconds else 0.0
+
+async def receive_upload(request: Request, field: str = "file") -> UploadWriter:
+    """Stream the `field` file of a multipart request to disk.
+
+    The body is parsed as it arrives instead of being spooled first, so the
+    size limit stops an oversized upload early. The caller owns the returned
+    writer's temporary file (move it into place or discard it).
+    """
+    media_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if media_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data body")
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD_BYTES:
+        upload_stats["too_large"] += 1
+        raise HTTPException(status_code=413, detail=f"File too large (max {UPLOAD_MAX_BYTES} bytes)")
+    
+    # Parser callbacks are synchronous: record events, then act on them
+    events = []
+    header = {"field": bytearray(), "value": bytearray(), "headers": {}}
+    
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+    
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+    
+    def on_header_end():
+        header["headers"][bytes(header["field"]).lower()] = bytes(header["value"])
+        header["field"], header["value"] = bytearray(), bytearray()
+    
+    def on_headers_finished():
+        events.append(("headers", header["headers"]))
+        header["headers"] = {}
+    
+    def on_part_data(data, start, end):
+        events.append(("data", bytes(data[start:end])))
+    
+    def on_part_end():
+        events.append(("end", None))
+    
+    callbacks = {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    }
+    parser = MultipartParser(params[b"boundary"], callbacks)
+    
+    writer = None
+    receiving = False
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for kind, payload in events:
+                if kind == "headers":
+                    _, disposition = parse_options_header(payload.get(b"content-disposition", b""))
+                    receiving = (
+                        writer is None
+                        and disposition.get(b"name") == field.encode()
+                        and b"filename" in disposition
+                    )
+                    if receiving:
+                        content_type = payload.get(b"content-type")
+                        writer = UploadWriter(
+                            disposition[b"filename"].decode("utf-8", "replace"),
+                            content_type.decode("latin-1") if content_type else None
+                        )
+                elif kind == "data" and receiving:
+                    await writer.write(payload)
+                elif kind == "end":
+                    receiving = False
+            events.clear()
+        parser.finalize()
+        
+        if writer is None:
+            raise HTTPException(status_code=400, detail=f"Missing file field '{field}'")
+        await writer.finish()
+        return writer
+    except BaseException as e:
+        if isinstance(e, ClientDisconnect):
+            upload_stats["aborted"] += 1
+        if writer is not None:
+            await writer.discard()
+        raise
+
+# ============= Storage =============
+# Upload content lives in a blob store keyed by SHA-256. Each key has a
+# `blobs` document ({sha256, size, refs, stored}) counting the `files`
+# records that point at it; identical uploads share one blob. Blobs whose
+# count drops to zero are deleted by gc_blobs.py after BLOB_GC_GRACE_SECONDS.
+blob_stats = {"stored": 0, "deduplicated": 0, "released": 0}
+
+def content_disposition(filename: str, inline: bool = False) -> str:
+    return f"{'inline' if inline else 'attachment'}; filename*=UTF-8''{quote(filename)}"
+
+class LocalStorage:
+    """Blobs as files under `root`, fanned out by their first two hex digits."""
+
+    name = "local"
+    direct_uploads = False
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(upload_executor, func, *args)
+
+    async def put(self, key: str, source: Path, content_type: Optional[str]):
+        def move():
+            target = self.path(key)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(source, target)
+        await self._run(move)
+
+    async def stat(self, key: str) -> Optional[dict]:
+        def stat():
+            try:
+                return {"size": self.path(key).stat().st_size, "sha256": None}
+            except FileNotFoundError:
+                return None
+        return await self._run(stat)
+
+    async def delete(self, key: str):
+        await self._run(lambda: self.path(key).unlink(missing_ok=True))
+
+    async def list_keys(self) -> List[tuple]:
+        """(key, last modified) for every stored blob"""
+        def scan():
+            return [
+                (path.name, datetime.fromtimestamp(path.stat().st_mtime, timezone.utc))
+                for path in self.root.glob("??/*")
+            ]
+        return await self._run(scan)
+
+    async def list_staged(self) -> List[tuple]:
+        # No direct uploads; partial uploads are UPLOAD_DIR/.*.part files
+        return []
+
+    async def fetch_local(self, key: str) -> tuple:
+        """(path of a local copy, whether it is a temporary download)"""
+        return self.path(key), False
+
+class S3Storage:
+    """Blobs as objects in an S3-compatible bucket.
+
+    boto3 is synchronous, so every call runs on `upload_executor`. Clients
+    can bypass the API: they PUT to a staging key through a presigned URL, the
+    object is verified against its SHA-256 and copied under its content key
+    inside the bucket, and downloads redirect to a presigned GET.
+    """
+
+    name = "s3"
+    direct_uploads = True
+
+    def __init__(self, bucket: str, prefix: str, staging_prefix: str, endpoint_url: Optional[str], region: str, expires: int):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.staging_prefix = staging_prefix
+        self.expires = expires
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=BotoConfig(signature_version="s3v4")
+        )
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(upload_executor, func, *args)
+
+    def _head(self, object_key: str) -> Optional[dict]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=object_key, ChecksumMode="ENABLED")
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        checksum = head.get("ChecksumSHA256")
+        # Multipart checksums ("...-3") are not a hash of the whole object
+        sha256 = base64.b64decode(checksum).hex() if checksum and "-" not in checksum else None
+        return {"size": head["ContentLength"], "sha256": sha256}
+
+    def _list(self, prefix: str) -> List[tuple]:
+        keys = []
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend((obj["Key"][len(prefix):], obj["LastModified"]) for obj in page.get("Contents", []))
+        return keys
+
+    async def put(self, key: str, source: Path, content_type: Optional[str]):
+        def upload():
+            self.client.upload_file(
+                str(source), self.bucket, self.prefix + key,
+                ExtraArgs={"ContentType": content_type or "application/octet-stream"}
+            )
+            source.unlink(missing_ok=True)
+        await self._run(upload)
+
+    async def stat(self, key: str) -> Optional[dict]:
+        return await self._run(self._head, self.prefix + key)
+
+    async def fetch_local(self, key: str) -> tuple:
+        path = UPLOAD_DIR / f".{uuid.uuid4()}.part"
+        await self._run(self.client.download_file, self.bucket, self.prefix + key, str(path))
+        return path, True
+
+    async def delete(self, key: str):
+        await self._run(lambda: self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key))
+
+    async def list_keys(self) -> List[tuple]:
+        return await self._run(self._list, self.prefix)
+
+    def presigned_put(self, upload_id: str, content_type: str, size: int, sha256: str) -> dict:
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        url = self.client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self.staging_prefix + upload_id,
+                "ContentType": content_type,
+                "ContentLength": size,
+                "ChecksumSHA256": checksum,
+            },
+            ExpiresIn=self.expires
+        )
+        return {"method": "PUT", "url": url, "headers": {"Content-Type": content_type, "x-amz-checksum-sha256": checksum}}
+
+    async def stat_staged(self, upload_id: str) -> Optional[dict]:
+        return await self._run(self._head, self.staging_prefix + upload_id)
+
+    async def hash_staged(self, upload_id: str) -> str:
+        """SHA-256 of a staged upload, for stores that did not check the signed checksum"""
+        def read():
+            digest = hashlib.sha256()
+            body = self.client.get_object(Bucket=self.bucket, Key=self.staging_prefix + upload_id)["Body"]
+            for chunk in body.iter_chunks(UPLOAD_CHUNK_BYTES):
+                digest.update(chunk)
+            return digest.hexdigest()
+        return await self._run(read)
+
+    async def promote(self, upload_id: str, key: str):
+        """Copy a verified staged upload to its content key (server-side) and drop it"""
+        def copy():
+            self.client.copy(
+                {"Bucket": self.bucket, "Key": self.staging_prefix + upload_id},
+                self.bucket, self.prefix + key
+            )
+            self.client.delete_object(Bucket=self.bucket, Key=self.staging_prefix + upload_id)
+        await self._run(copy)
+
+    async def discard_staged(self, upload_id: str):
+        await self._run(lambda: self.client.delete_object(Bucket=self.bucket, Key=self.staging_prefix + upload_id))
+
+    async def list_staged(self) -> List[tuple]:
+        return await self._run(self._list, self.staging_prefix)
+
+    def presigned_get(self, key: str, filename: str, content_type: str) -> str:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self.prefix + key,
+                "ResponseContentType": content_type,
+                "ResponseContentDisposition": content_disposition(filename),
+            },
+            ExpiresIn=self.expires
+        )
+
+if STORAGE_BACKEND == "s3":
+    storage = S3Storage(S3_BUCKET, S3_KEY_PREFIX, S3_STAGING_PREFIX, S3_ENDPOINT_URL, S3_REGION, S3_PRESIGN_EXPIRES_SECONDS)
+else:
+    storage = LocalStorage(UPLOAD_DIR / "blobs")
+
+async def acquire_blob(sha256: str, size: int, store, discard):
+    """Take a reference on the blob for `sha256`.
+
+    If the content is not stored yet `store()` puts it into storage,
+    otherwise `discard()` drops the caller's copy.
+    """
+    for _ in range(50):
+        try:
+            blob = await db.blobs.find_one_and_update(
+                {"sha256": sha256, "deleting": {"$ne": True}},
+                {
+                    "$inc": {"refs": 1},
+                    "$unset": {"unreferenced_at": ""},
+                    "$setOnInsert": {"size": size, "stored": False, "created_at": datetime.now(timezone.utc)}
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            break
+        except DuplicateKeyError:
+            # gc_blobs.py is deleting this blob; the upsert succeeds once it is gone
+            await asyncio.sleep(0.1)
+    else:
+        await discard()
+        raise HTTPException(status_code=503, detail="Storage busy, please retry")
+    
+    if blob["stored"]:
+        blob_stats["deduplicated"] += 1
+        await discard()
+        return
+    
+    try:
+        await store()
+    except BaseException:
+        await release_blob(sha256)
+        await discard()
+        raise
+    await db.blobs.update_one({"sha256": sha256}, {"$set": {"stored": True}})
+    blob_stats["stored"] += 1
+
+async def reference_stored_blob(sha256: str, size: int) -> bool:
+    """Take a reference on `sha256` only if its content is already stored"""
+    blob = await db.blobs.find_one_and_update(
+        {"sha256": sha256, "size": size, "stored": True, "deleting": {"$ne": True}},
+        {"$inc": {"refs": 1}, "$unset": {"unreferenced_at": ""}}
+    )
+    if blob is None:
+        return False
+    blob_stats["deduplicated"] += 1
+    return True
+
+async def release_blob(sha256: str):
+    # Pipeline update so the time the count reached zero is recorded atomically
+    await db.blobs.update_one({"sha256": sha256}, [
+        {"$set": {"refs": {"$subtract": ["$refs", 1]}}},
+        {"$set": {"unreferenced_at": {"$cond": [{"$lte": ["$refs", 0]}, "$$NOW", "$unreferenced_at"]}}},
+    ])
+    blob_stats["released"] += 1
+
+async def create_file_record(current_user: User, filename: str, content_type: Optional[str], size: int, sha256: str) -> FileUpload:
+    file_id = str(uuid.uuid4())
+    file_upload = FileUpload(
+        id=file_id,
+        filename=filename,
+        file_url=f"/api/files/{file_id}",
+        uploaded_by=current_user.id,
+        file_type=content_type or "unknown",
+        size=size,
+        sha256=sha256
+    )
+    await db.files.insert_one(file_upload.model_dump())
+    return file_upload
+
+# ============= Resumable Uploads =============
+# POST /upload/sessions opens a session for a file of known size, then the
+# client PATCHes consecutive chunks, each starting at the session's offset
+# (Upload-Offset header). The offset is recorded after every
+# UPLOAD_CHUNK_BYTES written, so a dropped connection or a restarted worker
+# loses at most one chunk: GET the session and continue from its offset. The
+# PATCH carrying the last byte stores the file like POST /upload does.
+# gc_blobs.py deletes expired sessions and their partial data.
+UPLOAD_CHUNK_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/offset+octet-stream": {"schema": {"type": "string", "format": "binary"}}}
+    }
+}
+
+def upload_session_path(session_id: str) -> Path:
+    return UPLOAD_SESSION_DIR / f"{session_id}.part"
+
+async def claim_upload_session(session_id: str, user_id: str, offset: int) -> dict:
+    """Lock an open session for one PATCH starting at `offset`.
+
+    The lock expires after UPLOAD_SESSION_LOCK_SECONDS without progress, so
+    a session held by a worker that died becomes writable again.
+    """
+    now = datetime.now(timezone.utc)
+    session = await db.upload_sessions.find_one_and_update(
+        {
+            "id": session_id,
+            "user_id": user_id,
+            "status": "open",
+            "offset": offset,
+            "expires_at": {"$gt": now},
+            "locked_until": {"$not": {"$gt": now}},
+        },
+        {"$set": {"locked_until": now + timedelta(seconds=UPLOAD_SESSION_LOCK_SECONDS)}},
+        projection={"_id": 0}
+    )
+    if session:
+        return session
+    
+    session = await db.upload_sessions.find_one({"id": session_id, "user_id": user_id}, {"_id": 0})
+    if not session or (session["status"] == "open" and session["expires_at"] <= now):
+        raise HTTPException(status_code=404, detail="Upload session not found or expired")
+    if session["status"] != "open":
+        raise HTTPException(status_code=409, detail="Upload session is already complete")
+    if session["offset"] != offset:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Upload-Offset should be {session['offset']}",
+            headers={UPLOAD_OFFSET_HEADER: str(session["offset"])}
+        )
+    raise HTTPException(status_code=409, detail="Another chunk of this upload is in progress")
+
+class UploadSessionWriter:
+    """Writes one PATCH body into a session's partial file at its offset.
+
+    Like UploadWriter, data is buffered up to UPLOAD_CHUNK_BYTES and written
+    on `upload_executor`. After each write the new offset is recorded (and
+    the session's lock and expiry pushed back), so whatever reached the disk
+    counts even if the client disconnects halfway through.
+    """
+
+    def __init__(self, session: dict):
+        self.session_id = session["id"]
+        self.path = upload_session_path(session["id"])
+        self.offset = self.start = session["offset"]
+        self.limit = session["size"]
+        self.started = time.perf_counter()
+        self._buffer = bytearray()
+        self._file = None
+
+    async def write(self, data: bytes):
+        if self.offset + len(self._buffer) + len(data) > self.limit:
+            upload_stats["too_large"] += 1
+            raise HTTPException(status_code=413, detail=f"Chunk goes past the declared size of {self.limit} bytes")
+        self._buffer += data
+        if len(self._buffer) >= UPLOAD_CHUNK_BYTES:
+            await self._flush()
+
+    def _open_file(self) -> int:
+        UPLOAD_SESSION_DIR.mkdir(exist_ok=True)
+        self._file = open(self.path, "r+b" if self.path.exists() else "w+b")
+        on_disk = self._file.seek(0, os.SEEK_END)
+        if on_disk >= self.offset:
+            # Bytes past the recorded offset were never acknowledged
+            self._file.seek(self.offset)
+            self._file.truncate()
+        return on_disk
+
+    async def open(self):
+        """Open the partial file, which must hold every byte before the offset.
+
+        If some were lost (the file was removed or cut short), seeking past
+        its end would leave a hole of zeros; instead the session goes back to
+        the bytes still on disk and the client is told to resume from there.
+        """
+        loop = asyncio.get_running_loop()
+        on_disk = await loop.run_in_executor(upload_executor, self._open_file)
+        if on_disk < self.offset:
+            await loop.run_in_executor(upload_executor, self._file.close)
+            self._file = None
+            await db.upload_sessions.update_one({"id": self.session_id}, {"$set": {"offset": on_disk}})
+            raise HTTPException(
+                status_code=409,
+                detail="Part of the uploaded data was lost; resume from Upload-Offset",
+                headers={UPLOAD_OFFSET_HEADER: str(on_disk)}
+            )
+
+    def _write_chunk(self, data: bytes):
+        self._file.write(data)
+        self._file.flush()
+
+    async def _flush(self):
+        if not self._buffer:
+            return
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        await asyncio.get_running_loop().run_in_executor(upload_executor, self._write_chunk, data)
+        self.offset += len(data)
+        now = datetime.now(timezone.utc)
+        await db.upload_sessions.update_one({"id": self.session_id}, {"$set": {
+            "offset": self.offset,
+            "locked_until": now + timedelta(seconds=UPLOAD_SESSION_LOCK_SECONDS),
+            "expires_at": now + timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS),
+        }})
+
+    async def finish(self, keep_buffer: bool = True):
+        """Record what is left (unless `keep_buffer` is False) and close the file."""
+        if keep_buffer:
+            await self._flush()
+        self._buffer.clear()
+        if self._file is not None:
+            await asyncio.get_running_loop().run_in_executor(upload_executor, self._file.close)
+        upload_stats["bytes"] += self.offset - self.start
+        upload_stats["seconds"] += time.perf_counter() - self.started
+
+async def receive_session_chunk(request: Request, session: dict) -> int:
+    """Append the request body to `session`; returns the new offset."""
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and session["offset"] + int(declared) > session["size"]:
+        upload_stats["too_large"] += 1
+        raise HTTPException(status_code=413, detail=f"Chunk goes past the declared size of {session['size']} bytes")
+    
+    writer = UploadSessionWriter(session)
+    await writer.open()
+    try:
+        async for chunk in request.stream():
+            await writer.write(chunk)
+    except HTTPException:
+        await writer.finish(keep_buffer=False)
+        raise
+    except ClientDisconnect:
+        # Keep the partial chunk: the client resumes from the recorded offset
+        upload_stats["aborted"] += 1
+        await writer.finish()
+        raise
+    await writer.finish()
+    return writer.offset
+
+async def complete_upload_session(session: dict, current_user: User) -> dict:
+    """Store a fully received session as a blob and file record."""
+    path = upload_session_path(session["id"])
+    loop = asyncio.get_running_loop()
+    
+    def digest():
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+    
+    def remove():
+        path.unlink(missing_ok=True)
+    
+    async def restart(detail: str):
+        await loop.run_in_executor(upload_executor, remove)
+        await db.upload_sessions.update_one({"id": session["id"]}, {"$set": {"offset": 0}})
+        raise HTTPException(status_code=409, detail=detail, headers={UPLOAD_OFFSET_HEADER: "0"})
+    
+    try:
+        sha256 = await loop.run_in_executor(upload_executor, digest)
+    except FileNotFoundError:
+        await restart("Uploaded data was lost; upload the file again")
+    if session.get("sha256") and sha256 != session["sha256"]:
+        # Some chunk was corrupted; there is no telling which, so start over
+        await restart("Uploaded content does not match its SHA-256; upload it again")
+    
+    try:
+        await acquire_blob(
+            sha256, session["size"],
+            store=lambda: storage.put(sha256, path, session["content_type"]),
+            discard=lambda: loop.run_in_executor(upload_executor, remove)
+        )
+    except BaseException:
+        # acquire_blob dropped the data along with its reference
+        await db.upload_sessions.update_one({"id": session["id"]}, {"$set": {"offset": 0}})
+        raise
+    try:
+        file_upload = await create_file_record(current_user, session["filename"], session["content_type"], session["size"], sha256)
+    except BaseException:
+        await release_blob(sha256)
+        raise
+    upload_stats["completed"] += 1
+    
+    return await db.upload_sessions.find_one_and_update(
+        {"id": session["id"]},
+        {
+            "$set": {
+                "status": "completed",
+                "sha256": sha256,
+                "file_id": file_upload.id,
+                "file_url": file_upload.file_url,
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS),
+            },
+            "$unset": {"locked_until": ""}
+        },
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+# ============= File Serving =============
+# Stored content never changes under a given URL (blobs are named by their
+# hash), so responses carry a strong ETag and can be cached for a year.
+FILE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+def parse_byte_range(header: str, size: int) -> Optional[tuple]:
+    """(start, end) for a single `bytes=` range, None to serve the whole file.
+
+    Multiple or malformed ranges are ignored, as RFC 9110 allows.
+    Raises 416 when the range lies outside the file.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if first and last and int(last) < int(first):
+        # An invalid range, not an unsatisfiable one
+        return None
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start, end = max(size - int(last), 0), size - 1
+    if start >= size or (not first and int(last) == 0):
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+class StoredFileResponse(Response):
+    """Sends `length` bytes of `path` from `start`.
+
+    Uses the ASGI zero-copy extensions when the server offers them
+    (zerocopysend for any range, pathsend for whole files), otherwise reads
+    the file in chunks on `upload_executor`.
+    """
+
+    def __init__(self, path: Path, start: int, length: int, status_code: int, headers: dict, media_type: str):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.length = length
+        self.headers["content-length"] = str(length)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        extensions = scope.get("extensions") or {}
+        if scope["method"] == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        if "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as f:
+                await send({"type": "http.response.zerocopysend", "file": f.fileno(), "offset": self.start, "count": self.length})
+            return
+        if "http.response.pathsend" in extensions and self.status_code == 200:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+            return
+        
+        loop = asyncio.get_running_loop()
+        with open(self.path, "rb") as f:
+            await loop.run_in_executor(upload_executor, f.seek, self.start)
+            remaining = self.length
+            while remaining:
+                chunk = await loop.run_in_executor(upload_executor, f.read, min(FILES_SEND_CHUNK_BYTES, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining:
+            # File shrank underneath us; end the response rather than hang
+            await send({"type": "http.response.body", "body": b""})
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match lists `etag` (weak comparison)"""
+    tags = [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]
+    return "*" in tags or etag in tags
+
+def serve_stored_file(request: Request, path: Path, etag: str, media_type: str, filename: str, inline: bool = False) -> Response:
+    """Conditional (304), ranged (206) or full response for a local file"""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    last_modified = formatdate(int(stat.st_mtime), usegmt=True)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Cache-Control": FILE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    
+    # If-None-Match takes precedence over If-Modified-Since
+    if request.headers.get("if-none-match") is not None:
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+    elif request.headers.get("if-modified-since"):
+        try:
+            if int(stat.st_mtime) <= parsedate_to_datetime(request.headers["if-modified-since"]).timestamp():
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+    
+    headers["Content-Disposition"] = content_disposition(filename, inline)
+    if FILES_ACCEL_REDIRECT_PREFIX:
+        # nginx serves the body itself, including ranges
+        headers["X-Accel-Redirect"] = FILES_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + path.relative_to(UPLOAD_DIR).as_posix()
+        return Response(headers=headers, media_type=media_type)
+    
+    size = stat.st_size
+    byte_range = None
+    if request.headers.get("range") and size:
+        # A stale If-Range validator means the client gets the whole new file
+        if_range = request.headers.get("if-range")
+        if if_range is None or if_range in (etag, last_modified):
+            byte_range = parse_byte_range(request.headers["range"], size)
+    
+    if byte_range is None:
+        return StoredFileResponse(path, 0, size, 200, headers, media_type)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StoredFileResponse(path, start, end - start + 1, 206, headers, media_type)
+
+# ============= Image Variants =============
+# /api/images/{file_id}/{variant}: "square-N" crops to an N x N square (avatars,
+# banner tiles), "fit-N" fits within N x N. Variants are WebP, or JPEG for
+# clients that do not accept WebP.
+IMAGE_VARIANTS = {
+    "square-64": (64, True),
+    "square-192": (192, True),
+    "fit-320": (320, False),
+    "fit-1024": (1024, False),
+    "fit-1920": (1920, False),
+}
+IMAGE_FORMATS = {"WEBP": ("webp", "image/webp"), "JPEG": ("jpg", "image/jpeg")}
+
+class ImageVariantCache:
+    """Rendered variants on disk under `root`, evicted least recently used first.
+
+    Files are named by source hash, variant and format, so every worker
+    shares them. A hit refreshes the file's mtime, and eviction removes the
+    oldest files until the cache is back under 90% of `max_bytes`. Files used
+    in the last `min_age` seconds are kept, as they may still be being sent.
+    """
+    min_age = 60
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.size = None
+        self.inflight = {}
+        self._evicting = None
+        self.hits = 0
+        self.renders = 0
+        self.evictions = 0
+
+    def path(self, sha256: str, variant: str, image_format: str) -> Path:
+        return self.root / sha256[:2] / f"{sha256}-{variant}.{IMAGE_FORMATS[image_format][0]}"
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(upload_executor, func, *args)
+
+    @staticmethod
+    def _touch(path: Path) -> bool:
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    async def get(self, sha256: str, variant: str, image_format: str) -> Path:
+        path = self.path(sha256, variant, image_format)
+        if await self._run(self._touch, path):
+            self.hits += 1
+            return path
+        
+        # Concurrent requests for the same variant share one render
+        key = str(path)
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._render(sha256, variant, image_format, path))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _render(self, sha256: str, variant: str, image_format: str, path: Path) -> Path:
+        size, crop = IMAGE_VARIANTS[variant]
+        source, temporary = await storage.fetch_local(sha256)
+        try:
+            written = await asyncio.get_running_loop().run_in_executor(
+                image_executor, render_image_variant, str(source), str(path), size, crop, image_format, IMAGE_QUALITY
+            )
+        except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError) as e:
+            logger.warning("Cannot render %s of %s: %s", variant, sha256, e)
+            raise HTTPException(status_code=415, detail="Cannot create an image variant of this file")
+        finally:
+            if temporary:
+                await self._run(lambda: source.unlink(missing_ok=True))
+        self.renders += 1
+        
+        if self.size is None:
+            self.size = sum(size for _, size, _ in await self._run(self._scan))
+        else:
+            self.size += written
+        if self.size > self.max_bytes and self._evicting is None:
+            self._evicting = asyncio.create_task(self._evict())
+        return path
 
-class Notification(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str
-    type: str  # new_post, new_assignment, new_follower, etc.
-    message: str
-    message_en: str
-    link: Optional[str] = None
-    read: bool = False
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    def _scan(self) -> List[tuple]:
+        entries = []
+        for entry in self.root.glob("??/*"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        return entries
 
-class NotificationSettings(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str
-    email_enabled: bool = True
-    in_app_enabled: bool = True
-    new_posts: bool = True
-    new_assignments: bool = True
-    new_followers: bool = True
-    forum_replies: bool = True
+    async def _evict(self):
+        try:
+            def evict():
+                entries = sorted(self._scan(), key=lambda e: e[0])
+                total = sum(size for _, size, _ in entries)
+                removed = 0
+                recent = time.time() - self.min_age
+                for mtime, size, entry in entries:
+                    if total <= self.max_bytes * 0.9 or mtime > recent:
+                        break
+                    entry.unlink(missing_ok=True)
+                    total -= size
+                    removed += 1
+                return total, removed
+            self.size, removed = await self._run(evict)
+            self.evictions += removed
+        except Exception as e:
+            logger.error("Image cache eviction failed: %s", e)
+        finally:
+            self._evicting = None
 
-class AdBanner(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    image_url: str
-    title: str
-    text: str
-    phone: Optional[str] = None
-    email: Optional[str] = None
-    link: Optional[str] = None
-    is_active: bool = True
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    def stats(self) -> dict:
+        return {
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "renders": self.renders,
+            "evictions": self.evictions,
+            "rendering": len(self.inflight)
+        }
 
-class FileUpload(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    filename: str
-    file_url: str
-    uploaded_by: str
-    file_type: str
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+image_variants = ImageVariantCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
 
 # ============= Helper Functions =============
 def hash_password(password: str) -> str:
@@ -242,6 +2936,37 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+async def run_password_task(func, *args):
+    """Run a bcrypt call on the password pool, shedding load once the queue is full."""
+    if password_pool_stats["queued"] >= PASSWORD_HASH_MAX_QUEUE:
+        password_pool_stats["rejected"] += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Authentication service busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    
+    password_pool_stats["queued"] += 1
+    password_pool_stats["max_queue_depth"] = max(password_pool_stats["max_queue_depth"], password_pool_stats["queued"])
+    try:
+        await password_slots.acquire()
+    finally:
+        password_pool_stats["queued"] -= 1
+    
+    password_pool_stats["running"] += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        password_pool_stats["running"] -= 1
+        password_pool_stats["completed"] += 1
+        password_slots.release()
+
+async def hash_password_async(password: str) -> str:
+    return await run_password_task(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await run_password_task(verify_password, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     if expires_delta:
@@ -253,29 +2978,146 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await resolve_user(credentials.credentials)
+
+async def resolve_user(token: str, scope: Optional[str] = None, **claims) -> User:
+    """User for a token issued for `scope` (None for regular access tokens) and `claims`"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
-        if user_id is None:
+        if user_id is None or payload.get("scope") != scope:
+            raise credentials_exception
+        if any(payload.get(name) != value for name, value in claims.items()):
             raise credentials_exception
     except JWTError:
         raise credentials_exception
     
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
-    if user is None:
+    current_user = await user_cache.get(user_id)
+    if current_user is None:
         raise credentials_exception
-    return User(**user)
+    return current_user
+
+def encode_cursor(doc: dict, sort_field: str) -> str:
+    """Opaque cursor for the position right after `doc` in a (sort_field, id) ordering."""
+    value = doc[sort_field]
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, doc["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, last_id = json.loads(raw)
+        return datetime.fromisoformat(value), str(last_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Keyset pages sort and compare dates as BSON dates: ISO strings left by
+# older write paths would be skipped or misordered. Until migrate_datetimes.py
+# has converted a collection (or it is found to hold no string dates), its
+# paginated endpoints answer 503 instead of returning wrong pages.
+migrated_date_fields = set()
+
+async def require_migrated_dates(collection, field: str):
+    if (collection.name, field) in migrated_date_fields:
+        return
+    migration = await db.migrations.find_one({"id": f"bson_datetimes:{collection.name}", "completed": True}, {"_id": 1})
+    if migration is None and await collection.find_one({field: {"$type": "string"}}, {"_id": 1}):
+        raise HTTPException(
+            status_code=503,
+            detail=f"{collection.name}.{field} still holds dates stored as strings; run migrate_datetimes.py"
+        )
+    migrated_date_fields.add((collection.name, field))
+
+async def fetch_page(collection, query: dict, sort_field: str, direction: int, limit: int, cursor: Optional[str] = None, projection: Optional[dict] = None):
+    """Return one keyset page of `collection` ordered by (sort_field, id) and the cursor for the next one.
+
+    Each page is a bounded index range scan starting after the cursor, so its
+    cost does not grow with how deep the client has paged. `sort_field` must
+    be a date field.
+    """
+    await require_migrated_dates(collection, sort_field)
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        op = "$gt" if direction == ASCENDING else "$lt"
+        after_cursor = {"$or": [{sort_field: {op: value}}, {sort_field: value, "id": {op: last_id}}]}
+        query = {"$and": [query, after_cursor]}
+    
+    docs = await collection.find(query, projection or {"_id": 0}).sort([(sort_field, direction), ("id", direction)]).limit(limit + 1).to_list(limit + 1)
+    
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1], sort_field)
+    return docs, next_cursor
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]):
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+# One `student_progress` document per (student, assignment), maintained on every
+# answer and submission write; rebuild_student_progress.py recomputes them.
+# Quizzes: scores ({question id: score of the latest answer}), answered_count
+# and score (its size and sum), max_score (sum of question points).
+# Submissions: score is the grade, out of max_score 20.
+SUBMISSION_MAX_GRADE = 20
+
+# Quiz totals recomputed from `scores` (a pipeline update, so concurrent
+# answers to the same quiz cannot overwrite each other's totals)
+PROGRESS_TOTALS_UPDATE = [{"$set": {
+    "answered_count": {"$size": {"$objectToArray": "$scores"}},
+    "score": {"$sum": {"$map": {"input": {"$objectToArray": "$scores"}, "in": "$$this.v"}}},
+}}]
+
+async def record_progress(student_id: str, assignment_id: str, question_scores: Optional[dict] = None,
+                          set_fields: Optional[dict] = None, level_id: Optional[str] = None):
+    """Mark `assignment_id` completed, storing `question_scores` for a quiz.
+
+    A question answered again replaces its earlier score.
+    """
+    query = {"student_id": student_id, "assignment_id": assignment_id}
+    fields = {f"scores.{question_id}": score or 0 for question_id, score in (question_scores or {}).items()}
+    update = {"$set": {**(set_fields or {}), **fields, "completed": True, "updated_at": datetime.now(timezone.utc)}}
+    
+    matched = False
+    if level_id is None:
+        # Usual case: the document exists and a single update is enough
+        result = await db.student_progress.update_one(query, update)
+        matched = result.matched_count > 0
+        if not matched:
+            assignment = await db.assignments.find_one({"id": assignment_id}, {"_id": 0, "level_id": 1})
+            level_id = assignment.get("level_id") if assignment else None
+    if not matched:
+        update["$setOnInsert"] = {"level_id": level_id}
+        await db.student_progress.update_one(query, update, upsert=True)
+    
+    if fields:
+        await db.student_progress.update_one(query, PROGRESS_TOTALS_UPDATE)
+
+def grade_answer(answer_value: str, question: dict):
+    """Return (is_correct, score) for an answer to `question`."""
+    is_correct = answer_value.strip().lower() == question["correct_answer"].strip().lower()
+    return is_correct, question["points"] if is_correct else 0
+
+async def can_view_topic(topic: dict, user: User) -> bool:
+    if topic["visibility"] != "followers_only" or topic["author_id"] == user.id:
+        return True
+    is_following = await db.follows.find_one({"follower_id": user.id, "followed_id": topic["author_id"]})
+    return is_following is not None
+
+async def get_followed_ids(user_id: str) -> List[str]:
+    follows = await db.follows.find({"follower_id": user_id}, {"_id": 0, "followed_id": 1}).to_list(None)
+    return [f["followed_id"] for f in follows]
 
 async def send_email_notification(to_email: str, subject: str, body: str):
-    # Placeholder for email sending
-    # In production, configure SMTP settings
-    pass
+    # Queued in the outbox and sent by the email workers, never inline
+    await email_outbox.enqueue([(to_email, {"subject": subject, "body": body})])
 
 # ============= Routes =============
 
@@ -287,7 +3129,7 @@ async def register(user_create: UserCreate):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Create user
-    hashed_password = hash_password(user_create.password)
+    hashed_password = await hash_password_async(user_create.password)
     user_dict = user_create.model_dump(exclude={"password"})
     user = User(**user_dict)
     
@@ -299,7 +3141,6 @@ async def register(user_create: UserCreate):
     
     user_doc = user.model_dump()
     user_doc["password"] = hashed_password
-    user_doc["created_at"] = user_doc["created_at"].isoformat()
     
     await db.users.insert_one(user_doc)
     
@@ -318,13 +3159,9 @@ async def login(user_login: UserLogin):
     if not user_doc:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    if not verify_password(user_login.password, user_doc["password"]):
+    if not await verify_password_async(user_login.password, user_doc["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    # Convert datetime string back to datetime if needed
-    if isinstance(user_doc.get("created_at"), str):
-        user_doc["created_at"] = datetime.fromisoformat(user_doc["created_at"])
-    
     user = User(**{k: v for k, v in user_doc.items() if k != "password"})
     
     access_token = create_access_token(data={"sub": user.id})
@@ -343,21 +3180,20 @@ async def update_profile(user_update: dict, current_user: User = Depends(get_cur
     user_update.pop("is_validated", None)
     
     await db.users.update_one({"id": current_user.id}, {"$set": user_update})
-    
-    updated_user = await db.users.find_one({"id": current_user.id}, {"_id": 0, "password": 0})
-    if isinstance(updated_user.get("created_at"), str):
-        updated_user["created_at"] = datetime.fromisoformat(updated_user["created_at"])
-    
-    return User(**updated_user)
+    await user_cache.invalidate(current_user.id)
+    return await user_cache.get(current_user.id)
 
 # Branches
+async def reference_response(request: Request, collection: str, model, query: Optional[dict] = None) -> Response:
+    body, etag = await reference_cache.get(collection, model, query)
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={REFERENCE_MAX_AGE_SECONDS}"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @api_router.get("/branches", response_model=List[Branch])
-async def get_branches():
-    branches = await db.branches.find({}, {"_id": 0}).to_list(100)
-    for branch in branches:
-        if isinstance(branch.get("created_at"), str):
-            branch["created_at"] = datetime.fromisoformat(branch["created_at"])
-    return branches
+async def get_branches(request: Request):
+    return await reference_response(request, "branches", Branch)
 
 @api_router.post("/branches", response_model=Branch)
 async def create_branch(branch: Branch, current_user: User = Depends(get_current_user)):
@@ -365,19 +3201,15 @@ async def create_branch(branch: Branch, current_user: User = Depends(get_current
         raise HTTPException(status_code=403, detail="Admin only")
     
     branch_doc = branch.model_dump()
-    branch_doc["created_at"] = branch_doc["created_at"].isoformat()
     await db.branches.insert_one(branch_doc)
+    await reference_cache.invalidate()
     return branch
 
 # Levels
 @api_router.get("/levels", response_model=List[Level])
-async def get_levels(branch_id: Optional[str] = None):
+async def get_levels(request: Request, branch_id: Optional[str] = None):
     query = {"branch_id": branch_id} if branch_id else {}
-    levels = await db.levels.find(query, {"_id": 0}).to_list(100)
-    for level in levels:
-        if isinstance(level.get("created_at"), str):
-            level["created_at"] = datetime.fromisoformat(level["created_at"])
-    return levels
+    return await reference_response(request, "levels", Level, query)
 
 @api_router.post("/levels", response_model=Level)
 async def create_level(level: Level, current_user: User = Depends(get_current_user)):
@@ -385,18 +3217,14 @@ async def create_level(level: Level, current_user: User = Depends(get_current_us
         raise HTTPException(status_code=403, detail="Admin only")
     
     level_doc = level.model_dump()
-    level_doc["created_at"] = level_doc["created_at"].isoformat()
     await db.levels.insert_one(level_doc)
+    await reference_cache.invalidate()
     return level
 
 # Subjects
 @api_router.get("/subjects", response_model=List[Subject])
-async def get_subjects():
-    subjects = await db.subjects.find({}, {"_id": 0}).to_list(100)
-    for subject in subjects:
-        if isinstance(subject.get("created_at"), str):
-            subject["created_at"] = datetime.fromisoformat(subject["created_at"])
-    return subjects
+async def get_subjects(request: Request):
+    return await reference_response(request, "subjects", Subject)
 
 @api_router.post("/subjects", response_model=Subject)
 async def create_subject(subject: Subject, current_user: User = Depends(get_current_user)):
@@ -404,8 +3232,8 @@ async def create_subject(subject: Subject, current_user: User = Depends(get_curr
         raise HTTPException(status_code=403, detail="Admin only")
     
     subject_doc = subject.model_dump()
-    subject_doc["created_at"] = subject_doc["created_at"].isoformat()
     await db.subjects.insert_one(subject_doc)
+    await reference_cache.invalidate()
     return subject
 
 # Teacher Subjects
@@ -415,24 +3243,23 @@ async def add_teacher_subject(teacher_subject: TeacherSubject, current_user: Use
         raise HTTPException(status_code=403, detail="Not authorized")
     
     ts_doc = teacher_subject.model_dump()
-    ts_doc["created_at"] = ts_doc["created_at"].isoformat()
     await db.teacher_subjects.insert_one(ts_doc)
     return teacher_subject
 
 @api_router.get("/teacher-subjects/{teacher_id}", response_model=List[TeacherSubject])
 async def get_teacher_subjects(teacher_id: str):
     ts_list = await db.teacher_subjects.find({"teacher_id": teacher_id}, {"_id": 0}).to_list(100)
-    for ts in ts_list:
-        if isinstance(ts.get("created_at"), str):
-            ts["created_at"] = datetime.fromisoformat(ts["created_at"])
     return ts_list
 
 # Topics (Forum)
 @api_router.get("/topics", response_model=List[Topic])
 async def get_topics(
+    response: Response,
     branch_id: Optional[str] = None,
     level_id: Optional[str] = None,
     subject_id: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     query = {}
@@ -443,26 +3270,16 @@ async def get_topics(
     if subject_id:
         query["subject_id"] = subject_id
     
-    topics = await db.topics.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
+    # Filter visibility in the query itself so the limit applies to visible topics
+    followed_ids = await get_followed_ids(current_user.id)
+    query["$or"] = [
+        {"visibility": "public"},
+        {"visibility": "followers_only", "author_id": {"$in": followed_ids + [current_user.id]}}
+    ]
     
-    # Filter visibility
-    filtered_topics = []
-    for topic in topics:
-        if isinstance(topic.get("created_at"), str):
-            topic["created_at"] = datetime.fromisoformat(topic["created_at"])
-        
-        if topic["visibility"] == "public":
-            filtered_topics.append(topic)
-        elif topic["visibility"] == "followers_only":
-            # Check if current user follows the author
-            is_following = await db.follows.find_one({
-                "follower_id": current_user.id,
-                "followed_id": topic["author_id"]
-            })
-            if is_following or topic["author_id"] == current_user.id:
-                filtered_topics.append(topic)
-    
-    return filtered_topics
+    topics, next_cursor = await fetch_page(db.topics, query, "created_at", DESCENDING, limit, cursor)
+    set_next_cursor(response, next_cursor)
+    return ModelListResponse(Topic, topics, headers=response.headers)
 
 @api_router.post("/topics", response_model=Topic)
 async def create_topic(topic: Topic, current_user: User = Depends(get_current_user)):
@@ -471,20 +3288,16 @@ async def create_topic(topic: Topic, current_user: User = Depends(get_current_us
     topic.author_role = current_user.role
     
     topic_doc = topic.model_dump()
-    topic_doc["created_at"] = topic_doc["created_at"].isoformat()
     await db.topics.insert_one(topic_doc)
     
     # Notify followers
-    followers = await db.follows.find({"followed_id": current_user.id}, {"_id": 0}).to_list(1000)
-    for follower in followers:
-        notif = Notification(
-            user_id=follower["follower_id"],
-            type="new_post",
-            message=f"{current_user.name} a créé un nouveau sujet: {topic.title}",
-            message_en=f"{current_user.name} created a new topic: {topic.title}",
-            link=f"/forum/topic/{topic.id}"
-        )
-        await db.notifications.insert_one(notif.model_dump())
+    notification_fanout.enqueue(
+        source=("follows", {"followed_id": current_user.id}, "follower_id"),
+        type="new_post",
+        message=f"{current_user.name} a créé un nouveau sujet: {topic.title}",
+        message_en=f"{current_user.name} created a new topic: {topic.title}",
+        link=f"/forum/topic/{topic.id}"
+    )
     
     return topic
 
@@ -494,32 +3307,27 @@ async def get_topic(topic_id: str, current_user: User = Depends(get_current_user
     if not topic:
         raise HTTPException(status_code=404, detail="Topic not found")
     
-    if isinstance(topic.get("created_at"), str):
-        topic["created_at"] = datetime.fromisoformat(topic["created_at"])
-    
     # Check visibility
-    if topic["visibility"] == "followers_only":
-        if topic["author_id"] != current_user.id:
-            is_following = await db.follows.find_one({
-                "follower_id": current_user.id,
-                "followed_id": topic["author_id"]
-            })
-            if not is_following:
-                raise HTTPException(status_code=403, detail="Access denied")
-    
-    # Increment views
-    await db.topics.update_one({"id": topic_id}, {"$inc": {"views_count": 1}})
+    if not await can_view_topic(topic, current_user):
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    # Count the view; buffered views are written by the periodic flush
+    topic_views.record(topic_id, current_user.id)
+    topic["views_count"] = topic.get("views_count", 0) + topic_views.pending_for(topic_id)
     
     return Topic(**topic)
 
 # Posts (Replies)
 @api_router.get("/posts/{topic_id}", response_model=List[Post])
-async def get_posts(topic_id: str):
-    posts = await db.posts.find({"topic_id": topic_id}, {"_id": 0}).sort("created_at", 1).to_list(1000)
-    for post in posts:
-        if isinstance(post.get("created_at"), str):
-            post["created_at"] = datetime.fromisoformat(post["created_at"])
-    return posts
+async def get_posts(
+    topic_id: str,
+    response: Response,
+    limit: int = Query(PAGE_SIZE_LONG_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None
+):
+    posts, next_cursor = await fetch_page(db.posts, {"topic_id": topic_id}, "created_at", ASCENDING, limit, cursor)
+    set_next_cursor(response, next_cursor)
+    return ModelListResponse(Post, posts, headers=response.headers)
 
 @api_router.post("/posts", response_model=Post)
 async def create_post(post: Post, current_user: User = Depends(get_current_user)):
@@ -528,31 +3336,35 @@ async def create_post(post: Post, current_user: User = Depends(get_current_user)
     post.author_role = current_user.role
     
     post_doc = post.model_dump()
-    post_doc["created_at"] = post_doc["created_at"].isoformat()
     await db.posts.insert_one(post_doc)
     
     # Increment replies count
     await db.topics.update_one({"id": post.topic_id}, {"$inc": {"replies_count": 1}})
     
+    # Push the reply to clients watching the topic
+    await event_broker.publish(f"topic:{post.topic_id}", {"type": "post", "data": post.model_dump()})
+    
     # Notify topic author
     topic = await db.topics.find_one({"id": post.topic_id}, {"_id": 0})
     if topic and topic["author_id"] != current_user.id:
-        notif = Notification(
-            user_id=topic["author_id"],
+        notification_fanout.enqueue(
+            user_ids=[topic["author_id"]],
             type="forum_reply",
             message=f"{current_user.name} a répondu à votre sujet",
             message_en=f"{current_user.name} replied to your topic",
             link=f"/forum/topic/{post.topic_id}"
         )
-        await db.notifications.insert_one(notif.model_dump())
     
     return post
 
 # Assignments
 @api_router.get("/assignments", response_model=List[Assignment])
 async def get_assignments(
+    response: Response,
     level_id: Optional[str] = None,
     subject_id: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
     query = {}
@@ -567,13 +3379,9 @@ async def get_assignments(
     if subject_id:
         query["subject_id"] = subject_id
     
-    assignments = await db.assignments.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
-    for assignment in assignments:
-        if isinstance(assignment.get("created_at"), str):
-            assignment["created_at"] = datetime.fromisoformat(assignment["created_at"])
-        if isinstance(assignment.get("due_date"), str):
-            assignment["due_date"] = datetime.fromisoformat(assignment["due_date"])
-    return assignments
+    assignments, next_cursor = await fetch_page(db.assignments, query, "created_at", DESCENDING, limit, cursor)
+    set_next_cursor(response, next_cursor)
+    return ModelListResponse(Assignment, assignments, headers=response.headers)
 
 @api_router.post("/assignments", response_model=Assignment)
 async def create_assignment(assignment: Assignment, current_user: User = Depends(get_current_user)):
@@ -583,21 +3391,16 @@ async def create_assignment(assignment: Assignment, current_user: User = Depends
     assignment.teacher_id = current_user.id
     
     assignment_doc = assignment.model_dump()
-    assignment_doc["created_at"] = assignment_doc["created_at"].isoformat()
-    assignment_doc["due_date"] = assignment_doc["due_date"].isoformat()
     await db.assignments.insert_one(assignment_doc)
     
     # Notify students in the level
-    students = await db.users.find({"role": "student", "level_id": assignment.level_id}, {"_id": 0}).to_list(1000)
-    for student in students:
-        notif = Notification(
-            user_id=student["id"],
-            type="new_assignment",
-            message=f"Nouveau devoir: {assignment.title}",
-            message_en=f"New assignment: {assignment.title}",
-            link=f"/assignments/{assignment.id}"
-        )
-        await db.notifications.insert_one(notif.model_dump())
+    notification_fanout.enqueue(
+        source=("users", {"role": "student", "level_id": assignment.level_id}, "id"),
+        type="new_assignment",
+        message=f"Nouveau devoir: {assignment.title}",
+        message_en=f"New assignment: {assignment.title}",
+        link=f"/assignments/{assignment.id}"
+    )
     
     return assignment
 
@@ -607,21 +3410,76 @@ async def get_assignment(assignment_id: str):
     if not assignment:
         raise HTTPException(status_code=404, detail="Assignment not found")
     
-    if isinstance(assignment.get("created_at"), str):
-        assignment["created_at"] = datetime.fromisoformat(assignment["created_at"])
-    if isinstance(assignment.get("due_date"), str):
-        assignment["due_date"] = datetime.fromisoformat(assignment["due_date"])
-    
     return Assignment(**assignment)
 
+@api_router.get("/assignments/{assignment_id}/analytics")
+async def get_assignment_analytics(assignment_id: str, current_user: User = Depends(get_current_user)):
+    if current_user.role != "teacher":
+        raise HTTPException(status_code=403, detail="Teachers only")
+    
+    assignment = await db.assignments.find_one({"id": assignment_id}, {"_id": 0, "teacher_id": 1})
+    if not assignment:
+        raise HTTPException(status_code=404, detail="Assignment not found")
+    if assignment["teacher_id"] != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    async def compute():
+        questions = await question_cache.get(assignment_id)
+        answers = await db.answers.find(
+            {"assignment_id": assignment_id},
+            {"_id": 0, "student_id": 1, "question_id": 1, "answer_value": 1, "is_correct": 1, "score": 1}
+        ).sort("created_at", ASCENDING).to_list(None)
+        
+        # The number crunching runs off the event loop
+        analytics = await asyncio.get_running_loop().run_in_executor(None, compute_quiz_analytics, answers, questions)
+        return {"assignment_id": assignment_id, **analytics}
+    
+    return await analytics_cache.get(assignment_id, compute)
+
+@api_router.get("/assignments/{assignment_id}/gradebook")
+async def export_assignment_gradebook(
+    assignment_id: str,
+    export_format: str = Query("csv", alias="format", pattern="^(csv|xlsx)$"),
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.role not in ["teacher", "admin"]:
+        raise HTTPException(status_code=403, detail="Teachers only")
+    
+    assignment = await db.assignments.find_one({"id": assignment_id}, {"_id": 0})
+    if not assignment:
+        raise HTTPException(status_code=404, detail="Assignment not found")
+    if current_user.role == "teacher" and assignment["teacher_id"] != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    return gradebook_response(assignment["level_id"], [assignment], export_format, f"gradebook-{assignment_id}")
+
+@api_router.get("/levels/{level_id}/gradebook")
+async def export_level_gradebook(
+    level_id: str,
+    subject_id: Optional[str] = None,
+    export_format: str = Query("csv", alias="format", pattern="^(csv|xlsx)$"),
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.role not in ["teacher", "admin"]:
+        raise HTTPException(status_code=403, detail="Teachers only")
+    
+    query = {"level_id": level_id}
+    # Teachers export the assignments they created; admins see the whole level
+    if current_user.role == "teacher":
+        query["teacher_id"] = current_user.id
+    if subject_id:
+        query["subject_id"] = subject_id
+    
+    assignments = await db.assignments.find(
+        query, {"_id": 0, "id": 1, "title": 1, "assignment_type": 1}
+    ).sort([("created_at", ASCENDING), ("id", ASCENDING)]).to_list(None)
+    
+    return gradebook_response(level_id, assignments, export_format, f"gradebook-{level_id}")
+
 # Questions
 @api_router.get("/questions/{assignment_id}", response_model=List[Question])
 async def get_questions(assignment_id: str):
-    questions = await db.questions.find({"assignment_id": assignment_id}, {"_id": 0}).to_list(100)
-    for question in questions:
-        if isinstance(question.get("created_at"), str):
-            question["created_at"] = datetime.fromisoformat(question["created_at"])
-    return questions
+    return await question_cache.get(assignment_id)
 
 @api_router.post("/questions", response_model=Question)
 async def create_question(question: Question, current_user: User = Depends(get_current_user)):
@@ -629,10 +3487,65 @@ async def create_question(question: Question, current_user: User = Depends(get_c
         raise HTTPException(status_code=403, detail="Teachers only")
     
     question_doc = question.model_dump()
-    question_doc["created_at"] = question_doc["created_at"].isoformat()
     await db.questions.insert_one(question_doc)
+    await question_cache.invalidate(question.assignment_id)
+    await analytics_cache.invalidate(question.assignment_id)
+    return question
+
+async def get_owned_question(question_id: str, current_user: User) -> dict:
+    if current_user.role != "teacher":
+        raise HTTPException(status_code=403, detail="Teachers only")
+    question = await db.questions.find_one({"id": question_id}, {"_id": 0})
+    if not question:
+        raise HTTPException(status_code=404, detail="Question not found")
+    assignment = await db.assignments.find_one({"id": question["assignment_id"]}, {"_id": 0, "teacher_id": 1})
+    if not assignment or assignment["teacher_id"] != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized")
     return question
 
+@api_router.put("/questions/{question_id}", response_model=Question)
+async def update_question(question_id: str, question_update: dict, current_user: User = Depends(get_current_user)):
+    question = await get_owned_question(question_id, current_user)
+    
+    # Only the content of the question can change
+    question_update = {
+        k: v for k, v in question_update.items()
+        if k in ("question_type", "question_text", "options", "correct_answer", "points")
+    }
+    try:
+        updated = Question(**{**question, **question_update})
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=jsonable_encoder(e.errors()))
+    await db.questions.update_one({"id": question_id}, {"$set": {k: getattr(updated, k) for k in question_update}})
+    await question_cache.invalidate(question["assignment_id"])
+    await analytics_cache.invalidate(question["assignment_id"])
+    
+    # Answers already stored were graded against the old version
+    if any(getattr(updated, k) != question.get(k) for k in GRADING_FIELDS):
+        await regrade_runner.submit(updated.model_dump(), current_user.id)
+    return updated
+
+@api_router.post("/questions/{question_id}/regrade", response_model=RegradeJob)
+async def regrade_question(question_id: str, current_user: User = Depends(get_current_user)):
+    question = await get_owned_question(question_id, current_user)
+    return await regrade_runner.submit(question, current_user.id)
+
+@api_router.get("/regrade-jobs", response_model=List[RegradeJob])
+async def get_regrade_jobs(question_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    if current_user.role != "teacher":
+        raise HTTPException(status_code=403, detail="Teachers only")
+    query = {"teacher_id": current_user.id}
+    if question_id:
+        query["question_id"] = question_id
+    return await db.regrade_jobs.find(query, {"_id": 0}).sort("created_at", DESCENDING).to_list(20)
+
+@api_router.get("/regrade-jobs/{job_id}", response_model=RegradeJob)
+async def get_regrade_job(job_id: str, current_user: User = Depends(get_current_user)):
+    job = await db.regrade_jobs.find_one({"id": job_id, "teacher_id": current_user.id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Regrade job not found")
+    return job
+
 # Student Answers (for quiz-type assignments)
 @api_router.post("/answers", response_model=StudentAnswer)
 async def submit_answer(answer: StudentAnswer, current_user: User = Depends(get_current_user)):
@@ -643,22 +3556,78 @@ async def submit_answer(answer: StudentAnswer, current_user: User = Depends(get_
     
     # Get question to check correct answer
     if answer.question_id:
-        question = await db.questions.find_one({"id": answer.question_id}, {"_id": 0})
+        questions_by_id = await question_cache.get_by_id(answer.assignment_id)
+        question = questions_by_id.get(answer.question_id)
+        if question is None:
+            question = await db.questions.find_one({"id": answer.question_id}, {"_id": 0})
         if question:
-            answer.is_correct = (answer.answer_value.strip().lower() == question["correct_answer"].strip().lower())
-            answer.score = question["points"] if answer.is_correct else 0
+            answer.is_correct, answer.score = grade_answer(answer.answer_value, question)
     
     answer_doc = answer.model_dump()
-    answer_doc["created_at"] = answer_doc["created_at"].isoformat()
     await db.answers.insert_one(answer_doc)
+    analytics_cache.discard(answer.assignment_id)
+    
+    questions = await question_cache.get(answer.assignment_id)
+    await record_progress(
+        current_user.id,
+        answer.assignment_id,
+        question_scores={answer.question_id: answer.score} if answer.question_id else None,
+        set_fields={"max_score": sum(q["points"] for q in questions)}
+    )
     return answer
 
+@api_router.post("/answers/batch", response_model=AnswerBatchResult)
+async def submit_answers(batch: AnswerBatch, current_user: User = Depends(get_current_user)):
+    """Submit every answer to a quiz at once: one read of the questions, one insert."""
+    if current_user.role != "student":
+        raise HTTPException(status_code=403, detail="Students only")
+    
+    assignment = await db.assignments.find_one({"id": batch.assignment_id}, {"_id": 0, "assignment_type": 1, "level_id": 1})
+    if not assignment:
+        raise HTTPException(status_code=404, detail="Assignment not found")
+    if assignment.get("assignment_type", "quiz") != "quiz":
+        raise HTTPException(status_code=422, detail="Only quiz assignments take answers")
+    
+    questions = await question_cache.get(batch.assignment_id)
+    questions_by_id = {q["id"]: q for q in questions}
+    
+    question_ids = [item.question_id for item in batch.answers]
+    unknown = [qid for qid in question_ids if qid not in questions_by_id]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Questions not in this assignment: {', '.join(unknown)}")
+    if len(set(question_ids)) != len(question_ids):
+        raise HTTPException(status_code=422, detail="Each question can only be answered once")
+    
+    answers = []
+    for item in batch.answers:
+        is_correct, score = grade_answer(item.answer_value, questions_by_id[item.question_id])
+        answers.append(StudentAnswer(
+            assignment_id=batch.assignment_id,
+            question_id=item.question_id,
+            student_id=current_user.id,
+            answer_value=item.answer_value,
+            is_correct=is_correct,
+            score=score
+        ))
+    
+    score = sum(answer.score for answer in answers)
+    max_score = sum(q["points"] for q in questions)
+    if answers:
+        await db.answers.insert_many([answer.model_dump() for answer in answers], ordered=False)
+        analytics_cache.discard(batch.assignment_id)
+        await record_progress(
+            current_user.id,
+            batch.assignment_id,
+            question_scores={answer.question_id: answer.score for answer in answers},
+            set_fields={"max_score": max_score},
+            level_id=assignment.get("level_id")
+        )
+    
+    return AnswerBatchResult(assignment_id=batch.assignment_id, answers=answers, score=score, max_score=max_score)
+
 @api_router.get("/answers/{assignment_id}/{student_id}", response_model=List[StudentAnswer])
 async def get_student_answers(assignment_id: str, student_id: str):
     answers = await db.answers.find({"assignment_id": assignment_id, "student_id": student_id}, {"_id": 0}).to_list(100)
-    for answer in answers:
-        if isinstance(answer.get("created_at"), str):
-            answer["created_at"] = datetime.fromisoformat(answer["created_at"])
     return answers
 
 # Submissions (for submission-type assignments)
@@ -670,75 +3639,148 @@ async def create_submission(submission: Submission, current_user: User = Depends
     submission.student_id = current_user.id
     submission.student_name = current_user.name
     
-    submission_doc = submission.model_dump()
-    submission_doc["submitted_at"] = submission_doc["submitted_at"].isoformat()
-    if submission_doc.get("graded_at"):
-        submission_doc["graded_at"] = submission_doc["graded_at"].isoformat()
+    if submission.upload_session_ids:
+        session_ids = set(submission.upload_session_ids)
+        sessions = await db.upload_sessions.find(
+            {"id": {"$in": list(session_ids)}, "user_id": current_user.id, "status": "completed"},
+            {"_id": 0, "file_url": 1}
+        ).to_list(len(session_ids))
+        if len(sessions) != len(session_ids):
+            raise HTTPException(status_code=400, detail="Upload session not found or not complete")
+        file_urls = submission.file_urls or []
+        submission.file_urls = file_urls + [s["file_url"] for s in sessions if s["file_url"] not in file_urls]
     
+    submission_doc = submission.model_dump()
     await db.submissions.insert_one(submission_doc)
     
-    # Notify teacher
     assignment = await db.assignments.find_one({"id": submission.assignment_id}, {"_id": 0})
+    await record_progress(
+        current_user.id,
+        submission.assignment_id,
+        set_fields={"max_score": SUBMISSION_MAX_GRADE},
+        level_id=assignment.get("level_id") if assignment else None
+    )
+    
+    # Notify teacher
     if assignment:
-        notif = Notification(
-            user_id=assignment["teacher_id"],
+        notification_fanout.enqueue(
+            user_ids=[assignment["teacher_id"]],
             type="new_submission",
             message=f"{current_user.name} a soumis un devoir: {assignment['title']}",
             message_en=f"{current_user.name} submitted an assignment: {assignment['title']}",
             link=f"/assignments/{submission.assignment_id}"
         )
-        await db.notifications.insert_one(notif.model_dump())
     
     return submission
 
 @api_router.get("/submissions/{assignment_id}", response_model=List[Submission])
-async def get_submissions(assignment_id: str, current_user: User = Depends(get_current_user)):
+async def get_submissions(
+    assignment_id: str,
+    response: Response,
+    limit: int = Query(PAGE_SIZE_LONG_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
     query = {"assignment_id": assignment_id}
     
     # Students can only see their own submissions
     if current_user.role == "student":
         query["student_id"] = current_user.id
     
-    submissions = await db.submissions.find(query, {"_id": 0}).to_list(1000)
-    for sub in submissions:
-        if isinstance(sub.get("submitted_at"), str):
-            sub["submitted_at"] = datetime.fromisoformat(sub["submitted_at"])
-        if sub.get("graded_at") and isinstance(sub["graded_at"], str):
-            sub["graded_at"] = datetime.fromisoformat(sub["graded_at"])
-    return submissions
+    submissions, next_cursor = await fetch_page(db.submissions, query, "submitted_at", ASCENDING, limit, cursor)
+    set_next_cursor(response, next_cursor)
+    return ModelListResponse(Submission, submissions, headers=response.headers)
 
-@api_router.put("/submissions/{submission_id}/grade")
-async def grade_submission(
-    submission_id: str,
-    grade_data: dict,
-    current_user: User = Depends(get_current_user)
-):
+async def apply_grades(current_user: User, entries: List[GradeEntry]) -> int:
+    """Grade submissions owned by `current_user`: one ownership query, one bulk_write per collection."""
     if current_user.role != "teacher":
         raise HTTPException(status_code=403, detail="Teachers only")
+    if not entries:
+        return 0
     
-    update_data = {
-        "grade": grade_data.get("grade"),
-        "teacher_comment": grade_data.get("teacher_comment"),
-        "graded_at": datetime.now(timezone.utc).isoformat(),
-        "status": "graded"
-    }
+    submission_ids = [entry.submission_id for entry in entries]
+    if len(set(submission_ids)) != len(submission_ids):
+        raise HTTPException(status_code=400, detail="Each submission can only be graded once per request")
+    
+    # Submissions joined with their assignment's owner in a single round trip
+    pipeline = [
+        {"$match": {"id": {"$in": submission_ids}}},
+        {"$lookup": {"from": "assignments", "localField": "assignment_id", "foreignField": "id", "as": "assignment"}},
+        {"$project": {
+            "_id": 0, "id": 1, "student_id": 1, "assignment_id": 1,
+            "teacher_id": {"$arrayElemAt": ["$assignment.teacher_id", 0]},
+            "level_id": {"$arrayElemAt": ["$assignment.level_id", 0]},
+        }},
+    ]
+    submissions = {s["id"]: s async for s in db.submissions.aggregate(pipeline)}
+    
+    missing = [sid for sid in submission_ids if sid not in submissions]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Submissions not found: {', '.join(missing)}")
+    if any(s.get("teacher_id") != current_user.id for s in submissions.values()):
+        raise HTTPException(status_code=403, detail="Not authorized")
     
-    await db.submissions.update_one({"id": submission_id}, {"$set": update_data})
+    now = datetime.now(timezone.utc)
+    await db.submissions.bulk_write([
+        UpdateOne({"id": entry.submission_id}, {"$set": {
+            "grade": entry.grade,
+            "teacher_comment": entry.teacher_comment,
+            "graded_at": now,
+            "status": "graded"
+        }})
+        for entry in entries
+    ], ordered=False)
     
-    # Notify student
-    submission = await db.submissions.find_one({"id": submission_id}, {"_id": 0})
-    if submission:
-        notif = Notification(
-            user_id=submission["student_id"],
+    await db.student_progress.bulk_write([
+        UpdateOne(
+            {"student_id": submissions[entry.submission_id]["student_id"], "assignment_id": submissions[entry.submission_id]["assignment_id"]},
+            {
+                "$set": {"score": entry.grade, "max_score": SUBMISSION_MAX_GRADE, "completed": True, "updated_at": now},
+                "$setOnInsert": {"level_id": submissions[entry.submission_id].get("level_id")}
+            },
+            upsert=True
+        )
+        for entry in entries
+    ], ordered=False)
+    
+    # Notify students: one fan-out job per (assignment, grade) shares its message
+    recipients = {}
+    for entry in entries:
+        submission = submissions[entry.submission_id]
+        recipients.setdefault((submission["assignment_id"], entry.grade), []).append(submission["student_id"])
+    for (assignment_id, grade), student_ids in recipients.items():
+        notification_fanout.enqueue(
+            user_ids=student_ids,
             type="submission_graded",
-            message=f"Votre devoir a été noté: {grade_data.get('grade')}/20",
-            message_en=f"Your assignment has been graded: {grade_data.get('grade')}/20",
-            link=f"/assignments/{submission['assignment_id']}"
+            message=f"Votre devoir a été noté: {grade:g}/20",
+            message_en=f"Your assignment has been graded: {grade:g}/20",
+            link=f"/assignments/{assignment_id}"
         )
-        await db.notifications.insert_one(notif.model_dump())
     
+    return len(entries)
+
+@api_router.put("/submissions/{submission_id}/grade")
+async def grade_submission(
+    submission_id: str,
+    grade_data: dict,
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        entry = GradeEntry(
+            submission_id=submission_id,
+            grade=grade_data.get("grade"),
+            teacher_comment=grade_data.get("teacher_comment")
+        )
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=jsonable_encoder(e.errors()))
+    await apply_grades(current_user, [entry])
     return {"message": "Submission graded successfully"}
 
+@api_router.post("/submissions/grades")
+async def grade_submissions(batch: GradeBatch, current_user: User = Depends(get_current_user)):
+    graded = await apply_grades(current_user, batch.grades)
+    return {"message": "Submissions graded successfully", "graded": graded}
+
 # Follows
 @api_router.post("/follows")
 async def follow_user(followed_id: str, current_user: User = Depends(get_current_user)):
@@ -751,18 +3793,16 @@ async def follow_user(followed_id: str, current_user: User = Depends(get_current
     
     follow = Follow(follower_id=current_user.id, followed_id=followed_id)
     follow_doc = follow.model_dump()
-    follow_doc["created_at"] = follow_doc["created_at"].isoformat()
     await db.follows.insert_one(follow_doc)
     
     # Notify followed user
-    notif = Notification(
-        user_id=followed_id,
+    notification_fanout.enqueue(
+        user_ids=[followed_id],
         type="new_follower",
         message=f"{current_user.name} vous suit maintenant",
         message_en=f"{current_user.name} is now following you",
         link=f"/profile/{current_user.id}"
     )
-    await db.notifications.insert_one(notif.model_dump())
     
     return {"message": "Followed successfully"}
 
@@ -774,14 +3814,26 @@ async def unfollow_user(followed_id: str, current_user: User = Depends(get_curre
     return {"message": "Unfollowed successfully"}
 
 @api_router.get("/follows/followers/{user_id}")
-async def get_followers(user_id: str):
-    followers = await db.follows.find({"followed_id": user_id}, {"_id": 0}).to_list(1000)
-    return {"count": len(followers), "followers": followers}
+async def get_followers(
+    user_id: str,
+    limit: int = Query(PAGE_SIZE_LONG_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None
+):
+    query = {"followed_id": user_id}
+    followers, next_cursor = await fetch_page(db.follows, query, "created_at", DESCENDING, limit, cursor)
+    count = await db.follows.count_documents(query)
+    return {"count": count, "followers": followers, "next_cursor": next_cursor}
 
 @api_router.get("/follows/following/{user_id}")
-async def get_following(user_id: str):
-    following = await db.follows.find({"follower_id": user_id}, {"_id": 0}).to_list(1000)
-    return {"count": len(following), "following": following}
+async def get_following(
+    user_id: str,
+    limit: int = Query(PAGE_SIZE_LONG_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+    cursor: Optional[str] = None
+):
+    query = {"follower_id": user_id}
+    following, next_cursor = await fetch_page(db.follows, query, "created_at", DESCENDING, limit, cursor)
+    count = await db.follows.count_documents(query)
+    return {"count": count, "following": following, "next_cursor": next_cursor}
 
 @api_router.get("/follows/is-following/{followed_id}")
 async def is_following(followed_id: str, current_user: User = Depends(get_current_user)):
@@ -792,20 +3844,84 @@ async def is_following(followed_id: str, current_user: User = Depends(get_curren
 @api_router.get("/notifications", response_model=List[Notification])
 async def get_notifications(current_user: User = Depends(get_current_user)):
     notifications = await db.notifications.find({"user_id": current_user.id}, {"_id": 0}).sort("created_at", -1).limit(50).to_list(50)
-    for notif in notifications:
-        if isinstance(notif.get("created_at"), str):
-            notif["created_at"] = datetime.fromisoformat(notif["created_at"])
     return notifications
 
 @api_router.put("/notifications/{notification_id}/read")
 async def mark_notification_read(notification_id: str, current_user: User = Depends(get_current_user)):
-    await db.notifications.update_one({"id": notification_id, "user_id": current_user.id}, {"$set": {"read": True}})
+    result = await db.notifications.update_one(
+        {"id": notification_id, "user_id": current_user.id, "read": False},
+        {"$set": {"read": True}}
+    )
+    if result.modified_count:
+        await decrement_unread_counter(current_user.id)
     return {"message": "Marked as read"}
 
+@api_router.put("/notifications/read-all")
+async def mark_all_notifications_read(current_user: User = Depends(get_current_user)):
+    result = await db.notifications.update_many({"user_id": current_user.id, "read": False}, {"$set": {"read": True}})
+    if result.modified_count:
+        await decrement_unread_counter(current_user.id, result.modified_count)
+    return {"message": "All marked as read", "count": result.modified_count}
+
 @api_router.get("/notifications/unread-count")
 async def get_unread_count(current_user: User = Depends(get_current_user)):
-    count = await db.notifications.count_documents({"user_id": current_user.id, "read": False})
-    return {"count": count}
+    counter = await db.notification_counters.find_one({"user_id": current_user.id}, {"_id": 0, "unread": 1})
+    if counter is None:
+        # First read for this user: seed the counter from the source of truth
+        return {"count": await seed_unread_counter(current_user.id)}
+    return {"count": counter.get("unread", 0)}
+
+# Live events (Server-Sent Events)
+@api_router.post("/events/token")
+async def create_stream_token(current_user: User = Depends(get_current_user)):
+    """Short-lived token for opening /events.
+
+    EventSource cannot send an Authorization header, so the token goes in
+    the query string. It is only accepted by /events and expires after
+    STREAM_TOKEN_EXPIRE_SECONDS, so the access token never appears in a URL.
+    """
+    token = create_access_token(
+        data={"sub": current_user.id, "scope": "events"},
+        expires_delta=timedelta(seconds=STREAM_TOKEN_EXPIRE_SECONDS)
+    )
+    return {"token": token, "expires_in": STREAM_TOKEN_EXPIRE_SECONDS}
+
+@api_router.get("/events")
+async def stream_events(request: Request, token: str, topic_id: Optional[str] = None):
+    """Push the caller's new notifications, and replies to `topic_id`, as they happen.
+
+    `token` comes from POST /events/token; it is only checked when connecting.
+    """
+    current_user = await resolve_user(token, scope="events")
+    channels = [f"user:{current_user.id}"]
+    if topic_id:
+        topic = await db.topics.find_one({"id": topic_id}, {"_id": 0})
+        if not topic:
+            raise HTTPException(status_code=404, detail="Topic not found")
+        if not await can_view_topic(topic, current_user):
+            raise HTTPException(status_code=403, detail="Access denied")
+        channels.append(f"topic:{topic_id}")
+    
+    queue = event_broker.subscribe(channels)
+    
+    async def event_source():
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(jsonable_encoder(event['data']))}\n\n"
+        finally:
+            event_broker.unsubscribe(queue, channels)
+    
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # Notification Settings
 @api_router.get("/notification-settings", response_model=NotificationSettings)
@@ -827,9 +3943,6 @@ async def update_notification_settings(settings_update: dict, current_user: User
 @api_router.get("/ad-banners", response_model=List[AdBanner])
 async def get_ad_banners():
     banners = await db.ad_banners.find({"is_active": True}, {"_id": 0}).to_list(100)
-    for banner in banners:
-        if isinstance(banner.get("created_at"), str):
-            banner["created_at"] = datetime.fromisoformat(banner["created_at"])
     return banners
 
 @api_router.post("/ad-banners", response_model=AdBanner)
@@ -838,7 +3951,6 @@ async def create_ad_banner(banner: AdBanner, current_user: User = Depends(get_cu
         raise HTTPException(status_code=403, detail="Admin only")
     
     banner_doc = banner.model_dump()
-    banner_doc["created_at"] = banner_doc["created_at"].isoformat()
     await db.ad_banners.insert_one(banner_doc)
     return banner
 
@@ -849,9 +3961,6 @@ async def get_pending_teachers(current_user: User = Depends(get_current_user)):
         raise HTTPException(status_code=403, detail="Admin only")
     
     teachers = await db.users.find({"role": "teacher", "is_validated": False}, {"_id": 0, "password": 0}).to_list(100)
-    for teacher in teachers:
-        if isinstance(teacher.get("created_at"), str):
-            teacher["created_at"] = datetime.fromisoformat(teacher["created_at"])
     return teachers
 
 @api_router.put("/admin/validate-teacher/{teacher_id}")
@@ -860,6 +3969,7 @@ async def validate_teacher(teacher_id: str, current_user: User = Depends(get_cur
         raise HTTPException(status_code=403, detail="Admin only")
     
     await db.users.update_one({"id": teacher_id}, {"$set": {"is_validated": True}})
+    await user_cache.invalidate(teacher_id)
     return {"message": "Teacher validated"}
 
 @api_router.get("/admin/stats")
@@ -881,6 +3991,37 @@ async def get_admin_stats(current_user: User = Depends(get_current_user)):
         "total_assignments": total_assignments
     }
 
+@api_router.get("/admin/metrics")
+async def get_runtime_metrics(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin only")
+    
+    return {
+        "caches": {
+            "users": user_cache.stats(),
+            "questions": question_cache.stats(),
+            "analytics": analytics_cache.stats(),
+            "reference_data": reference_cache.stats()
+        },
+        "password_pool": {
+            "workers": PASSWORD_HASH_WORKERS,
+            "max_queue": PASSWORD_HASH_MAX_QUEUE,
+            **password_pool_stats
+        },
+        "topic_views": topic_views.stats(),
+        "notification_fanout": notification_fanout.stats(),
+        "event_broker": event_broker.stats(),
+        "email_outbox": await email_outbox.stats(),
+        "regrade": regrade_runner.stats(),
+        "storage": {"backend": storage.name, **blob_stats},
+        "image_variants": image_variants.stats(),
+        "uploads": {
+            **upload_stats,
+            "max_bytes": UPLOAD_MAX_BYTES,
+            "mb_per_second": round(upload_stats["bytes"] / upload_stats["seconds"] / 1e6, 2) if upload_stats["seconds"] else 0.0
+        }
+    }
+
 # Teacher stats
 @api_router.get("/teacher/stats")
 async def get_teacher_stats(current_user: User = Depends(get_current_user)):
@@ -903,55 +4044,258 @@ async def get_student_stats(current_user: User = Depends(get_current_user)):
     if current_user.role != "student":
         raise HTTPException(status_code=403, detail="Students only")
     
-    # Get assignments completed
-    assignments_in_level = await db.assignments.find({"level_id": current_user.level_id}, {"_id": 0}).to_list(1000)
-    assignment_ids = [a["id"] for a in assignments_in_level]
-    
-    completed_assignments = set()
-    all_answers = await db.answers.find({"student_id": current_user.id}, {"_id": 0}).to_list(10000)
-    for answer in all_answers:
-        if answer["assignment_id"] in assignment_ids:
-            completed_assignments.add(answer["assignment_id"])
+    # Read from the materialized student_progress documents
+    total_assignments = await db.assignments.count_documents({"level_id": current_user.level_id})
+    completed_assignments = await db.student_progress.count_documents({
+        "student_id": current_user.id,
+        "level_id": current_user.level_id,
+        "completed": True
+    })
     
-    # Calculate average score
-    total_score = sum([a.get("score", 0) for a in all_answers if a.get("score") is not None])
-    total_possible = len(all_answers)
+    # Average score over the questions answered (the latest answer to each counts)
+    totals = await db.student_progress.aggregate([
+        {"$match": {"student_id": current_user.id, "answered_count": {"$gt": 0}}},
+        {"$group": {"_id": None, "score": {"$sum": "$score"}, "answered": {"$sum": "$answered_count"}}}
+    ]).to_list(1)
+    total_score = totals[0]["score"] if totals else 0
+    total_possible = totals[0]["answered"] if totals else 0
     avg_score = (total_score / total_possible * 100) if total_possible > 0 else 0
     
     following = await db.follows.count_documents({"follower_id": current_user.id})
     
     return {
-        "total_assignments": len(assignment_ids),
-        "completed_assignments": len(completed_assignments),
+        "total_assignments": total_assignments,
+        "completed_assignments": completed_assignments,
         "average_score": round(avg_score, 2),
         "following": following
     }
 
 # File upload
-@api_router.post("/upload")
-async def upload_file(file: UploadFile = File(...), current_user: User = Depends(get_current_user)):
-    # Save file
-    file_id = str(uuid.uuid4())
-    file_extension = file.filename.split(".")[-1]
-    new_filename = f"{file_id}.{file_extension}"
-    file_path = UPLOAD_DIR / new_filename
+@api_router.post("/upload", openapi_extra=UPLOAD_REQUEST_BODY)
+async def upload_file(request: Request, current_user: User = Depends(get_current_user)):
+    upload = await receive_upload(request)
+    logger.info(
+        "Upload %s: %d bytes in %.2fs (%.1f MB/s)",
+        upload.sha256, upload.size, upload.seconds, upload.throughput() / 1e6
+    )
+    
+    await acquire_blob(
+        upload.sha256, upload.size,
+        store=lambda: storage.put(upload.sha256, upload.path, upload.content_type),
+        discard=upload.discard
+    )
+    try:
+        file_upload = await create_file_record(current_user, upload.filename, upload.content_type, upload.size, upload.sha256)
+    except BaseException:
+        await release_blob(upload.sha256)
+        raise
     
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    return {"file_url": file_upload.file_url, "file_id": file_upload.id, "size": upload.size, "sha256": upload.sha256}
+
+@api_router.post("/upload/direct", response_model=DirectUpload)
+async def start_direct_upload(request_data: DirectUploadRequest, current_user: User = Depends(get_current_user)):
+    """Let the client PUT the file straight to storage, then call /complete."""
+    upload_extension(request_data.filename)
+    if request_data.size > UPLOAD_MAX_BYTES:
+        upload_stats["too_large"] += 1
+        raise HTTPException(status_code=413, detail=f"File too large (max {UPLOAD_MAX_BYTES} bytes)")
+    if not storage.direct_uploads:
+        raise HTTPException(status_code=400, detail="Direct uploads need the s3 storage backend; use POST /api/upload")
     
-    # Save file info to DB
-    file_upload = FileUpload(
-        filename=file.filename,
-        file_url=f"/uploads/{new_filename}",
-        uploaded_by=current_user.id,
-        file_type=file.content_type or "unknown"
+    content_type = request_data.content_type or "application/octet-stream"
+    
+    # Known content: nothing to transfer
+    if await reference_stored_blob(request_data.sha256, request_data.size):
+        file_upload = await create_file_record(current_user, request_data.filename, content_type, request_data.size, request_data.sha256)
+        return DirectUpload(file_id=file_upload.id, file_url=file_upload.file_url)
+    
+    intent = {
+        "id": str(uuid.uuid4()),
+        "user_id": current_user.id,
+        "filename": request_data.filename,
+        "content_type": content_type,
+        "size": request_data.size,
+        "sha256": request_data.sha256,
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=S3_PRESIGN_EXPIRES_SECONDS),
+    }
+    await db.upload_intents.insert_one(intent)
+    presigned = storage.presigned_put(intent["id"], content_type, request_data.size, request_data.sha256)
+    return DirectUpload(upload_id=intent["id"], upload=PresignedRequest(**presigned))
+
+@api_router.post("/upload/direct/{upload_id}/complete")
+async def complete_direct_upload(upload_id: str, current_user: User = Depends(get_current_user)):
+    intent = await db.upload_intents.find_one({"id": upload_id, "user_id": current_user.id}, {"_id": 0})
+    if not intent or intent["expires_at"] < datetime.now(timezone.utc):
+        raise HTTPException(status_code=404, detail="Upload not found or expired")
+    
+    staged = await storage.stat_staged(upload_id)
+    if staged is None:
+        raise HTTPException(status_code=409, detail="File has not been uploaded to storage")
+    # S3 enforces the signed checksum; read the object back on stores that didn't record one
+    sha256 = staged["sha256"] or await storage.hash_staged(upload_id)
+    if staged["size"] != intent["size"] or sha256 != intent["sha256"]:
+        await storage.discard_staged(upload_id)
+        raise HTTPException(status_code=409, detail="Uploaded content does not match its size or SHA-256")
+    
+    await acquire_blob(
+        intent["sha256"], intent["size"],
+        store=lambda: storage.promote(upload_id, intent["sha256"]),
+        discard=lambda: storage.discard_staged(upload_id)
+    )
+    file_upload = await create_file_record(current_user, intent["filename"], intent["content_type"], intent["size"], intent["sha256"])
+    await db.upload_intents.delete_one({"id": upload_id})
+    
+    return {"file_url": file_upload.file_url, "file_id": file_upload.id, "size": intent["size"], "sha256": intent["sha256"]}
+
+@api_router.post("/upload/sessions", response_model=UploadSession)
+async def create_upload_session(request_data: UploadSessionCreate, current_user: User = Depends(get_current_user)):
+    """Start a resumable upload; send the file with PATCH /upload/sessions/{id}."""
+    upload_extension(request_data.filename)
+    if request_data.size > UPLOAD_MAX_BYTES:
+        upload_stats["too_large"] += 1
+        raise HTTPException(status_code=413, detail=f"File too large (max {UPLOAD_MAX_BYTES} bytes)")
+    
+    session = {
+        "id": str(uuid.uuid4()),
+        "user_id": current_user.id,
+        "filename": request_data.filename,
+        "content_type": request_data.content_type or "application/octet-stream",
+        "size": request_data.size,
+        "sha256": request_data.sha256,
+        "offset": 0,
+        "status": "open",
+        "created_at": datetime.now(timezone.utc),
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS),
+    }
+    # Known content: nothing to transfer
+    if request_data.sha256 and await reference_stored_blob(request_data.sha256, request_data.size):
+        file_upload = await create_file_record(current_user, request_data.filename, session["content_type"], request_data.size, request_data.sha256)
+        session.update(offset=request_data.size, status="completed", file_id=file_upload.id, file_url=file_upload.file_url)
+    await db.upload_sessions.insert_one(session)
+    return UploadSession(**session)
+
+@api_router.get("/upload/sessions/{session_id}", response_model=UploadSession)
+async def get_upload_session(session_id: str, response: Response, current_user: User = Depends(get_current_user)):
+    session = await db.upload_sessions.find_one({"id": session_id, "user_id": current_user.id}, {"_id": 0})
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found or expired")
+    response.headers[UPLOAD_OFFSET_HEADER] = str(session["offset"])
+    return session
+
+@api_router.patch("/upload/sessions/{session_id}", response_model=UploadSession, openapi_extra=UPLOAD_CHUNK_REQUEST_BODY)
+async def upload_session_chunk(
+    session_id: str,
+    request: Request,
+    response: Response,
+    upload_offset: int = Header(..., alias=UPLOAD_OFFSET_HEADER, ge=0),
+    current_user: User = Depends(get_current_user)
+):
+    """Append the body at `Upload-Offset`, which must equal the session's offset.
+
+    An empty body at the final offset retries a completion that failed.
+    """
+    session = await claim_upload_session(session_id, current_user.id, upload_offset)
+    try:
+        session["offset"] = await receive_session_chunk(request, session)
+        if session["offset"] == session["size"]:
+            session = await complete_upload_session(session, current_user)
+    finally:
+        await db.upload_sessions.update_one({"id": session_id, "status": "open"}, {"$unset": {"locked_until": ""}})
+    
+    response.headers[UPLOAD_OFFSET_HEADER] = str(session["offset"])
+    return session
+
+@api_router.delete("/upload/sessions/{session_id}")
+async def cancel_upload_session(session_id: str, current_user: User = Depends(get_current_user)):
+    result = await db.upload_sessions.delete_one({"id": session_id, "user_id": current_user.id, "status": "open"})
+    if not result.deleted_count:
+        raise HTTPException(status_code=404, detail="Upload session not found or already complete")
+    await asyncio.get_running_loop().run_in_executor(upload_executor, lambda: upload_session_path(session_id).unlink(missing_ok=True))
+    return {"message": "Upload cancelled"}
+
+@api_router.post("/files/{file_id}/link")
+async def create_file_link(file_id: str, current_user: User = Depends(get_current_user)):
+    """Signed URL for GET /files/{file_id}, valid for FILE_LINK_EXPIRE_SECONDS.
+
+    Links, <video>/<audio> elements and download managers cannot send an
+    Authorization header, so they get the file (ranges and revalidation
+    included) through this URL, whose token works for this file only.
+    """
+    if not await db.files.find_one({"id": file_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="File not found")
+    token = create_access_token(
+        data={"sub": current_user.id, "scope": "file", "file_id": file_id},
+        expires_delta=timedelta(seconds=FILE_LINK_EXPIRE_SECONDS)
     )
+    return {"url": f"/api/files/{file_id}?token={token}", "expires_in": FILE_LINK_EXPIRE_SECONDS}
+
+@api_router.get("/files/{file_id}")
+@api_router.head("/files/{file_id}")
+async def download_file(
+    file_id: str,
+    request: Request,
+    token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    """The file's content; authenticated by the Authorization header or a signed link's `token`"""
+    if token is not None:
+        await resolve_user(token, scope="file", file_id=file_id)
+    elif credentials is not None:
+        await resolve_user(credentials.credentials)
+    else:
+        raise HTTPException(status_code=403, detail="Not authenticated")
+    
+    file_doc = await db.files.find_one({"id": file_id}, {"_id": 0})
+    if not file_doc:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    if file_doc["file_url"].startswith("/uploads/"):
+        # Uploaded before content-addressed storage and not migrated yet
+        legacy_path = UPLOAD_DIR / Path(file_doc["file_url"]).name
+        etag = f'"{file_doc.get("sha256") or file_doc["id"]}"'
+        return serve_stored_file(request, legacy_path, etag, file_doc["file_type"], file_doc["filename"])
+    
+    if storage.direct_uploads:
+        return RedirectResponse(storage.presigned_get(file_doc["sha256"], file_doc["filename"], file_doc["file_type"]), status_code=307)
+    return serve_stored_file(request, storage.path(file_doc["sha256"]), f'"{file_doc["sha256"]}"', file_doc["file_type"], file_doc["filename"])
+
+# Used directly in <img> tags, so no bearer token: the random file id is the
+# capability, as it was for the static /uploads URLs.
+@api_router.get("/images/{file_id}/{variant}")
+@api_router.head("/images/{file_id}/{variant}")
+async def get_image_variant(file_id: str, variant: str, request: Request):
+    if variant not in IMAGE_VARIANTS:
+        raise HTTPException(status_code=404, detail="Unknown image variant")
+    file_doc = await db.files.find_one({"id": file_id}, {"_id": 0, "sha256": 1, "file_type": 1, "filename": 1, "file_url": 1})
+    if not file_doc or file_doc["file_url"].startswith("/uploads/") or not file_doc["file_type"].startswith("image/"):
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    image_format = "WEBP" if "image/webp" in request.headers.get("accept", "") else "JPEG"
+    extension, media_type = IMAGE_FORMATS[image_format]
+    path = await image_variants.get(file_doc["sha256"], variant, image_format)
     
-    file_doc = file_upload.model_dump()
-    file_doc["created_at"] = file_doc["created_at"].isoformat()
-    await db.files.insert_one(file_doc)
+    stem = file_doc["filename"].rsplit(".", 1)[0]
+    response = serve_stored_file(
+        request, path, f'"{file_doc["sha256"]}-{variant}.{extension}"', media_type,
+        f"{stem}-{variant}.{extension}", inline=True
+    )
+    response.headers["Vary"] = "Accept"
+    return response
+
+@api_router.delete("/files/{file_id}")
+async def delete_file(file_id: str, current_user: User = Depends(get_current_user)):
+    file_doc = await db.files.find_one({"id": file_id}, {"_id": 0})
+    if not file_doc:
+        raise HTTPException(status_code=404, detail="File not found")
+    if file_doc["uploaded_by"] != current_user.id and current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if await db.submissions.find_one({"file_urls": file_doc["file_url"]}, {"_id": 1}):
+        raise HTTPException(status_code=409, detail="File is attached to a submission")
     
-    return {"file_url": file_upload.file_url, "file_id": file_upload.id}
+    result = await db.files.delete_one({"id": file_id})
+    if result.deleted_count and not file_doc["file_url"].startswith("/uploads/"):
+        await release_blob(file_doc["sha256"])
+    return {"message": "File deleted"}
 
 # User search
 @api_router.get("/users/search", response_model=List[User])
@@ -961,9 +4305,6 @@ async def search_users(q: str, role: Optional[str] = None):
         query["role"] = role
     
     users = await db.users.find(query, {"_id": 0, "password": 0}).limit(20).to_list(20)
-    for user in users:
-        if isinstance(user.get("created_at"), str):
-            user["created_at"] = datetime.fromisoformat(user["created_at"])
     return users
 
 @api_router.get("/users/{user_id}", response_model=User)
@@ -972,9 +4313,6 @@ async def get_user(user_id: str):
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    if isinstance(user.get("created_at"), str):
-        user["created_at"] = datetime.fromisoformat(user["created_at"])
-    
     return User(**user)
 
 # Include the router in the main app
@@ -986,6 +4324,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, UPLOAD_OFFSET_HEADER],
 )
 
 # Configure logging
@@ -995,6 +4334,58 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def apply_index_manifest():
+    if AUTO_CREATE_INDEXES:
+        await ensure_indexes()
+
+@app.on_event("startup")
+async def start_topic_view_flusher():
+    topic_views.start()
+
+@app.on_event("startup")
+async def start_notification_fanout():
+    notification_fanout.start()
+
+@app.on_event("startup")
+async def start_event_broker():
+    await event_broker.start()
+
+@app.on_event("startup")
+async def start_email_workers():
+    email_outbox.start()
+
+@app.on_event("startup")
+async def start_reference_cache():
+    reference_cache.start()
+
+@app.on_event("startup")
+async def start_user_cache():
+    user_cache.start()
+
+@app.on_event("startup")
+async def start_question_cache():
+    question_cache.start()
+
+@app.on_event("startup")
+async def start_analytics_cache():
+    analytics_cache.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    await notification_fanout.stop(drain_timeout=NOTIFICATION_FANOUT_DRAIN_SECONDS)
+    await reference_cache.stop()
+    await user_cache.stop()
+    await question_cache.stop()
+    await analytics_cache.stop()
+    await event_broker.stop()
+    await email_outbox.stop()
+    await regrade_runner.stop()
+    try:
+        await topic_views.stop()
+    except Exception as e:
+        logger.error("Final topic view flush failed: %s", e)
+    client.close()
+    password_executor.shutdown(wait=False)
+    upload_executor.shutdown(wait=False)
+    image_executor.shutdown(wait=False, cancel_futures=True)
\ No newline at end of file
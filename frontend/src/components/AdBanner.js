@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import api from '../utils/api';
+import api, { imageVariant } from '../utils/api';
 import { Card } from './ui/card';
 import { Mail, Phone, ExternalLink } from 'lucide-react';
 
@@ -42,7 +42,7 @@ export const AdBanner = () => {
       <div className="flex items-center gap-4">
         {currentBanner.image_url && (
           <img 
-            src={currentBanner.image_url} 
+            src={imageVariant(currentBanner.image_url, 'square-192')} 
             alt={currentBanner.title}
             className="w-20 h-20 object-cover rounded-lg"
             data-testid="ad-banner-image"
@@ -12,7 +12,7 @@ import {
   DropdownMenuTrigger,
 } from './ui/dropdown-menu';
 import { Sheet, SheetContent, SheetTrigger } from './ui/sheet';
-import api from '../utils/api';
+import api, { imageVariant, openEventStream } from '../utils/api';
 
 export const Navbar = () => {
   const { user, logout } = useAuth();
@@ -24,8 +24,12 @@ export const Navbar = () => {
   useEffect(() => {
     if (user) {
       fetchUnreadCount();
-      const interval = setInterval(fetchUnreadCount, 30000);
-      return () => clearInterval(interval);
+      const source = openEventStream();
+      // Resync after every (re)connection, then count pushed notifications
+      source.onopen = fetchUnreadCount;
+      source.addEventListener('notification', () => setUnreadCount((count) => count + 1));
+      source.addEventListener('unread_count', (event) => setUnreadCount(JSON.parse(event.data).count));
+      return () => source.close();
     }
   }, [user]);
 
@@ -141,7 +145,7 @@ export const Navbar = () => {
                   <DropdownMenuTrigger asChild>
                     <Button variant="ghost" size="icon" data-testid="user-menu">
                       {user.avatar_url ? (
-                        <img src={user.avatar_url} alt={user.name} className="w-8 h-8 rounded-full" />
+                        <img src={imageVariant(user.avatar_url, 'square-64')} alt={user.name} className="w-8 h-8 rounded-full" />
                       ) : (
                         <User className="w-5 h-5" />
                       )}
@@ -8,7 +8,7 @@ import { Switch } from '../components/ui/switch';
 import { Label } from '../components/ui/label';
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '../components/ui/tabs';
 import { Bell, Check } from 'lucide-react';
-import api from '../utils/api';
+import api, { openEventStream } from '../utils/api';
 import { toast } from 'sonner';
 import i18n from '../i18n';
 
@@ -20,6 +20,12 @@ export const Notifications = () => {
 
   useEffect(() => {
     fetchData();
+    const source = openEventStream();
+    source.addEventListener('notification', (event) => {
+      const notification = JSON.parse(event.data);
+      setNotifications((current) => [notification, ...current]);
+    });
+    return () => source.close();
   }, []);
 
   const fetchData = async () => {
@@ -8,7 +8,7 @@ import { Input } from '../components/ui/input';
 import { Label } from '../components/ui/label';
 import { Textarea } from '../components/ui/textarea';
 import { User, Users, UserPlus, UserMinus } from 'lucide-react';
-import api from '../utils/api';
+import api, { imageVariant } from '../utils/api';
 import { toast } from 'sonner';
 import i18n from '../i18n';
 
@@ -109,7 +109,7 @@ export const Profile = () => {
             <div className="flex items-center gap-6">
               <div className="w-24 h-24 bg-gradient-to-br from-emerald-500 to-teal-600 rounded-full flex items-center justify-center">
                 {user.avatar_url ? (
-                  <img src={user.avatar_url} alt={user.name} className="w-24 h-24 rounded-full" />
+                  <img src={imageVariant(user.avatar_url, 'square-192')} alt={user.name} className="w-24 h-24 rounded-full" />
                 ) : (
                   <User className="w-12 h-12 text-white" />
                 )}
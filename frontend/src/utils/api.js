@@ -29,4 +29,67 @@ api.interceptors.response.use(
   }
 );
 
+// Live notifications and forum replies (Server-Sent Events). EventSource cannot
+// send headers, so each connection uses a short-lived token from
+// POST /events/token in the query string instead of the access token. Once that
+// token has expired the browser's own reconnection is refused, so a closed
+// stream reconnects with a fresh one. Returns { onopen, addEventListener, close }.
+export const openEventStream = (params = {}) => {
+  const listeners = [];
+  let source = null;
+  let retryTimer = null;
+  let closed = false;
+
+  const stream = {
+    onopen: null,
+    addEventListener: (type, listener) => {
+      listeners.push([type, listener]);
+      if (source) source.addEventListener(type, listener);
+    },
+    close: () => {
+      closed = true;
+      clearTimeout(retryTimer);
+      if (source) source.close();
+    }
+  };
+
+  const retry = () => {
+    if (!closed) retryTimer = setTimeout(connect, 5000);
+  };
+
+  const connect = async () => {
+    try {
+      const response = await api.post('/events/token');
+      if (closed) return;
+      const query = new URLSearchParams({ token: response.data.token, ...params });
+      source = new EventSource(`${API}/events?${query.toString()}`);
+      source.onopen = (event) => stream.onopen && stream.onopen(event);
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) retry();
+      };
+      listeners.forEach(([type, listener]) => source.addEventListener(type, listener));
+    } catch (error) {
+      retry();
+    }
+  };
+
+  connect();
+  return stream;
+};
+
+// Signed URL for an uploaded file (/api/files/{id}) that works without the
+// Authorization header: for <a download>, <video>/<audio> and download managers.
+export const signedFileUrl = async (url) => {
+  const match = url && url.match(/\/api\/files\/([0-9a-f-]+)$/);
+  if (!match) return url;
+  const response = await api.post(`/files/${match[1]}/link`);
+  return `${BACKEND_URL}${response.data.url}`;
+};
+
+// Resized copy of an uploaded image (/api/files/{id}); other URLs are returned as is.
+export const imageVariant = (url, variant) => {
+  const match = url && url.match(/\/api\/files\/([0-9a-f-]+)$/);
+  return match ? `${API}/images/${match[1]}/${variant}` : url;
+};
+
 export default api;
\ No newline at end of file
@@ -0,0 +1,68 @@
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+from pydantic import ValidationError
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "kaay_jang_test")
+
+import server  # noqa: E402
+
+def expected(model, docs):
+    return b"[" + b",".join(model(**doc).model_dump_json().encode() for doc in docs) + b"]"
+
+def post(**fields):
+    doc = {
+        "id": "post-1",
+        "topic_id": "topic-1",
+        "author_id": "user-1",
+        "author_name": "Élève 1",
+        "author_role": "student",
+        "content": "Bonjour",
+        "created_at": datetime(2024, 5, 1, 12, 0, 0, 123456, tzinfo=timezone.utc),
+    }
+    doc.update(fields)
+    return doc
+
+def submission(**fields):
+    doc = {
+        "id": "submission-1",
+        "assignment_id": "assignment-1",
+        "student_id": "user-1",
+        "student_name": "Élève 1",
+        "content": "Devoir",
+        "file_urls": ["/api/files/abc"],
+        "submitted_at": datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc),
+        "status": "graded",
+        "grade": 15,
+        "graded_at": datetime(2024, 5, 2, 8, 30, tzinfo=timezone.utc),
+    }
+    doc.update(fields)
+    return doc
+
+@pytest.mark.parametrize("model, docs", [
+    (server.Post, [post(), post(id="post-2")]),
+    (server.Submission, [submission(), submission(id="submission-2", grade=None, graded_at=None, status="submitted")]),
+])
+def test_migrated_documents_match_model_dump(model, docs):
+    assert server.compile_list_encoder(model)(docs) == expected(model, docs)
+
+@pytest.mark.parametrize("model, docs", [
+    # Dates not yet converted by migrate_datetimes.py
+    (server.Post, [post(), post(id="post-2", created_at="2024-05-01T12:00:00.123456+00:00")]),
+    (server.Submission, [submission(submitted_at="2024-05-01T12:00:00+00:00", graded_at="2024-05-02T08:30:00")]),
+    # A grade stored as a numeric string
+    (server.Submission, [submission(grade="15")]),
+])
+def test_legacy_documents_match_model_dump(model, docs):
+    assert server.compile_list_encoder(model)(docs) == expected(model, docs)
+
+def test_missing_required_field_fails_validation():
+    doc = post()
+    del doc["content"]
+    with pytest.raises(ValidationError):
+        server.compile_list_encoder(server.Post)([doc])